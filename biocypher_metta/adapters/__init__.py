@@ -1,11 +1,63 @@
 # Author Abdulrahman S. Omar <xabush@singularitynet.io>
 
+# provenance is controlled by add_provenance, a projection only drops these if they are excluded explicitly
+PROVENANCE_PROPERTIES = ["source", "source_url"]
+
 class Adapter:
     def __init__(self, write_properties, add_provenance):
         self.write_properties = write_properties
         self.add_provenance = add_provenance
+        self.include_properties = None
+        self.exclude_properties = None
+
     def get_nodes(self):
         pass
 
     def get_edges(self):
-        pass
\ No newline at end of file
+        pass
+
+    def set_property_projection(self, include=None, exclude=None):
+        """
+        Restrict the properties the adapter writes, set from the properties entry of adapters_config.yaml.
+        Nested properties are selected with dotted names, e.g. annotation.cadd_phred
+        :param include: list of the properties to write, None for all of them
+        :param exclude: list of properties not to write
+        """
+        self.include_properties = set(include) if include is not None else None
+        self.exclude_properties = set(exclude) if exclude is not None else None
+
+    def needs_property(self, name):
+        """
+        Check whether a property (dotted name for nested properties) is written. Adapters use this to
+        skip parsing and converting fields that would be dropped anyway.
+        """
+        if not self.write_properties:
+            return False
+        parts = name.split(".")
+        prefixes = [".".join(parts[:i]) for i in range(1, len(parts) + 1)]
+        if self.exclude_properties is not None and any(p in self.exclude_properties for p in prefixes):
+            return False
+        if self.include_properties is None or name in PROVENANCE_PROPERTIES:
+            return True
+        # included itself, through a parent, or it holds an included nested property
+        return any(p in self.include_properties for p in prefixes) or \
+            any(i.startswith(name + ".") for i in self.include_properties)
+
+    def project_properties(self, properties, prefix=""):
+        projected = {}
+        for k, v in properties.items():
+            name = prefix + k
+            if not self.needs_property(name):
+                continue
+            if isinstance(v, dict):
+                v = self.project_properties(v, name + ".")
+            projected[k] = v
+        return projected
+
+    def project(self, records):
+        """
+        Apply the property projection to the records of get_nodes/get_edges, for the properties the
+        adapter doesn't check with needs_property itself
+        """
+        for record in records:
+            yield (*record[:-1], self.project_properties(record[-1]))
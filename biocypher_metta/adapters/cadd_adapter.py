@@ -53,9 +53,11 @@ class CADDAdapter(Adapter):
                                 'rsid': rsid,
                                 'ref': ref,
                                 'alt': alt,
-                                'raw_cadd_score': float(row[5]),
-                                'phred_score': float(row[6])
                             }
+                            if self.needs_property('raw_cadd_score'):
+                                _props['raw_cadd_score'] = float(row[5])
+                            if self.needs_property('phred_score'):
+                                _props['phred_score'] = float(row[6])
                             if self.add_provenance:
                                 _props['source'] = self.source
                                 _props['source_url'] = self.source_url
@@ -88,7 +88,7 @@ class FavorAdapter(Adapter):
         exclude = ["chromosome", "start_position", "ref_vcf", "alt_vcf"]
 
         for k, v in FIELDS.items():
-            if k not in exclude:
+            if k not in exclude and self.needs_property(f"annotation.{k}"):
                 annotations[k] = self.convert_freq_value(row[v])
 
         return annotations
@@ -119,8 +119,9 @@ class FavorAdapter(Adapter):
                             # 'rsid': [row[FIELDS["rsid"], #TODO uncomment when rsid is available
                             'ref': row[FIELDS["ref_vcf"]],
                             'alt': row[FIELDS["alt_vcf"]],
-                            'annotation': self.parse_annotation(row),
                         }
+                        if self.needs_property('annotation'):
+                            props['annotation'] = self.parse_annotation(row)
                         if self.add_provenance:
                             props['source'] = self.source
                             props['source_url'] = self.source_url
@@ -1,11 +1,7 @@
 from inspect import getfullargspec
 import hashlib
 from math import log10, floor, isinf
-from liftover import get_lifter
-
-import hgvs.dataproviders.uta
-from hgvs.easy import parser
-from hgvs.extras.babelfish import Babelfish
+import numpy as np
 
 ALLOWED_ASSEMBLIES = ['GRCh38']
 _lifters = {}
@@ -33,6 +29,314 @@ def build_variant_id(chr, pos_first_ref_base, ref_seq, alt_seq, assembly='GRCh38
     # return hashlib.sha256(key.encode()).hexdigest()
     return key
 
+# Packed 64-bit variant keys. A variant ID of build_variant_id with alleles of up to 4 bases (ACGT, all upper
+# or all lower case) is packed losslessly, ordered by chromosome and position:
+#   bit 63      0 (1 marks a hashed key)
+#   bits 59-62  tag, free for the caller (e.g. the dedup label), 0 in plain keys
+#   bits 54-58  chromosome, 1-22, X=23, Y=24, M=25
+#   bits 25-53  position
+#   bit 24      chr prefix, bit 23 lower case alleles
+#   bits 21-22  ref length - 1, bits 19-20 alt length - 1
+#   bits 3-18   ref then alt bases, 2 bits each from the top
+#   bits 0-2    assembly, index in ALLOWED_ASSEMBLIES + 1
+# Other IDs (long alleles, indels with '-', other formats) get a hashed key with bit 63 set, see variant_key.
+VARIANT_KEY_HASHED = 1 << 63
+VARIANT_KEY_TAG_SHIFT = 59
+_VARIANT_CHROMOSOMES = [str(i) for i in range(1, 23)] + ['x', 'y', 'm']
+_VARIANT_CHROMOSOME_CODES = {c: i + 1 for i, c in enumerate(_VARIANT_CHROMOSOMES)}
+_BASES = 'ACGT'
+
+
+def _allele_codes():
+    codes = {}
+    for length in range(1, 5):
+        for n in range(4 ** length):
+            allele = ''.join(_BASES[(n >> (2 * (length - 1 - i))) & 3] for i in range(length))
+            codes[allele] = (n, False)
+            codes[allele.lower()] = (n, True)
+    return codes
+
+
+# allele -> (2-bit code, lower case)
+_ALLELE_CODES = _allele_codes()
+_MAX_POSITION = (1 << 29) - 1
+
+
+def _variant_fields(variant_id):
+    """
+    :return: (chromosome code, position, flags, lengths, bases, assembly) of the packed key, None if the ID
+    can't be packed losslessly
+    """
+    parts = variant_id.split('_')
+    if len(parts) != 5:
+        return None
+    chr, pos, ref, alt, assembly = parts
+    prefixed = chr.startswith('chr')
+    chr_code = _VARIANT_CHROMOSOME_CODES.get(chr[3:] if prefixed else chr)
+    ref_code = _ALLELE_CODES.get(ref)
+    alt_code = _ALLELE_CODES.get(alt)
+    if chr_code is None or ref_code is None or alt_code is None or ref_code[1] != alt_code[1] \
+            or assembly not in ALLOWED_ASSEMBLIES or not pos.isdigit() or pos != str(int(pos)) \
+            or int(pos) > _MAX_POSITION:
+        return None
+    bases = ((ref_code[0] << (2 * len(alt))) | alt_code[0]) << (2 * (8 - len(ref) - len(alt)))
+    return (chr_code, int(pos), (prefixed << 1) | ref_code[1], ((len(ref) - 1) << 2) | (len(alt) - 1), bases,
+            ALLOWED_ASSEMBLIES.index(assembly) + 1)
+
+
+def pack_variant_id(variant_id):
+    """
+    Pack a variant ID built by build_variant_id into a 64-bit key.
+    :return: the key, or None if the ID can't be packed losslessly
+    """
+    fields = _variant_fields(variant_id)
+    if fields is None:
+        return None
+    chr_code, pos, flags, lengths, bases, assembly = fields
+    return (chr_code << 54) | (pos << 25) | (flags << 23) | (lengths << 19) | (bases << 3) | assembly
+
+
+def unpack_variant_id(key):
+    """
+    :return: the variant ID of a packed key (the tag is ignored), None for hashed keys
+    """
+    key = int(key)
+    chr_code = (key >> 54) & 0x1f
+    assembly = key & 7
+    if key & VARIANT_KEY_HASHED or not 0 < chr_code <= len(_VARIANT_CHROMOSOMES) \
+            or not 0 < assembly <= len(ALLOWED_ASSEMBLIES):
+        return None
+    ref_length = ((key >> 21) & 3) + 1
+    alt_length = ((key >> 19) & 3) + 1
+    bases = ((key >> 3) & 0xffff) >> (2 * (8 - ref_length - alt_length))
+
+    def allele(code, length):
+        allele = ''.join(_BASES[(code >> (2 * (length - 1 - i))) & 3] for i in range(length))
+        return allele.lower() if (key >> 23) & 1 else allele
+
+    chr = ('chr' if (key >> 24) & 1 else '') + _VARIANT_CHROMOSOMES[chr_code - 1]
+    return f"{chr}_{(key >> 25) & _MAX_POSITION}_{allele(bases >> (2 * alt_length), ref_length)}_" \
+           f"{allele(bases & ((1 << (2 * alt_length)) - 1), alt_length)}_{ALLOWED_ASSEMBLIES[assembly - 1]}"
+
+
+def variant_position(key):
+    """
+    :return: (chromosome, position) of a packed key, the chromosome without chr prefix (1-22, x, y, m)
+    """
+    return _VARIANT_CHROMOSOMES[((key >> 54) & 0x1f) - 1], (key >> 25) & _MAX_POSITION
+
+
+def variant_key(id):
+    """
+    64-bit key of any ID: the packed key of variant IDs, otherwise a hash with bit 63 set. Hashed keys of
+    different IDs can collide, see VariantKeyTable.
+    """
+    key = pack_variant_id(id)
+    if key is None:
+        key = VARIANT_KEY_HASHED | (int.from_bytes(hashlib.blake2b(id.encode(), digest_size=8).digest(), 'little') >> 1)
+    return key
+
+
+def _lookup(table, values):
+    """
+    :return: (index of every value in the sorted table, bool array, True where the value is in it)
+    """
+    i = np.searchsorted(table, values)
+    i[i == len(table)] = 0
+    return i, table[i] == values
+
+
+def _as_chars(strings, width):
+    """
+    :return: uint8 matrix of the ASCII characters of strings, one row per string padded with 0
+    """
+    return np.ascontiguousarray(np.asarray(strings, dtype=f'S{width}')).view(np.uint8).reshape(-1, width)
+
+
+def _as_ints(chars):
+    """
+    :return: the rows of a character matrix of at most 8 columns as big endian uint64, which sort like the strings
+    """
+    padded = np.zeros((len(chars), 8), dtype=np.uint8)
+    padded[:, :chars.shape[1]] = chars
+    return padded.view('>u8').ravel().astype(np.uint64)
+
+
+def _gather(chars, starts, lengths, width):
+    """
+    :return: character matrix of the fields [starts, starts + lengths) of the rows of chars, padded with 0
+    """
+    columns = np.arange(width)
+    values = np.take_along_axis(chars, np.minimum(starts[:, None] + columns, chars.shape[1] - 1), axis=1)
+    values[columns >= lengths[:, None]] = 0
+    return values
+
+
+def _scatter(chars, offsets, values, lengths):
+    """
+    Write the first lengths characters of the rows of the character matrix values at offsets into chars
+    """
+    columns = np.arange(values.shape[1])
+    mask = columns < lengths[:, None]
+    rows = np.broadcast_to(np.arange(len(chars))[:, None], mask.shape)
+    chars[rows[mask], (offsets[:, None] + columns)[mask]] = values[mask]
+
+
+# sorted tables of the fields of variant IDs, as _as_ints of their characters
+_CHR_NAMES = sorted(p + c for p in ('', 'chr') for c in _VARIANT_CHROMOSOMES)
+_CHR_NAME_CODES = np.array([_VARIANT_CHROMOSOME_CODES[c.removeprefix('chr')] for c in _CHR_NAMES], dtype=np.uint64)
+_CHR_NAMES = _as_ints(_as_chars(_CHR_NAMES, 5))
+_ALLELES = sorted(_ALLELE_CODES)
+_ALLELE_NAME_CODES = np.array([_ALLELE_CODES[a][0] for a in _ALLELES], dtype=np.uint64)
+_ALLELE_NAME_LOWER = np.array([_ALLELE_CODES[a][1] for a in _ALLELES])
+_ALLELES = _as_ints(_as_chars(_ALLELES, 4))
+_ASSEMBLY_WIDTH = max(len(a) for a in ALLOWED_ASSEMBLIES)
+_ASSEMBLIES = sorted(ALLOWED_ASSEMBLIES)
+_ASSEMBLY_CODES = np.array([ALLOWED_ASSEMBLIES.index(a) + 1 for a in _ASSEMBLIES], dtype=np.uint64)
+_ASSEMBLIES = _as_ints(_as_chars(_ASSEMBLIES, _ASSEMBLY_WIDTH))
+# the fields by their codes: chromosome names by prefixed * 32 + code, alleles by _ALLELE_OFFSETS[length - 1] + code
+_CHR_BY_CODE = _as_chars([('chr' if prefixed else '') + (_VARIANT_CHROMOSOMES[code - 1] if 0 < code <= 25 else '')
+                          for prefixed in (0, 1) for code in range(32)], 5)
+_ALLELE_OFFSETS = np.array([0, 4, 20, 84])
+_ALLELE_BY_CODE = _as_chars(sorted((a for a in _ALLELE_CODES if a.isupper()),
+                                   key=lambda a: (len(a), _ALLELE_CODES[a][0])), 4)
+_ASSEMBLY_BY_CODE = _as_chars([''] + ALLOWED_ASSEMBLIES, _ASSEMBLY_WIDTH)
+
+
+def encode_variant_ids(ids):
+    """
+    Vectorized pack_variant_id, checked against it in tests/test_variant_keys.py: the IDs are converted to a
+    character matrix (one row per ID), cut at their underscores and the fields looked up in sorted tables as
+    integers, without a python loop over the IDs.
+    :param ids: sequence or array of the IDs, as str or ASCII bytes
+    :return: (uint64 array of keys, bool array, True where the ID was packed; the keys of the others are 0)
+    """
+    n = len(ids)
+    keys = np.zeros(n, dtype=np.uint64)
+    packed = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keys, packed
+    try:
+        chars = np.ascontiguousarray(np.asarray(ids, dtype=np.bytes_))
+    except UnicodeEncodeError:
+        # variant IDs are ASCII, leave out the others
+        ascii = np.array([id.isascii() for id in ids])
+        chars = np.ascontiguousarray(np.asarray([id if a else '' for id, a in zip(ids, ascii)], dtype=np.bytes_))
+    width = chars.dtype.itemsize
+    chars = chars.view(np.uint8).reshape(n, width)
+    # chr_pos_ref_alt_assembly, exactly four underscores; starts/lengths hold the five fields of every row
+    underscores = chars == ord('_')
+    rows = np.flatnonzero(underscores.sum(axis=1) == 4)
+    chars = chars[rows]
+    separators = np.nonzero(underscores[rows])[1].reshape(-1, 4)
+    ends = np.concatenate([separators, (chars != 0).sum(axis=1)[:, None]], axis=1)
+    starts = np.concatenate([np.zeros((len(rows), 1), dtype=ends.dtype), separators + 1], axis=1)
+    lengths = ends - starts
+
+    # the chromosome, alleles and assembly must be in their tables, the alleles of the same case
+    chr_i, valid = _lookup(_CHR_NAMES, _as_ints(_gather(chars, starts[:, 0], lengths[:, 0], 5)))
+    ref_i, ref_found = _lookup(_ALLELES, _as_ints(_gather(chars, starts[:, 2], lengths[:, 2], 4)))
+    alt_i, alt_found = _lookup(_ALLELES, _as_ints(_gather(chars, starts[:, 3], lengths[:, 3], 4)))
+    assembly_i, assembly_found = _lookup(_ASSEMBLIES,
+                                         _as_ints(_gather(chars, starts[:, 4], lengths[:, 4], _ASSEMBLY_WIDTH)))
+    valid &= (lengths[:, 0] <= 5) & ref_found & (lengths[:, 2] <= 4) & alt_found & (lengths[:, 3] <= 4) \
+        & assembly_found & (lengths[:, 4] <= _ASSEMBLY_WIDTH) & (_ALLELE_NAME_LOWER[ref_i] == _ALLELE_NAME_LOWER[alt_i])
+    # the position: 1 to 9 digits without leading zeros, at most _MAX_POSITION
+    digits = _gather(chars, starts[:, 1], lengths[:, 1], 9).astype(np.int64) - ord('0')
+    in_position = np.arange(9) < lengths[:, 1, None]
+    valid &= (lengths[:, 1] >= 1) & (lengths[:, 1] <= 9) & ((lengths[:, 1] == 1) | (digits[:, 0] != 0)) \
+        & np.all(~in_position | ((digits >= 0) & (digits <= 9)), axis=1)
+    powers = 10 ** np.maximum(lengths[:, 1, None] - 1 - np.arange(9), 0)
+    positions = np.where(in_position, digits * powers, 0).sum(axis=1)
+    valid &= positions <= _MAX_POSITION
+
+    # the bit fields of pack_variant_id, a chromosome name longer than 3 characters has the chr prefix
+    ref_lengths = np.where(valid, lengths[:, 2], 1).astype(np.uint64)
+    alt_lengths = np.where(valid, lengths[:, 3], 1).astype(np.uint64)
+    flags = ((lengths[:, 0] > 3).astype(np.uint64) << np.uint64(1)) | _ALLELE_NAME_LOWER[ref_i].astype(np.uint64)
+    field_lengths = ((ref_lengths - np.uint64(1)) << np.uint64(2)) | (alt_lengths - np.uint64(1))
+    bases = ((_ALLELE_NAME_CODES[ref_i] << (np.uint64(2) * alt_lengths)) | _ALLELE_NAME_CODES[alt_i]) << \
+        (np.uint64(2) * (np.uint64(8) - ref_lengths - alt_lengths))
+    row_keys = (_CHR_NAME_CODES[chr_i] << np.uint64(54)) | (positions.astype(np.uint64) << np.uint64(25)) | \
+        (flags << np.uint64(23)) | (field_lengths << np.uint64(19)) | (bases << np.uint64(3)) | \
+        _ASSEMBLY_CODES[assembly_i]
+    keys[rows[valid]] = row_keys[valid]
+    packed[rows[valid]] = True
+    return keys, packed
+
+
+def decode_variant_keys(keys):
+    """
+    Vectorized unpack_variant_id, checked against it in tests/test_variant_keys.py: the fields are looked up in
+    tables by their codes and written into a character matrix (one row per ID), without a python loop over the
+    keys.
+    :return: list of the variant IDs of the keys, None for hashed keys
+    """
+    keys = np.asarray(keys, dtype=np.uint64)
+    n = len(keys)
+    if n == 0:
+        return []
+    chr_codes = ((keys >> np.uint64(54)) & np.uint64(0x1f)).astype(np.int64)
+    assemblies = (keys & np.uint64(7)).astype(np.int64)
+    valid = ~(keys >> np.uint64(63)).astype(bool) & (chr_codes > 0) & (chr_codes <= len(_VARIANT_CHROMOSOMES)) \
+        & (assemblies > 0) & (assemblies <= len(ALLOWED_ASSEMBLIES))
+    assemblies[~valid] = 0
+    prefixed = ((keys >> np.uint64(24)) & np.uint64(1)).astype(np.int64)
+    lower = ((keys >> np.uint64(23)) & np.uint64(1)).astype(bool)
+    ref_lengths = ((keys >> np.uint64(21)) & np.uint64(3)).astype(np.int64) + 1
+    alt_lengths = ((keys >> np.uint64(19)) & np.uint64(3)).astype(np.int64) + 1
+    alleles = ((keys >> np.uint64(3)) & np.uint64(0xffff)).astype(np.int64) >> (2 * (8 - ref_lengths - alt_lengths))
+    ref = _ALLELE_BY_CODE[_ALLELE_OFFSETS[ref_lengths - 1] + (alleles >> (2 * alt_lengths))]
+    alt = _ALLELE_BY_CODE[_ALLELE_OFFSETS[alt_lengths - 1] + (alleles & ((1 << (2 * alt_lengths)) - 1))]
+    # lower case letters are 32 above upper case ones
+    ref = ref + (lower[:, None] & (ref != 0)).astype(np.uint8) * 32
+    alt = alt + (lower[:, None] & (alt != 0)).astype(np.uint8) * 32
+    # the decimal digits of the positions, without leading zeros
+    positions = ((keys >> np.uint64(25)) & np.uint64(_MAX_POSITION)).astype(np.int64)
+    position_lengths = np.maximum(np.floor(np.log10(np.maximum(positions, 1))).astype(np.int64) + 1, 1)
+    digits = (positions[:, None] // 10 ** np.maximum(position_lengths[:, None] - 1 - np.arange(9), 0) % 10
+              + ord('0')).astype(np.uint8)
+    chr = _CHR_BY_CODE[prefixed * 32 + chr_codes]
+    fields = [(chr, (chr != 0).sum(axis=1)), (digits, position_lengths), (ref, ref_lengths), (alt, alt_lengths),
+              (_ASSEMBLY_BY_CODE[assemblies], (_ASSEMBLY_BY_CODE[assemblies] != 0).sum(axis=1))]
+    # join the fields with underscores
+    chars = np.zeros((n, 5 + 9 + 4 + 4 + _ASSEMBLY_WIDTH + 4), dtype=np.uint8)
+    offsets = np.zeros(n, dtype=np.int64)
+    for i, (values, lengths) in enumerate(fields):
+        if i > 0:
+            chars[np.arange(n), offsets] = ord('_')
+            offsets += 1
+        _scatter(chars, offsets, values, lengths)
+        offsets += lengths
+    ids = chars.view(f'S{chars.shape[1]}').ravel().astype(str).astype(object)
+    ids[~valid] = None
+    return ids.tolist()
+
+
+class VariantKeyTable:
+    """
+    Collision-safe 64-bit keys: variant IDs are packed, every other ID gets a hashed key that is remembered
+    with its ID, a hash already taken by a different ID is probed forward. The table only holds the IDs
+    that couldn't be packed.
+    """
+
+    def __init__(self):
+        self.hashed = {}
+
+    def key(self, id):
+        key = variant_key(id)
+        if key & VARIANT_KEY_HASHED:
+            while self.hashed.setdefault(key, id) != id:
+                key = VARIANT_KEY_HASHED | ((key + 1) & (VARIANT_KEY_HASHED - 1))
+        return key
+
+    def id(self, key):
+        key = int(key)
+        if key & VARIANT_KEY_HASHED:
+            return self.hashed.get(key)
+        return unpack_variant_id(key)
+
+
 @assembly_check
 def build_regulatory_region_id(chr, pos_start, pos_end, assembly='GRCh38'):
     # return '{}_{}_{}_{}_{}'.format(class_name, chr, pos_start, pos_end, assembly)
@@ -43,6 +347,10 @@ def build_regulatory_region_id(chr, pos_start, pos_end, assembly='GRCh38'):
 def build_variant_id_from_hgvs(hgvs_id, validate=True, assembly='GRCh38'):
     # translate hgvs naming to vcf format e.g. NC_000003.12:g.183917980C>T -> 3_183917980_C_T
     if validate:  # use tools from hgvs, which corrects ref allele if it's wrong
+        # imported here, helpers is also used by the writers (variant keys) which don't need hgvs
+        import hgvs.dataproviders.uta
+        from hgvs.easy import parser
+        from hgvs.extras.babelfish import Babelfish
         # got connection timed out error occasionally, could add a retry function
         hdp = hgvs.dataproviders.uta.connect()
         babelfish38 = Babelfish(hdp, assembly_name=assembly)
@@ -162,6 +470,7 @@ def convert_genome_reference(chr, pos, from_build='hg19', to_build='hg38'):
 
     # Initialize the lifter for the specified build conversion if not already cached
     if lifter_key not in _lifters:
+        from liftover import get_lifter
         _lifters[lifter_key] = get_lifter(from_build, to_build)
 
     # Convert the chromosome identifier to a format compatible with the liftover library
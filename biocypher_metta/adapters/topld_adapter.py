@@ -56,9 +56,10 @@ class TopLDAdapter(Adapter):
                     if self.write_properties:
                         props = {
                             'r2': r2_score,
-                            'd_prime': float(row[TopLDAdapter.INDEX['Dprime']]),
                             'ancestry': self.ancestry
                         }
+                        if self.needs_property('d_prime'):
+                            props['d_prime'] = float(row[TopLDAdapter.INDEX['Dprime']])
                         if self.add_provenance:
                             props['source'] = self.source
                             props['source_url'] = self.source_url
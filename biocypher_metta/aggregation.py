@@ -0,0 +1,133 @@
+import itertools
+import pathlib
+import pickle
+import shutil
+import tempfile
+from biocypher._logger import logger
+from biocypher_metta.sorting import ExternalSorter, _RECORD_BYTES
+
+# sort: group the edges with an external sort, the output is ordered by (source, target, label)
+# hash: group the edges in a hash table, partitioned to disk when it outgrows the memory budget
+AGGREGATION_METHODS = ["sort", "hash"]
+
+
+def edge_key(edge):
+    source_id, target_id, label, _ = edge
+    return str(source_id), str(target_id), label
+
+
+class EdgeAggregator:
+    """
+    Collapses the edges with the same (source, target, label) into one edge. A property with the same value
+    in all edges of a group keeps that value, the others become lists with one value per merged edge, in
+    input order, so the lists of several properties stay aligned (e.g. the tissue, slope and p-value of
+    the eQTLs of a variant-gene pair). An edge without the property has None at its position, written as ()
+    by MeTTaWriter and [] by PrologWriter. With distinct the lists hold the distinct values instead, without
+    None (e.g. the evidence codes of a GO annotation).
+    """
+
+    def __init__(self, method="sort", memory_mb=1024, spill_dir=None, distinct=False, partitions=16, max_depth=4):
+        if method not in AGGREGATION_METHODS:
+            raise ValueError('Invalid aggregation method. Allowed values: ' +
+                             ','.join(AGGREGATION_METHODS))
+        self.method = method
+        self.memory_mb = memory_mb
+        self.max_in_memory = max(1, memory_mb * 1024 * 1024 // _RECORD_BYTES)
+        self.spill_dir = spill_dir
+        self.distinct = distinct
+        self.partitions = partitions
+        self.max_depth = max_depth
+
+    def aggregate(self, edges):
+        """
+        :return: generator of the aggregated edges
+        """
+        if self.method == "sort":
+            groups = self._sort_groups(edges)
+        else:
+            groups = self._hash_groups(((edge_key(edge), self._state(edge)) for edge in edges), depth=0)
+        merged = 0
+        for key, (n, properties) in groups:
+            merged += n - 1
+            yield (*key, self._finish(n, properties))
+        logger.info(f"Aggregated {merged} repeated edges")
+
+    @staticmethod
+    def _state(edge):
+        # number of merged edges, property -> one value per merged edge
+        return 1, {k: [v] for k, v in edge[-1].items()}
+
+    @staticmethod
+    def _merge(state, other):
+        n, properties = state
+        m, other_properties = other
+        for k in properties.keys() - other_properties.keys():
+            properties[k].extend([None] * m)
+        for k, values in other_properties.items():
+            properties.setdefault(k, [None] * n).extend(values)
+        return n + m, properties
+
+    def _finish(self, n, properties):
+        if n == 1:
+            return {k: values[0] for k, values in properties.items()}
+        result = {}
+        for k, values in properties.items():
+            if all(v == values[0] for v in values):
+                result[k] = values[0]
+            elif self.distinct:
+                distinct = []
+                for v in values:
+                    for e in (v if isinstance(v, list) else [v]):
+                        if e is not None and e not in distinct:
+                            distinct.append(e)
+                result[k] = distinct
+            else:
+                result[k] = values
+        return result
+
+    def _sort_groups(self, edges):
+        sorter = ExternalSorter(memory_mb=self.memory_mb, spill_dir=self.spill_dir)
+        for key, group in itertools.groupby(sorter.sort(edges, key=edge_key), key=edge_key):
+            state = None
+            for edge in group:
+                state = self._state(edge) if state is None else self._merge(state, self._state(edge))
+            yield key, state
+
+    def _hash_groups(self, states, depth):
+        """
+        Groups the (key, state) pairs in memory. Once the table holds max_in_memory groups it and the
+        remaining pairs are split by the hash of their key into partitions on disk, which are grouped
+        one after another.
+        """
+        groups = {}
+        tmp_dir = None
+        files = None
+        try:
+            for key, state in states:
+                if files is not None:
+                    pickle.dump((key, state), files[hash((depth, key)) % self.partitions],
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                    continue
+                current = groups.get(key, None)
+                groups[key] = state if current is None else self._merge(current, state)
+                if len(groups) >= self.max_in_memory and depth < self.max_depth:
+                    tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix="aggregate_", dir=self.spill_dir))
+                    files = [open(tmp_dir / f"partition_{i}.pkl", "wb") for i in range(self.partitions)]
+                    for key, state in groups.items():
+                        pickle.dump((key, state), files[hash((depth, key)) % self.partitions],
+                                    protocol=pickle.HIGHEST_PROTOCOL)
+                    logger.info(f"Spilled {len(groups)} edge groups to {tmp_dir}")
+                    groups = {}
+            if files is None:
+                yield from groups.items()
+                return
+            for f in files:
+                f.close()
+            for f in files:
+                yield from self._hash_groups(ExternalSorter._read_run(f.name), depth + 1)
+        finally:
+            if files is not None:
+                for f in files:
+                    f.close()
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
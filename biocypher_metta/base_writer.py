@@ -0,0 +1,706 @@
+from biocypher import BioCypher
+from contextlib import ExitStack
+from datetime import date
+import json
+import pathlib
+import os
+import re
+import shutil
+import tempfile
+from biocypher._logger import logger
+import networkx as nx
+from biocypher_metta.aggregation import EdgeAggregator
+from biocypher_metta.bgzf import BgzfWriter
+from biocypher_metta.bloom import BloomFilterBuilder, BloomStream
+from biocypher_metta.dedup import NodeDeduplicator
+from biocypher_metta.interning import IdInterner
+from biocypher_metta.interval_index import INDEX_DIR, IntervalIndexBuilder
+from biocypher_metta import offset_index
+from biocypher_metta.sorting import ExternalSorter, genomic_key
+from biocypher_metta.stats import MeasuredStream, StatsCollector, record_label
+
+# properties the adapters add to every record when add_provenance is on
+PROVENANCE_PROPERTIES = ["source", "source_url"]
+# record: keep the provenance properties on every record
+# dataset: write one dataset atom per adapter config entry next to its output files, drop the properties
+# reference: as dataset, and replace the properties by a dataset property holding the name of the dataset
+PROVENANCE_MODES = ["record", "dataset", "reference"]
+# inline: property atoms follow their node/edge atom in the same file
+# separate: the node/edge atoms (the graph topology) and the property atoms are written to separate files
+# per_property: as separate, with one file per property
+PROPERTY_LAYOUTS = ["inline", "separate", "per_property"]
+# with partition_by_chr, records without a chr property are written to this partition
+NON_POSITIONAL_PARTITION = "no_chr"
+# edges whose schema entry declares an inverse relation
+# emit: write the inverse edge (target, source) of every edge next to it
+# rule: write the edges as they are and a rule deriving the inverse relation from them
+INVERSE_EDGE_MODES = ["emit", "rule"]
+
+
+class TextStream:
+    """
+    Appends the serialized records of one adapter run to a text output file. Unless the writer's
+    property_layout is inline, only the node/edge atoms go to that file and the property atoms to
+    <kind>_properties.<ext> (separate) or <kind>_properties/<property>.<ext> (per_property) next to it.
+    """
+
+    def __init__(self, writer, file_path, kind):
+        self.path = file_path
+        self.writer = writer
+        self.kind = kind
+        self.serialize = writer.write_edge if kind == "edges" else writer.write_node
+        self.file = self.open_file(file_path)
+        self.property_files = {}
+        # property file path -> number of records with atoms in it
+        self.property_counts = {}
+        # property file paths the atoms of the last record were written to
+        self.record_paths = []
+        dir_path, name = os.path.split(file_path)
+        # the extension including .gz, if any
+        self.property_base = f"{dir_path}/{kind}_properties"
+        self.property_extension = name[len(kind):]
+
+    def open_file(self, path):
+        # binary, so tell() gives byte offsets, of the uncompressed data for block compressed files
+        return BgzfWriter(path) if self.writer.block_compress else open(path, "ab")
+
+    def write(self, record, is_new=True):
+        layout = self.writer.property_layout
+        self.record_paths = []
+        if layout == "per_property":
+            if is_new:
+                self.file.write((self.serialize((*record[:-1], {}))[0] + "\n").encode())
+            for k, v in record[-1].items():
+                self.write_properties(k, self.writer.write_update(self.kind, (*record[:-1], {k: v})))
+            return
+        if is_new:
+            out_str = self.serialize(record)
+            atom, properties = out_str[0], out_str[1:]
+        else:
+            # the record's own atom was already written with its first occurrence, only add its properties
+            atom, properties = None, self.writer.write_update(self.kind, record)
+        if atom is not None:
+            self.file.write((atom + "\n").encode())
+        if layout == "inline":
+            for s in properties:
+                self.file.write((s + "\n").encode())
+        else:
+            self.write_properties(None, properties)
+
+    def write_properties(self, name, out_str):
+        if len(out_str) == 0:
+            return
+        if name is None:
+            path = f"{self.property_base}{self.property_extension}"
+        else:
+            name = re.sub(r"[^\w.-]", "_", name)
+            path = f"{self.property_base}/{name}{self.property_extension}"
+        f = self.property_files.get(path, None)
+        if f is None:
+            pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+            f = self.open_file(path)
+            self.property_files[path] = f
+            self.property_counts[path] = 0
+        self.property_counts[path] += 1
+        self.record_paths.append(path)
+        for s in out_str:
+            f.write((s + "\n").encode())
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        for f in [self.file, *self.property_files.values()]:
+            f.write(b"\n")
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SplitStream:
+    """
+    Routes the records of one adapter run to sub streams below <prefix>/<subdir>/, opened on first use
+    with open_stream(kind, path_prefix, create_dir). Subclasses implement subdir(record); field names the
+    manifest entry key of the subdirectory.
+    """
+    field = None
+
+    def __init__(self, open_stream, kind, path_prefix=None, create_dir=True):
+        self.open_stream = open_stream
+        self.kind = kind
+        self.path_prefix = path_prefix
+        self.create_dir = create_dir
+        self.streams = {}
+        # subdir -> number of records written to it
+        self.counts = {}
+
+    def subdir(self, record):
+        raise NotImplementedError
+
+    def write(self, record, is_new=True):
+        subdir = self.subdir(record)
+        stream = self.streams.get(subdir, None)
+        if stream is None:
+            prefix = f"{self.path_prefix}/{subdir}" if self.path_prefix is not None else subdir
+            stream = self.open_stream(self.kind, prefix, self.create_dir)
+            self.streams[subdir] = stream
+            self.counts[subdir] = 0
+        self.counts[subdir] += 1
+        stream.write(record, is_new)
+
+    def outputs(self):
+        """
+        :return: list of (stream, record count, manifest fields) tuples of the sub streams that were written to
+        """
+        outputs = []
+        for subdir, stream in self.streams.items():
+            if isinstance(stream, SplitStream):
+                outputs.extend((leaf, n, {self.field: subdir, **fields}) for leaf, n, fields in stream.outputs())
+            else:
+                outputs.append((stream, self.counts[subdir], {self.field: subdir}))
+        return outputs
+
+    def close(self):
+        for stream in self.streams.values():
+            stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PartitionedStream(SplitStream):
+    """
+    Splits the records by their chr property into <prefix>/<chr>/, records without one go to <prefix>/no_chr/
+    """
+    field = "partition"
+
+    def subdir(self, record):
+        chr = record[-1].get("chr", None)
+        if chr is None or chr == "":
+            return NON_POSITIONAL_PARTITION
+        return re.sub(r"[^\w.-]", "_", str(chr))
+
+
+class ShardedStream(SplitStream):
+    """
+    Cuts the records into shards of shard_size records, <prefix>/shard-00000/, <prefix>/shard-00001/ ...
+    """
+    field = "shard"
+
+    def __init__(self, open_stream, kind, path_prefix=None, create_dir=True, shard_size=1_000_000):
+        super().__init__(open_stream, kind, path_prefix, create_dir)
+        self.shard_size = shard_size
+        self.written = 0
+
+    def subdir(self, record):
+        shard = self.written // self.shard_size
+        self.written += 1
+        return f"shard-{shard:05d}"
+
+
+class BaseWriter:
+    """
+    Serializer core shared by all output formats. It loads the schema once, runs the record pipeline
+    (provenance, deduplication, ID interning, sorting) and passes each record to the output streams of its sinks.
+    A plain writer is its own only sink; see MultiWriter to drive several output formats from a single
+    adapter pass. Subclasses implement write_node/write_edge to serialize a single record into a list of lines.
+    On close a manifest.json listing the datasets and output files of the build is written.
+    """
+    file_extension = None
+    # False for formats that change the case of IDs, they can't use case sensitive interned IDs
+    case_sensitive_ids = True
+    # True for formats that can express a derived inverse relation, see write_inverse_rules
+    inverse_rules = False
+
+    def __init__(self, schema_config, biocypher_config,
+                 output_dir, bcy=None, block_compress=False, property_layout="inline", **pipeline_args):
+        if property_layout not in PROPERTY_LAYOUTS:
+            raise ValueError('Invalid property layout. Allowed values: ' +
+                             ','.join(PROPERTY_LAYOUTS))
+        self.schema_config = schema_config
+        self.biocypher_config = biocypher_config
+        self.output_path = pathlib.Path(output_dir)
+
+        if not os.path.exists(output_dir):
+            self.output_path.mkdir()
+
+        # the BioCypher instance can be shared between writers so the schema is only loaded once
+        if bcy is None:
+            bcy = BioCypher(schema_config_path=schema_config,
+                            biocypher_config_path=biocypher_config)
+        self.bcy = bcy
+
+        self.onotology = self.bcy._get_ontology()
+        self.create_edge_types()
+
+        # Write the text output as BGZF (<kind>.<ext>.gz with a .gzi block index) for random access reads
+        self.block_compress = block_compress
+        # Write the property atoms of the text output next to the topology atoms or to separate files
+        self.property_layout = property_layout
+        #self.excluded_properties = ["licence", "version", "source"]
+        self.excluded_properties = []
+        self.sinks = [self]
+        self.init_pipeline(**pipeline_args)
+
+    def init_pipeline(self, dedup_policy=None, dedup_memory_mb=1024, id_format=None, provenance="record",
+                      partition_by_chr=False, sort_records=False, sort_memory_mb=1024, shard_size=None,
+                      interval_index=False, offset_index=False, inverse_edges=None, aggregate_memory_mb=1024,
+                      stats=False, bloom_fpr=None):
+        if provenance not in PROVENANCE_MODES:
+            raise ValueError('Invalid provenance mode. Allowed values: ' +
+                             ','.join(PROVENANCE_MODES))
+        self.provenance = provenance
+        self.dataset = None
+        self.dataset_reference = None
+        self.manifest = {"datasets": {}, "files": {}}
+        # Drop nodes emitted more than once (by one or several adapters) keyed by (label, id)
+        self.deduplicator = None
+        # also the memory budget of the sorts merging the properties of repeated nodes into columnar output
+        self.dedup_memory_mb = dedup_memory_mb
+        if dedup_policy is not None:
+            self.deduplicator = NodeDeduplicator(policy=dedup_policy, memory_mb=dedup_memory_mb,
+                                                 spill_dir=self.output_path)
+        # Replace entity IDs by compact symbols, the mapping is written to an id dictionary on close
+        self.interner = None
+        if id_format is not None:
+            if id_format == "base62" and not all(sink.case_sensitive_ids for sink in self.sinks):
+                raise ValueError("base62 IDs are case sensitive, use int IDs with this output format")
+            self.interner = IdInterner(id_format)
+        # Write nodes and edges to one directory per chromosome below the output directory of the adapter
+        self.partition_by_chr = partition_by_chr
+        # Sort the nodes and edges of every adapter run by (chr, start), the others by (source) ID
+        self.sorter = None
+        if sort_records:
+            self.sorter = ExternalSorter(memory_mb=sort_memory_mb, spill_dir=self.output_path)
+        # Cut the output of every adapter run (and partition) into shards of at most shard_size records
+        if shard_size is not None and shard_size < 1:
+            raise ValueError("shard_size must be at least 1")
+        self.shard_size = shard_size
+        # Build an interval index of the positional nodes per output directory and label, written on close
+        self.interval_index = interval_index
+        self.interval_builders = {}
+        # Record the byte range of the atoms of every entity ID in the text output files, per output format
+        self.offset_builders = None
+        if offset_index:
+            self.offset_builders = {}
+            self.sort_memory_mb = sort_memory_mb
+        # Derive the inverse of the edges with an inverse relation in the schema, so one adapter pass
+        # writes both directions
+        if inverse_edges is not None and inverse_edges not in INVERSE_EDGE_MODES:
+            raise ValueError('Invalid inverse edge mode. Allowed values: ' +
+                             ','.join(INVERSE_EDGE_MODES))
+        if inverse_edges == "rule" and not all(sink.inverse_rules for sink in self.sinks):
+            raise ValueError("Inverse rules can only be written with the metta and prolog output formats")
+        self.inverse_edges = inverse_edges
+        # edge labels written so far, their inverse rules are written on close
+        self.edge_labels = set()
+        # Memory budget of the edge aggregation of the adapter runs that request it, see write_edges
+        self.aggregate_memory_mb = aggregate_memory_mb
+        # Collect counts, distinct values and degree distributions per label and property, written on close
+        self.stats = StatsCollector(self.output_path) if stats else None
+        # Write a bloom filter of the entity IDs of every output file next to it, sized on close
+        if bloom_fpr is not None and not 0 < bloom_fpr < 1:
+            raise ValueError("bloom_fpr must be between 0 and 1")
+        self.bloom_fpr = bloom_fpr
+        self.bloom_builders = {}
+        self.bloom_dir = None
+
+    def create_edge_types(self):
+        schema = self.bcy._get_ontology_mapping()._extend_schema()
+        self.edge_node_types = {}
+        # declared properties (name -> type) of every node and edge input label, in schema order
+        self.label_properties = {}
+        # edge input label -> input label of the inverse relation declared in the schema
+        self.edge_inverses = {}
+        # schema name -> input label of the edges
+        edge_labels = {}
+
+        for k, v in schema.items():
+            labels = v["input_label"] if isinstance(v["input_label"], list) else [v["input_label"]]
+            for label in labels:
+                self.label_properties[self.convert_input_labels(label).lower()] = v.get("properties", None) or {}
+
+            if v["represented_as"] == "edge":
+                source_type = v.get("source", None)
+                target_type = v.get("target", None)
+                if source_type is None or target_type is None:
+                    continue
+                # ## TODO fix this in the scheme config
+                if isinstance(v["input_label"], list):
+                    label = self.convert_input_labels(v["input_label"][0])
+                    source_type = self.convert_input_labels(source_type[0])
+                    target_type = self.convert_input_labels(target_type[0])
+                else:
+                    label = self.convert_input_labels(v["input_label"])
+                    source_type = self.convert_input_labels(source_type)
+                    target_type = self.convert_input_labels(target_type)
+
+                output_label = v.get("output_label", None)
+                self.edge_node_types[label.lower()] = {"source": source_type.lower(), "target": target_type.lower(),
+                                                       "output_label": output_label.lower() if output_label is not None else None}
+                edge_labels[k] = label.lower()
+
+        for k, v in schema.items():
+            inverse = v.get("inverse", None)
+            if k in edge_labels and inverse in edge_labels:
+                self.edge_inverses[edge_labels[k]] = edge_labels[inverse]
+
+    def start_dataset(self, name, adapter=None, path_prefix=None):
+        """
+        Called before the records of an adapter config entry are written. Records the dataset in the
+        manifest and, unless provenance is kept per record, writes its dataset atom to
+        <path_prefix>/datasets.<ext> so the records of that directory are linked to it.
+        :param adapter: the adapter of the entry, its source, source_url and version describe the dataset.
+        None if no provenance should be written.
+        """
+        properties = {}
+        for k in PROVENANCE_PROPERTIES + ["version"]:
+            v = getattr(adapter, k, None)
+            if v is not None:
+                properties[k] = v
+        properties["build_date"] = date.today().isoformat()
+        self.dataset = name
+        self.dataset_reference = None
+        self.manifest["datasets"][name] = {"outdir": path_prefix, **properties}
+        if self.provenance != "record" and adapter is not None:
+            self.write_records("datasets", [((name, "dataset", properties), True)], path_prefix)
+            if self.provenance == "reference":
+                self.dataset_reference = name
+
+    def hoist_provenance(self, properties):
+        properties = {k: v for k, v in properties.items() if k not in PROVENANCE_PROPERTIES}
+        if self.dataset_reference is not None:
+            properties["dataset"] = self.dataset_reference
+        return properties
+
+    def get_output_path(self, kind, path_prefix=None, create_dir=True):
+        if path_prefix is not None:
+            file_path = f"{self.output_path}/{path_prefix}/{kind}.{self.file_extension}"
+            if create_dir:
+                if not os.path.exists(f"{self.output_path}/{path_prefix}"):
+                    pathlib.Path(f"{self.output_path}/{path_prefix}").mkdir(parents=True, exist_ok=True)
+        else:
+            file_path = f"{self.output_path}/{kind}.{self.file_extension}"
+        if self.block_compress:
+            file_path += ".gz"
+        return file_path
+
+    def open_stream(self, kind, path_prefix=None, create_dir=True):
+        return TextStream(self, self.get_output_path(kind, path_prefix, create_dir), kind)
+
+    def write_nodes(self, nodes, path_prefix=None, create_dir=True):
+        self.write_records("nodes", self.prepare_nodes(nodes), path_prefix, create_dir)
+        logger.info("Finished writing out nodes")
+
+    def write_edges(self, edges, path_prefix=None, create_dir=True, aggregate=None):
+        """
+        :param aggregate: None, or the arguments (method, distinct) of an EdgeAggregator collapsing the edges
+        with the same (source, target, label) into one edge with list valued properties
+        """
+        if aggregate is not None:
+            aggregator = EdgeAggregator(memory_mb=self.aggregate_memory_mb, spill_dir=self.output_path, **aggregate)
+            edges = aggregator.aggregate(edges)
+        self.write_records("edges", self.prepare_edges(edges), path_prefix, create_dir)
+
+    def prepare_nodes(self, nodes):
+        """
+        Run the node pipeline, yields (node, is_new) tuples
+        """
+        for node in nodes:
+            is_new = True
+            if self.provenance != "record":
+                id, label, properties = node
+                node = id, label, self.hoist_provenance(properties)
+            if self.deduplicator is not None:
+                id, label, properties = node
+                if "." in label:
+                    label = label.split(".")[1]
+                is_new, properties = self.deduplicator.check(label, id, properties)
+                if not is_new and not properties:
+                    continue
+                node = id, label, properties
+            if self.interner is not None:
+                id, label, properties = node
+                node = self.interner.intern(id), label, properties
+            yield node, is_new
+
+    def prepare_edges(self, edges):
+        """
+        Run the edge pipeline, yields (edge, is_new) tuples
+        """
+        for edge in edges:
+            if self.provenance != "record":
+                source_id, target_id, label, properties = edge
+                edge = source_id, target_id, label, self.hoist_provenance(properties)
+            if self.interner is not None:
+                source_id, target_id, label, properties = edge
+                edge = self.interner.intern(source_id), self.interner.intern(target_id), label, properties
+            if self.inverse_edges is not None:
+                self.edge_labels.add(edge[2].lower())
+            yield edge, True
+            if self.inverse_edges == "emit":
+                source_id, target_id, label, properties = edge
+                inverse = self.edge_inverses.get(label.lower(), None)
+                if inverse is not None:
+                    yield (target_id, source_id, inverse, properties), True
+
+    def inverse_relations(self):
+        """
+        :return: dict of edge label -> inverse label of the edges written so far whose inverse relation
+        wasn't written itself, i.e. the relations to derive with an inverse rule
+        """
+        return {label: self.edge_inverses[label] for label in sorted(self.edge_labels)
+                if label in self.edge_inverses and self.edge_inverses[label] not in self.edge_labels}
+
+    def open_stream_of(self, sink, kind, path_prefix=None, create_dir=True):
+        if kind not in ("nodes", "edges"):
+            return sink.open_stream(kind, path_prefix, create_dir)
+        open_stream = sink.open_stream
+        if self.stats is not None:
+            def open_stream(kind, path_prefix, create_dir):
+                stream = sink.open_stream(kind, path_prefix, create_dir)
+                # only text streams have byte offsets
+                if not hasattr(stream, "tell"):
+                    return stream
+                return MeasuredStream(stream, self.stats, sink.file_extension)
+        if self.offset_builders is not None:
+            open_measured = open_stream
+
+            def open_stream(kind, path_prefix, create_dir):
+                stream = open_measured(kind, path_prefix, create_dir)
+                if not hasattr(stream, "tell"):
+                    return stream
+                return offset_index.OffsetIndexedStream(stream, self.offset_builder(sink))
+        if self.bloom_fpr is not None:
+            open_unfiltered = open_stream
+
+            def open_stream(kind, path_prefix, create_dir):
+                stream = open_unfiltered(kind, path_prefix, create_dir)
+                if stream.path is None:
+                    return stream
+                return BloomStream(stream, self.bloom_builder, kind)
+        if self.shard_size is not None:
+            shard_size = self.shard_size
+            open_leaf = open_stream
+
+            def open_stream(kind, path_prefix, create_dir):
+                return ShardedStream(open_leaf, kind, path_prefix, create_dir, shard_size)
+        if self.partition_by_chr:
+            return PartitionedStream(open_stream, kind, path_prefix, create_dir)
+        return open_stream(kind, path_prefix, create_dir)
+
+    def index_intervals(self, records, path_prefix=None):
+        """
+        Pass through the (node, is_new) tuples of records, adding the positional ones to the interval index
+        """
+        for node, is_new in records:
+            id, label, properties = node
+            chr = properties.get("chr", None)
+            if is_new and chr is not None and chr != "":
+                try:
+                    start = int(properties["start"])
+                    end = int(properties.get("end", None) or start)
+                except (KeyError, TypeError, ValueError):
+                    start = None
+                if start is not None:
+                    if "." in label:
+                        label = label.split(".")[1]
+                    label = self.convert_input_labels(label).lower()
+                    builder = self.interval_builders.get((path_prefix, label), None)
+                    if builder is None:
+                        index_dir = self.output_path / path_prefix if path_prefix is not None else self.output_path
+                        builder = IntervalIndexBuilder(index_dir / INDEX_DIR / label, spill_dir=self.output_path)
+                        self.interval_builders[(path_prefix, label)] = builder
+                    builder.add(str(chr), start, end, str(id))
+            yield node, is_new
+
+    def offset_builder(self, sink):
+        builder = self.offset_builders.get(sink.file_extension, None)
+        if builder is None:
+            builder = offset_index.OffsetIndexBuilder(self.output_path / offset_index.INDEX_DIR / sink.file_extension,
+                                                      self.output_path, spill_dir=self.output_path,
+                                                      sort_memory_mb=self.sort_memory_mb)
+            self.offset_builders[sink.file_extension] = builder
+        return builder
+
+    def bloom_builder(self, path):
+        builder = self.bloom_builders.get(path, None)
+        if builder is None:
+            if self.bloom_dir is None:
+                self.bloom_dir = tempfile.mkdtemp(prefix="bloom_", dir=self.output_path)
+            builder = BloomFilterBuilder(path, self.bloom_dir, fpr=self.bloom_fpr)
+            self.bloom_builders[path] = builder
+        return builder
+
+    def write_records(self, kind, records, path_prefix=None, create_dir=True):
+        if self.sorter is not None and kind in ("nodes", "edges"):
+            records = self.sorter.sort(records, key=lambda r: genomic_key(r[0]))
+        if self.interval_index and kind == "nodes":
+            records = self.index_intervals(records, path_prefix)
+        if self.stats is not None and kind in ("nodes", "edges"):
+            records = self.stats.observe(kind, records)
+        # the labels of the records as in stats.json, listed in the manifest entries of the files written
+        labels = set()
+        if kind in ("nodes", "edges"):
+            records = self.collect_labels(kind, records, labels)
+        with ExitStack() as stack:
+            streams = [stack.enter_context(self.open_stream_of(sink, kind, path_prefix, create_dir))
+                       for sink in self.sinks]
+            count = 0
+            for record, is_new in records:
+                count += 1
+                for stream in streams:
+                    stream.write(record, is_new)
+        for sink, stream in zip(self.sinks, streams):
+            outputs = stream.outputs() if isinstance(stream, SplitStream) else [(stream, count, {})]
+            for leaf, n, fields in outputs:
+                property_counts = getattr(leaf, "property_counts", {})
+                if getattr(sink, "property_layout", "inline") != "inline":
+                    fields = {**fields, "atoms": "topology"}
+                self.register_output(sink, leaf.path, kind, n, fields, labels)
+                for path, m in property_counts.items():
+                    self.register_output(sink, path, kind, m, {**fields, "atoms": "properties"}, labels)
+
+    @staticmethod
+    def collect_labels(kind, records, labels):
+        """
+        Pass through the (record, is_new) tuples of records, adding their labels to the set labels
+        """
+        for record, is_new in records:
+            labels.add(record_label(kind, record))
+            yield record, is_new
+
+    def register_output(self, sink, path, kind, count, fields=None, labels=None):
+        if path is None:
+            # streamed, not written to a file
+            return
+        path = os.path.relpath(path, self.output_path)
+        entry = self.manifest["files"].setdefault(path, {"format": sink.file_extension, "kind": kind,
+                                                         "datasets": [], "records": 0})
+        if fields:
+            entry.update(fields)
+        if labels:
+            entry["labels"] = sorted(set(entry.get("labels", [])) | labels)
+        if getattr(sink, "block_compress", False):
+            entry["compression"] = "bgzf"
+        entry["records"] += count
+        if self.dataset is not None and self.dataset not in entry["datasets"]:
+            entry["datasets"].append(self.dataset)
+
+    def write_manifest(self):
+        with open(f"{self.output_path}/manifest.json", "w") as f:
+            json.dump(self.manifest, f, indent=2)
+
+    def write_node(self, node):
+        raise NotImplementedError
+
+    def write_edge(self, edge):
+        raise NotImplementedError
+
+    def write_update(self, kind, record):
+        """
+        Serialize the properties of a record whose own atom was already written
+        """
+        return (self.write_node(record) if kind == "nodes" else self.write_edge(record))[1:]
+
+    def flush_inverse_rules(self):
+        """
+        In rule mode, have the sinks write the inverse rules of the edge labels written so far. Called on
+        close, before the sinks are closed if they need to (e.g. the connection of a streaming sink).
+        """
+        if self.inverse_edges != "rule":
+            return
+        inverses = self.inverse_relations()
+        self.edge_labels = set()
+        if inverses:
+            for sink in self.sinks:
+                sink.write_inverse_rules(inverses)
+            logger.info(f"Wrote inverse rules for {len(inverses)} edge labels")
+
+    def write_inverse_rules(self, inverses):
+        """
+        Write rules deriving the inverse edges
+        :param inverses: dict of edge input label -> input label of its inverse relation
+        """
+        raise NotImplementedError
+
+    def write_id_dictionary(self, interner):
+        """
+        Write the mapping of interned symbols to the original IDs, as tsv unless the format has its own
+        """
+        with open(f"{self.output_path}/id_dictionary.tsv", "w") as f:
+            for symbol, id in interner.items():
+                f.write(f"{symbol}\t{id}\n")
+
+    def check_property(self, prop):
+        if isinstance(prop, str):
+            if " " in prop:
+                prop = prop.replace(" ", "_")
+
+            special_chars = ["(", ")"]
+            escape_char = "\\"
+            return "".join(escape_char + c if c in special_chars or c == escape_char else c for c in prop)
+
+        return prop
+
+    def convert_input_labels(self, label, replace_char="_"):
+        """
+        A method that removes spaces in input labels and replaces them with replace_char
+        :param label: Input label of a node or edge
+        :param replace_char: the character to replace spaces with
+        :return:
+        """
+        return label.replace(" ", replace_char)
+
+    def get_parent(self, G, node):
+        """
+        Get the immediate parent of a node in the ontology.
+        """
+        return nx.dfs_preorder_nodes(G, node, depth_limit=2)
+
+    def close(self):
+        if self.deduplicator is not None:
+            self.deduplicator.close()
+        for builder in self.interval_builders.values():
+            chromosomes = builder.close()
+            if self.manifest is not None:
+                self.manifest.setdefault("indexes", {})[os.path.relpath(builder.index_dir, self.output_path)] = {
+                    "kind": "interval", "records": builder.count, "chromosomes": sorted(chromosomes)}
+        for builder in (self.offset_builders or {}).values():
+            builder.close()
+            if self.manifest is not None:
+                self.manifest.setdefault("indexes", {})[os.path.relpath(builder.index_dir, self.output_path)] = {
+                    "kind": "offset", "records": builder.count}
+        self.flush_inverse_rules()
+        for path, builder in self.bloom_builders.items():
+            bloom_path = builder.close()
+            if self.manifest is not None:
+                entry = self.manifest["files"].get(os.path.relpath(path, self.output_path), None)
+                if entry is not None:
+                    entry["bloom"] = os.path.relpath(bloom_path, self.output_path)
+        if self.bloom_dir is not None:
+            shutil.rmtree(self.bloom_dir, ignore_errors=True)
+        if self.stats is not None:
+            path = self.stats.close()
+            if self.manifest is not None:
+                self.manifest["stats"] = path
+            logger.info(f"Wrote build statistics to {path}")
+        if self.interner is not None:
+            for sink in self.sinks:
+                sink.write_id_dictionary(self.interner)
+            logger.info(f"Wrote id dictionary with {len(self.interner)} IDs")
+        if self.manifest is not None:
+            self.write_manifest()
+
+    def show_ontology_structure(self):
+        self.bcy.show_ontology_structure()
+
+    def summary(self):
+        self.bcy.summary()
@@ -0,0 +1,129 @@
+"""
+BGZF block compressed files: a series of gzip members of at most 64 KB of uncompressed data each, so any
+gzip reader can decompress the whole file while a reader with the block index only decompresses the blocks
+covering the range it needs. The block index is written next to the file as <file>.gzi in the layout of
+`bgzip -i`: a uint64 count followed by (compressed offset, uncompressed offset) uint64 pairs for every block
+after the first. The last entry is the empty end-of-file block, it holds the uncompressed size of the file.
+"""
+import os
+import struct
+import zlib
+import numpy as np
+
+# uncompressed bytes per block, as in htslib, so a block never exceeds the 64 KB BSIZE limit
+BLOCK_DATA_SIZE = 0xff00
+# gzip header with the BGZF extra subfield (BC, 2 bytes holding the total block size - 1)
+_HEADER = struct.Struct("<4BI2BH2BHH")
+_TRAILER = struct.Struct("<II")
+_EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def compress_block(data, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    payload = compressor.compress(data) + compressor.flush()
+    block_size = _HEADER.size + len(payload) + _TRAILER.size
+    header = _HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord("B"), ord("C"), 2, block_size - 1)
+    return header + payload + _TRAILER.pack(zlib.crc32(data), len(data))
+
+
+def read_index(path):
+    """
+    :return: (compressed offsets, uncompressed offsets) of all blocks of the BGZF file at path, including the
+    first block at (0, 0)
+    """
+    with open(f"{path}.gzi", "rb") as f:
+        count = struct.unpack("<Q", f.read(8))[0]
+        entries = np.frombuffer(f.read(16 * count), dtype=np.uint64).reshape(count, 2)
+    return (np.concatenate([[0], entries[:, 0]]).astype(np.int64),
+            np.concatenate([[0], entries[:, 1]]).astype(np.int64))
+
+
+class BgzfWriter:
+    """
+    Binary file-like writer of a BGZF file. An existing file is continued: its end-of-file block is dropped
+    and new blocks are appended after the last one, so several adapter runs can write to the same file.
+    tell() returns the uncompressed offset.
+    """
+
+    def __init__(self, path, level=6):
+        self.path = path
+        self.level = level
+        self.blocks = []
+        self.offset = 0
+        if os.path.exists(path) and os.path.exists(f"{path}.gzi"):
+            coffsets, uoffsets = read_index(path)
+            self.blocks = list(zip(coffsets[1:].tolist(), uoffsets[1:].tolist()))
+            # the last entry is the end-of-file block, continue in its place
+            coffset, self.offset = self.blocks.pop()
+            self.file = open(path, "r+b")
+            self.file.truncate(coffset)
+            self.file.seek(coffset)
+        else:
+            self.file = open(path, "wb")
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BLOCK_DATA_SIZE:
+            self._write_block(bytes(self.buffer[:BLOCK_DATA_SIZE]))
+            del self.buffer[:BLOCK_DATA_SIZE]
+
+    def _write_block(self, data):
+        coffset = self.file.tell()
+        if coffset > 0:
+            self.blocks.append((coffset, self.offset))
+        self.file.write(compress_block(data, self.level))
+        self.offset += len(data)
+
+    def tell(self):
+        return self.offset + len(self.buffer)
+
+    def close(self):
+        if len(self.buffer) > 0:
+            self._write_block(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.blocks.append((self.file.tell(), self.offset))
+        self.file.write(_EOF_BLOCK)
+        self.file.close()
+        with open(f"{self.path}.gzi", "wb") as f:
+            f.write(struct.pack("<Q", len(self.blocks)))
+            f.write(np.array(self.blocks, dtype=np.uint64).tobytes())
+
+
+class BgzfReader:
+    """
+    Random access reads of uncompressed byte ranges of a BGZF file, using its .gzi block index
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.coffsets, self.uoffsets = read_index(path)
+        self.file = open(path, "rb")
+
+    def _read_block(self, coffset):
+        self.file.seek(coffset)
+        header = self.file.read(_HEADER.size)
+        block_size = _HEADER.unpack(header)[-1] + 1
+        payload = self.file.read(block_size - _HEADER.size)
+        return zlib.decompress(payload[:-_TRAILER.size], -15)
+
+    def read(self, offset, length):
+        """
+        :return: length bytes starting at the uncompressed offset, only the blocks covering them are decompressed
+        """
+        i = int(np.searchsorted(self.uoffsets, offset, side="right")) - 1
+        data = bytearray()
+        start = offset - int(self.uoffsets[i])
+        while len(data) < start + length and i < len(self.coffsets) - 1:
+            data += self._read_block(int(self.coffsets[i]))
+            i += 1
+        return bytes(data[start:start + length])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
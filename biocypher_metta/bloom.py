@@ -0,0 +1,182 @@
+"""
+Bloom filters over the entity IDs (node IDs, edge source and target IDs) of every output file, property files
+of the separate layouts included, so a lookup across many shards only opens the files that can contain an ID
+
+    <file>.bloom    "BLM1", uint64 bits, uint32 hash count, uint64 IDs, followed by the bit array
+
+The filter is sized on close for the configured false positive rate and the distinct ID count of the file
+(estimated with a HyperLogLog sketch); the ID hashes are spilled to disk until then. The k bit positions of
+an ID are h1 + i * h2 mod bits, from the two halves of its 64-bit hash.
+
+    python -m biocypher_metta.bloom --build-dir out --id ENSG00000290825
+"""
+import json
+import math
+import os
+import pathlib
+import struct
+from typing import List
+import numpy as np
+import typer
+from typing_extensions import Annotated
+from biocypher_metta.dedup import hash_key
+from biocypher_metta.stats import HyperLogLog
+
+BLOOM_SUFFIX = ".bloom"
+_HEADER = struct.Struct("<4sQIQ")
+_MAGIC = b"BLM1"
+
+
+def bit_positions(hashes, bits, k):
+    """
+    :return: array (k, len(hashes)) of the bit positions of the hashes
+    """
+    h1 = (hashes & np.uint64(0xffffffff)).astype(np.uint64)
+    h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+    i = np.arange(k, dtype=np.uint64)[:, None]
+    return (h1[None, :] + i * h2[None, :]) % np.uint64(bits)
+
+
+class BloomFilterBuilder:
+    """
+    Collects the ID hashes of one output file, written to <path>.bloom on close
+    """
+
+    def __init__(self, path, spill_dir, fpr=0.01, buffer_size=1 << 16):
+        self.path = path
+        self.fpr = fpr
+        self.buffer_size = buffer_size
+        self.spill_path = pathlib.Path(spill_dir) / f"{hash_key(str(path)):016x}.bin"
+        self.buffer = []
+        self.spilled = False
+        self.distinct = HyperLogLog()
+
+    def add(self, id):
+        h = hash_key(str(id))
+        self.buffer.append(h)
+        self.distinct.add(h)
+        if len(self.buffer) >= self.buffer_size:
+            self._spill()
+
+    def _spill(self):
+        with open(self.spill_path, "ab") as f:
+            np.array(self.buffer, dtype=np.uint64).tofile(f)
+        self.buffer = []
+        self.spilled = True
+
+    def close(self, chunk_size=1 << 20):
+        """
+        :return: path of the filter file
+        """
+        n = max(1, self.distinct.count())
+        bits = max(64, int(math.ceil(-n * math.log(self.fpr) / math.log(2) ** 2)))
+        k = max(1, int(round(bits / n * math.log(2))))
+        array = np.zeros((bits + 7) // 8, dtype=np.uint8)
+        if self.spilled:
+            self._spill()
+            hashes = np.memmap(self.spill_path, dtype=np.uint64, mode="r")
+        else:
+            hashes = np.array(self.buffer, dtype=np.uint64)
+        for i in range(0, len(hashes), chunk_size):
+            positions = bit_positions(np.asarray(hashes[i:i + chunk_size]), bits, k).ravel()
+            np.bitwise_or.at(array, (positions >> np.uint64(3)).astype(np.int64),
+                             (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+        del hashes
+        if self.spilled:
+            os.remove(self.spill_path)
+        self.buffer = []
+        filter_path = f"{self.path}{BLOOM_SUFFIX}"
+        with open(filter_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, bits, k, n))
+            f.write(array.tobytes())
+        return filter_path
+
+
+class BloomFilter:
+    """
+    Read side of a <file>.bloom filter, memory-mapped
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic, self.bits, self.k, self.count = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC:
+            raise ValueError(f"{path} isn't a bloom filter")
+        self.array = np.memmap(path, dtype=np.uint8, mode="r", offset=_HEADER.size)
+
+    def __contains__(self, id):
+        positions = bit_positions(np.array([hash_key(str(id))], dtype=np.uint64), self.bits, self.k).ravel()
+        bytes_ = self.array[(positions >> np.uint64(3)).astype(np.int64)]
+        return bool(np.all(bytes_ & (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8))))
+
+
+class BloomIndex:
+    """
+    The bloom filters of all output files of a build, from its manifest.json
+    """
+
+    def __init__(self, build_dir):
+        self.build_dir = pathlib.Path(build_dir)
+        with open(self.build_dir / "manifest.json") as f:
+            manifest = json.load(f)
+        self.filters = {path: BloomFilter(self.build_dir / entry["bloom"])
+                        for path, entry in manifest["files"].items() if "bloom" in entry}
+
+    def files_containing(self, id):
+        """
+        :return: paths (relative to the build directory) of the output files that may contain id; a file
+        that isn't listed doesn't
+        """
+        return [path for path, bloom in self.filters.items() if id in bloom]
+
+
+class BloomStream:
+    """
+    Wraps an output stream and adds the IDs of every record it writes, new or an update of an earlier one, to
+    the BloomFilterBuilder of the output file and of every property file (--property-layout) the record's
+    atoms went to
+    :param builder_of: function returning the BloomFilterBuilder of a file path
+    """
+
+    def __init__(self, stream, builder_of, kind):
+        self.stream = stream
+        self.builder_of = builder_of
+        self.path = stream.path
+        self.kind = kind
+
+    @property
+    def property_counts(self):
+        return getattr(self.stream, "property_counts", {})
+
+    def write(self, record, is_new=True):
+        self.stream.write(record, is_new)
+        ids = [record[0], record[1]] if self.kind == "edges" else [record[0]]
+        for path in [self.path, *getattr(self.stream, "record_paths", [])]:
+            builder = self.builder_of(path)
+            for id in ids:
+                builder.add(id)
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+app = typer.Typer()
+
+
+@app.command()
+def main(build_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=False, dir_okay=True)],
+         id: List[str] = typer.Option(..., help="Entity ID(s) to look up")):
+    index = BloomIndex(build_dir)
+    for i in id:
+        for path in index.files_containing(i):
+            print(f"{i}\t{path}")
+
+
+if __name__ == "__main__":
+    app()
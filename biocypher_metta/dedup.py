@@ -0,0 +1,270 @@
+import hashlib
+import os
+import pathlib
+import shutil
+import struct
+import tempfile
+import numpy as np
+from biocypher._logger import logger
+from biocypher_metta.adapters.helpers import VARIANT_KEY_HASHED, VARIANT_KEY_TAG_SHIFT, pack_variant_id
+
+# Rough per-entry cost of a python int key and str value in a dict (objects + hash slot), plus the key length
+_ENTRY_BYTES = 120
+# offset of a run entry whose hash is the key itself
+_NO_KEY = np.uint64(0xffffffffffffffff)
+_KEY_LENGTH = struct.Struct("<I")
+
+
+def hash_key(key):
+    """
+    Hash a string key to an unsigned 64-bit integer
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+class SeenSet:
+    """
+    A set of keys, looked up by their 64-bit hash and verified against the exact key, so a hash collision
+    can't drop a distinct key. Up to max_bytes worth of keys are kept in a dict of hash -> key, beyond that
+    the hashes are sorted and spilled to disk as a run file, with the offsets of their keys in a key file
+    next to it. Runs are memory-mapped and binary searched on lookup; a hash found in a run is verified by
+    reading its key back. Runs are merged pairwise, streaming blocks of merge_block entries, once there are
+    more than max_runs of them, so memory stays bounded regardless of the number of keys. The keys that
+    collide with the hash of another key are kept in memory.
+    """
+
+    def __init__(self, spill_dir=None, max_bytes=1 << 30, max_runs=8, merge_block=1 << 22):
+        self.max_bytes = max_bytes
+        self.max_runs = max_runs
+        self.merge_block = merge_block
+        self.spill_dir = pathlib.Path(tempfile.mkdtemp(prefix="seen_", dir=spill_dir))
+        # hash -> key, None if the hash is the key itself
+        self.keys = {}
+        self.bytes = 0
+        # keys whose hash is the hash of another key
+        self.collisions = set()
+        # list of (hashes, key offsets) memory-mapped arrays
+        self.runs = []
+        self.key_file = open(self.spill_dir / "keys.bin", "w+b")
+        self._run_count = 0
+        self._size = 0
+
+    def add(self, key):
+        """
+        Add key to the set.
+        :return: True if the key was not in the set before
+        """
+        return self.add_hash(hash_key(key), key)
+
+    def add_hash(self, h, key=None):
+        """
+        Add a key by its 64-bit hash
+        :param key: the exact key, compared when the hash is found. None if the hash is the key itself,
+        e.g. a packed variant key.
+        :return: True if it was not in the set before
+        """
+        seen = self._lookup(h)
+        if seen is not False:
+            if seen == key or key in self.collisions:
+                return False
+            self.collisions.add(key)
+            self._size += 1
+            return True
+        self.keys[h] = key
+        self.bytes += _ENTRY_BYTES + (len(key) if key is not None else 0)
+        self._size += 1
+        if self.bytes >= self.max_bytes:
+            self._spill()
+        return True
+
+    def __contains__(self, key):
+        return self._lookup(hash_key(key)) == key or key in self.collisions
+
+    def __len__(self):
+        return self._size
+
+    def _lookup(self, h):
+        """
+        :return: the key of hash h, False if the hash isn't in the set
+        """
+        if h in self.keys:
+            return self.keys[h]
+        h = np.uint64(h)
+        for hashes, offsets in self.runs:
+            if h < hashes[0] or h > hashes[-1]:
+                continue
+            i = np.searchsorted(hashes, h)
+            if i < len(hashes) and hashes[i] == h:
+                return self._read_key(offsets[i])
+        return False
+
+    def _read_key(self, offset):
+        if offset == _NO_KEY:
+            return None
+        self.key_file.seek(int(offset))
+        n, = _KEY_LENGTH.unpack(self.key_file.read(_KEY_LENGTH.size))
+        return self.key_file.read(n).decode()
+
+    def _new_run_path(self):
+        self._run_count += 1
+        return self.spill_dir / f"run_{self._run_count}"
+
+    def _open_run(self, path):
+        return (np.memmap(f"{path}.u64", dtype=np.uint64, mode="r"),
+                np.memmap(f"{path}.offsets", dtype=np.uint64, mode="r"))
+
+    def _spill(self):
+        n = len(self.keys)
+        hashes = np.fromiter(self.keys.keys(), dtype=np.uint64, count=n)
+        offsets = np.empty(n, dtype=np.uint64)
+        self.key_file.seek(0, os.SEEK_END)
+        offset = self.key_file.tell()
+        buffer = bytearray()
+        for i, key in enumerate(self.keys.values()):
+            if key is None:
+                offsets[i] = _NO_KEY
+                continue
+            data = key.encode()
+            offsets[i] = offset
+            buffer += _KEY_LENGTH.pack(len(data))
+            buffer += data
+            offset += _KEY_LENGTH.size + len(data)
+            if len(buffer) >= 1 << 20:
+                self.key_file.write(buffer)
+                buffer = bytearray()
+        self.key_file.write(buffer)
+        self.key_file.flush()
+        order = np.argsort(hashes)
+        path = self._new_run_path()
+        hashes[order].tofile(f"{path}.u64")
+        offsets[order].tofile(f"{path}.offsets")
+        self.runs.append(self._open_run(path))
+        self.keys = {}
+        self.bytes = 0
+        logger.info(f"Spilled {n} keys to {path}")
+
+        while len(self.runs) > self.max_runs:
+            a, b = self.runs.pop(0), self.runs.pop(0)
+            self.runs.append(self._merge_runs(a, b))
+
+    def _merge_runs(self, a, b):
+        """
+        Merge two runs, reading at most merge_block entries of each at a time
+        """
+        path = self._new_run_path()
+        (a_hashes, a_offsets), (b_hashes, b_offsets) = a, b
+        with open(f"{path}.u64", "wb") as hash_file, open(f"{path}.offsets", "wb") as offset_file:
+            i = j = 0
+            while i < len(a_hashes) and j < len(b_hashes):
+                block_a = np.asarray(a_hashes[i:i + self.merge_block])
+                block_b = np.asarray(b_hashes[j:j + self.merge_block])
+                # everything up to the smaller of the two block ends is final
+                limit = min(block_a[-1], block_b[-1])
+                n_a = int(np.searchsorted(block_a, limit, side="right"))
+                n_b = int(np.searchsorted(block_b, limit, side="right"))
+                hashes = np.concatenate([block_a[:n_a], block_b[:n_b]])
+                offsets = np.concatenate([a_offsets[i:i + n_a], b_offsets[j:j + n_b]])
+                order = np.argsort(hashes, kind="stable")
+                hashes[order].tofile(hash_file)
+                offsets[order].tofile(offset_file)
+                i += n_a
+                j += n_b
+            for hashes, offsets, k in ((a_hashes, a_offsets, i), (b_hashes, b_offsets, j)):
+                for start in range(k, len(hashes), self.merge_block):
+                    np.asarray(hashes[start:start + self.merge_block]).tofile(hash_file)
+                    np.asarray(offsets[start:start + self.merge_block]).tofile(offset_file)
+        for run in (a, b):
+            for array in run:
+                os.remove(array.filename)
+        return self._open_run(path)
+
+    def close(self):
+        self.keys = {}
+        self.runs = []
+        self.key_file.close()
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+class NodeDeduplicator:
+    """
+    Drops nodes that have already been written, keyed by (label, id).
+    Policies for handling the properties of a duplicate:
+        first - keep the properties of the first occurrence and drop the duplicate entirely
+        merge - write the properties of the duplicate that have not been written for that node yet, so the
+                output holds the union of the properties of all occurrences; a property keeps the value of its
+                first occurrence
+    """
+    POLICIES = ["first", "merge"]
+
+    def __init__(self, policy="first", memory_mb=1024, spill_dir=None):
+        if policy not in NodeDeduplicator.POLICIES:
+            raise ValueError('Invalid dedup policy. Allowed values: ' +
+                             ','.join(NodeDeduplicator.POLICIES))
+        self.policy = policy
+        max_bytes = max(1, memory_mb * 1024 * 1024)
+        if policy == "merge":
+            # property keys usually outnumber node keys, give them the larger share of the budget
+            self.nodes = SeenSet(spill_dir, max_bytes=max(1, max_bytes // 4))
+            self.properties = SeenSet(spill_dir, max_bytes=max(1, max_bytes - max_bytes // 4))
+        else:
+            self.nodes = SeenSet(spill_dir, max_bytes=max_bytes)
+            self.properties = None
+        self.duplicates = 0
+        # properties of duplicates dropped because the node already has a value for them
+        self.repeated_properties = 0
+        # label -> tag of the packed variant keys of that label
+        self.variant_tags = {}
+
+    def node_key(self, label, id):
+        """
+        64-bit key of a node. Variant IDs are packed losslessly with a tag per label in the free tag bits,
+        other nodes are keyed by the hash of their label and ID, with the hashed bit set so they can't
+        collide with packed keys.
+        :return: (key, exact key to verify a matching hash against, None for packed keys)
+        """
+        key = pack_variant_id(id) if isinstance(id, str) else None
+        if key is not None:
+            tag = self.variant_tags.get(label, None)
+            if tag is None and len(self.variant_tags) < 15:
+                tag = len(self.variant_tags) + 1
+                self.variant_tags[label] = tag
+            if tag is not None:
+                return key | (tag << VARIANT_KEY_TAG_SHIFT), None
+        exact = f"{label}\x1f{id}"
+        return VARIANT_KEY_HASHED | (hash_key(exact) >> 1), exact
+
+    def check(self, label, id, properties):
+        """
+        :return: a tuple (is_new, properties) where properties are the ones that still need to be written
+        """
+        key, exact = self.node_key(label, id)
+        is_new = self.nodes.add_hash(key, exact)
+        if not is_new:
+            self.duplicates += 1
+
+        if self.policy == "first":
+            return is_new, properties if is_new else {}
+
+        unseen = {}
+        for k, v in properties.items():
+            if v is None or v == "":
+                # not written, a later occurrence may still set it
+                continue
+            if self.properties.add(f"{key if exact is None else exact}\x1f{k}"):
+                unseen[k] = v
+            else:
+                self.repeated_properties += 1
+        return is_new, unseen
+
+    def close(self):
+        logger.info(f"Dropped {self.duplicates} duplicate nodes")
+        if self.repeated_properties > 0:
+            logger.info(f"Kept the first value of {self.repeated_properties} properties set again by duplicates")
+        collisions = len(self.nodes.collisions)
+        if self.properties is not None:
+            collisions += len(self.properties.collisions)
+        if collisions > 0:
+            logger.info(f"Resolved {collisions} key hash collisions by comparing the keys")
+        self.nodes.close()
+        if self.properties is not None:
+            self.properties.close()
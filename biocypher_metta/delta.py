@@ -0,0 +1,118 @@
+"""
+Compare two builds and write the atoms added and removed between them, so a loaded space can be updated
+instead of reloaded when a source releases a new version
+
+    python -m biocypher_metta.delta --old-dir out_v1 --new-dir out_v2 --output-dir delta_v1_v2
+
+Every MeTTa/Prolog output file (plain or block compressed) is compared with the file of the same path in the
+other build through a SeenSet of the atoms of the other file: looked up by 64-bit hash and verified against
+the exact atom, spilled to disk beyond the memory budget. The atoms only in the new file are written to
+<output-dir>/add/<path>, the ones only in the old file to <output-dir>/remove/<path>, and a delta.json
+summary lists the counts per file. Apply it with scripts/metta_space_import.py --delta-dir.
+"""
+import gzip
+import json
+import pathlib
+import typer
+from typing_extensions import Annotated
+from biocypher._logger import logger
+from biocypher_metta.dedup import SeenSet
+
+TEXT_SUFFIXES = [".metta", ".pl"]
+
+
+def find_text_files(build_dir):
+    """
+    :return: dict of path relative to build_dir (without .gz) -> path of the MeTTa/Prolog files of a build
+    """
+    build_dir = pathlib.Path(build_dir)
+    files = {}
+    for path in sorted(build_dir.rglob("*")):
+        name = path.name[:-3] if path.name.endswith(".gz") else path.name
+        if path.is_file() and pathlib.Path(name).suffix in TEXT_SUFFIXES:
+            files[str(path.relative_to(build_dir).with_name(name))] = path
+    return files
+
+
+def read_atoms(path):
+    with (gzip.open(path, "rt") if path.suffix == ".gz" else open(path)) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def atom_set(path, memory_mb=1024, spill_dir=None):
+    """
+    :return: SeenSet of the atoms of a file, empty if path is None
+    """
+    atoms = SeenSet(spill_dir, max_bytes=memory_mb << 20)
+    if path is not None:
+        for atom in read_atoms(path):
+            atoms.add(atom)
+    return atoms
+
+
+def write_missing(src_path, other_path, dst_path, memory_mb=1024, spill_dir=None):
+    """
+    Copy the atoms of src_path that aren't in other_path to dst_path, once each and in file order
+    :return: number of atoms written
+    """
+    # 3/4 of the budget for the atoms of the other file, the rest for the atoms written
+    other = atom_set(other_path, max(1, memory_mb - memory_mb // 4), spill_dir)
+    written = SeenSet(spill_dir, max_bytes=max(1, memory_mb // 4) << 20)
+    f = None
+    try:
+        for atom in read_atoms(src_path):
+            if atom in other or not written.add(atom):
+                continue
+            if f is None:
+                dst_path.parent.mkdir(parents=True, exist_ok=True)
+                f = open(dst_path, "w")
+            f.write(atom + "\n")
+    finally:
+        if f is not None:
+            f.close()
+        other.close()
+        written.close()
+    return len(written)
+
+
+def diff_builds(old_dir, new_dir, output_dir, memory_mb=1024):
+    """
+    Write the add/remove files of every output file that differs between the builds.
+    :param memory_mb: memory budget of the atom sets, they spill to output_dir beyond it
+    :return: dict of relative path -> {"added": n, "removed": n} of the files that differ
+    """
+    output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    old_files = find_text_files(old_dir)
+    new_files = find_text_files(new_dir)
+    summary = {}
+    for path in sorted(set(old_files) | set(new_files)):
+        old, new = old_files.get(path, None), new_files.get(path, None)
+        added = write_missing(new, old, output_dir / "add" / path, memory_mb, output_dir) if new is not None else 0
+        removed = write_missing(old, new, output_dir / "remove" / path, memory_mb, output_dir) if old is not None else 0
+        if added == 0 and removed == 0:
+            continue
+        summary[path] = {"added": added, "removed": removed}
+        logger.info(f"{path}: {added} atoms added, {removed} removed")
+    with open(output_dir / "delta.json", "w") as f:
+        json.dump({"old": str(old_dir), "new": str(new_dir), "files": summary}, f, indent=2)
+    return summary
+
+
+app = typer.Typer()
+
+
+@app.command()
+def main(old_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=False, dir_okay=True)],
+         new_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=False, dir_okay=True)],
+         output_dir: Annotated[pathlib.Path, typer.Option(file_okay=False, dir_okay=True)],
+         memory: int = typer.Option(1024, help="Memory budget (MB) of the atom sets before they spill to disk")):
+    diff_builds(old_dir, new_dir, output_dir, memory_mb=memory)
+    logger.info("Done")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,351 @@
+"""
+Referential integrity check of a MeTTa build: finds the edges whose source or target node was never written
+
+    python -m biocypher_metta.integrity --build-dir out [--prune]
+
+The node IDs of the node files listed in manifest.json are collected as 64-bit hashes per node label, then the
+edge files are streamed against them. An edge endpoint (<type> <id>) resolves to the nodes of the labels of
+its schema type and its subtypes. If the hashes don't fit the memory budget, the hash range is split and
+the edge files are read once per part. The dangling edges per edge label, with sample IDs, are written to
+<build-dir>/integrity.json; --prune removes the dangling edges and their property atoms from the output files.
+"""
+import collections
+import gzip
+import json
+import math
+import os
+import pathlib
+import re
+import shutil
+import tempfile
+import numpy as np
+import typer
+import yaml
+from typing_extensions import Annotated
+from biocypher._logger import logger
+from biocypher_metta.bgzf import BgzfWriter
+from biocypher_metta.dedup import hash_key
+
+_NODE_ATOM = r"\((\S+) ([^()\s]+)\)"
+_EDGE_ATOM = r"\((\S+) \((\S+) ([^()\s]+)\) \((\S+) ([^()\s]+)\)\)"
+NODE_RE = re.compile(rf"^{_NODE_ATOM}$")
+EDGE_RE = re.compile(rf"^({_EDGE_ATOM})$")
+EDGE_RECORD_RE = re.compile(rf"^\(\S+_record ({_EDGE_ATOM})")
+
+
+def first_argument(line):
+    """
+    :return: the first argument of an atom if it is an expression, e.g. the edge atom of a property atom,
+    else None
+    """
+    start = line.find(" ") + 1
+    if start == 0 or start >= len(line) or line[start] != "(":
+        return None
+    depth = 0
+    i = start
+    while i < len(line):
+        c = line[i]
+        if c == "\\":
+            i += 1
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                return line[start:i + 1]
+        i += 1
+    return None
+
+
+def property_subject(line):
+    """
+    :return: the node or edge atom a property atom is about, following the (<key> <subject>) subjects of the
+    keys of dict properties down, e.g. the edge of (k2 (k1 (edge ...)) v); None if it has none
+    """
+    subject = first_argument(line)
+    while subject is not None and EDGE_RE.match(subject) is None and NODE_RE.match(subject) is None:
+        subject = first_argument(subject)
+    return subject
+
+
+def type_labels(schema_config):
+    """
+    :return: dict of schema type (as written in edge atoms) -> set of the node labels of the type and its subtypes
+    """
+    with open(schema_config) as f:
+        schema = yaml.safe_load(f)
+
+    def name(s):
+        return s.replace(" ", "_").lower()
+
+    children = collections.defaultdict(set)
+    labels = collections.defaultdict(set)
+    for k, v in schema.items():
+        if not isinstance(v, dict):
+            continue
+        parents = v.get("is_a", None) or []
+        for parent in parents if isinstance(parents, list) else [parents]:
+            children[name(parent)].add(name(k))
+        if v.get("represented_as", None) == "node":
+            input_labels = v["input_label"] if isinstance(v["input_label"], list) else [v["input_label"]]
+            labels[name(k)].update(name(l) for l in input_labels)
+
+    def resolve(type, seen):
+        result = set(labels[type])
+        for child in children[type]:
+            if child not in seen:
+                seen.add(child)
+                result |= resolve(child, seen)
+        return result
+
+    return {type: resolve(type, {type}) for type in set(labels) | set(children)}
+
+
+def read_lines(path):
+    with (gzip.open(path, "rt") if path.suffix == ".gz" else open(path)) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+class IdSets:
+    """
+    Hashes of the node IDs per label, buffered in memory and spilled to .npy chunks. load(lo, hi) returns
+    the sorted unique hashes of every label within [lo, hi).
+    """
+
+    def __init__(self, spill_dir, chunk_size=1_000_000):
+        self.spill_dir = pathlib.Path(spill_dir)
+        self.chunk_size = chunk_size
+        self.buffers = collections.defaultdict(list)
+        self.chunks = collections.defaultdict(list)
+        self.count = 0
+
+    def add(self, label, id):
+        buffer = self.buffers[label]
+        buffer.append(hash_key(id))
+        self.count += 1
+        if len(buffer) >= self.chunk_size:
+            self._spill(label)
+
+    def _spill(self, label):
+        path = self.spill_dir / f"ids_{len(self.chunks[label])}_{hash_key(label)}.npy"
+        np.save(path, np.unique(np.array(self.buffers[label], dtype=np.uint64)))
+        self.chunks[label].append(path)
+        self.buffers[label] = []
+
+    def close(self):
+        for label in list(self.buffers):
+            if self.buffers[label]:
+                self._spill(label)
+
+    def load(self, lo, hi):
+        sets = {}
+        for label, paths in self.chunks.items():
+            parts = []
+            for path in paths:
+                chunk = np.load(path, mmap_mode="r")
+                end = len(chunk) if hi >= 1 << 64 else np.searchsorted(chunk, np.uint64(hi))
+                parts.append(np.asarray(chunk[np.searchsorted(chunk, np.uint64(lo)):end]))
+            sets[label] = np.unique(np.concatenate(parts))
+        return sets
+
+
+class IntegrityChecker:
+    """
+    :param by_label: resolve edge endpoints against the nodes of their type only, else against all node IDs
+    :param memory_mb: memory budget of the node ID hashes, the edges are read once per part of the hash range
+    that fits it
+    """
+
+    def __init__(self, build_dir, schema_config="config/schema_config.yaml", by_label=True, memory_mb=1024,
+                 sample_size=5, batch_size=100_000):
+        self.build_dir = pathlib.Path(build_dir)
+        with open(self.build_dir / "manifest.json") as f:
+            self.manifest = json.load(f)
+        self.type_labels = type_labels(schema_config) if by_label else None
+        self.memory_mb = memory_mb
+        self.sample_size = sample_size
+        self.batch_size = batch_size
+
+    def files(self, kind, atoms=("topology", None)):
+        paths = []
+        for path, entry in self.manifest["files"].items():
+            if entry["format"] != "metta":
+                continue
+            if entry["kind"] == kind and entry.get("atoms", None) in atoms:
+                paths.append(path)
+        return paths
+
+    def collect_ids(self, id_sets):
+        for path in self.files("nodes"):
+            for line in read_lines(self.build_dir / path):
+                # record atoms (--record-atoms) follow their node atom
+                m = NODE_RE.match(line)
+                if m is not None:
+                    id_sets.add(m.group(1).lower() if self.type_labels is not None else "", m.group(2))
+        id_sets.close()
+
+    def check(self):
+        """
+        :return: (dict of edge label -> edge count, dangling edge count, missing source and target count and
+        sample endpoints, sorted hashes of the dangling edge atoms)
+        """
+        report = collections.defaultdict(lambda: {"edges": 0, "dangling": 0, "missing_sources": 0,
+                                                  "missing_targets": 0, "samples": []})
+        tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix="integrity_", dir=self.build_dir))
+        try:
+            id_sets = IdSets(tmp_dir)
+            self.collect_ids(id_sets)
+            # hashes, their sorted unique copy and the union of the labels of a type
+            parts = max(1, math.ceil(id_sets.count * 8 * 3 / (self.memory_mb * 1024 * 1024)))
+            logger.info(f"Collected {id_sets.count} node IDs, checking the edges in {parts} part(s)")
+            bounds = [(1 << 64) * part // parts for part in range(parts + 1)]
+            # edge label -> hashes of its dangling edge atoms
+            dangling = collections.defaultdict(list)
+            for part in range(parts):
+                sets = id_sets.load(bounds[part], bounds[part + 1])
+                self.check_part(sets, bounds[part], bounds[part + 1], part == 0, report, dangling)
+            hashes = [np.empty(0, dtype=np.uint64)]
+            for label, label_hashes in dangling.items():
+                # an edge may be found in several parts, by its source and by its target
+                label_hashes = np.unique(np.array(label_hashes, dtype=np.uint64))
+                report[label]["dangling"] = int(len(label_hashes))
+                hashes.append(label_hashes)
+            hashes = np.unique(np.concatenate(hashes))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return dict(report), hashes
+
+    def type_set(self, sets, type, cache):
+        ids = cache.get(type, None)
+        if ids is None:
+            if self.type_labels is None:
+                labels = sets.keys()
+            else:
+                labels = self.type_labels.get(type, {type})
+            parts = [sets[l] for l in labels if l in sets]
+            ids = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.uint64)
+            cache[type] = ids
+        return ids
+
+    def check_part(self, sets, lo, hi, count_edges, report, dangling):
+        """
+        Check the endpoints whose ID hash is in [lo, hi), adds the hashes of the dangling edge atoms to dangling
+        """
+        cache = {}
+
+        def check_batch(batch):
+            # batch: list of (atom, label, source type, source id, target type, target id)
+            missing = np.zeros(len(batch), dtype=bool)
+            for side, (t, i) in (("missing_sources", (2, 3)), ("missing_targets", (4, 5))):
+                h = np.fromiter((hash_key(e[i]) for e in batch), dtype=np.uint64, count=len(batch))
+                in_part = h >= np.uint64(lo)
+                if hi < 1 << 64:
+                    in_part &= h < np.uint64(hi)
+                types = np.array([e[t] for e in batch], dtype=object)
+                for type in set(types[in_part]):
+                    mask = in_part & (types == type)
+                    ids = self.type_set(sets, type, cache)
+                    side_missing = np.zeros(len(batch), dtype=bool)
+                    side_missing[mask] = ~np.isin(h[mask], ids)
+                    for j in np.flatnonzero(side_missing):
+                        entry = report[batch[j][1]]
+                        entry[side] += 1
+                        if len(entry["samples"]) < self.sample_size:
+                            entry["samples"].append(f"({batch[j][t]} {batch[j][i]})")
+                    missing |= side_missing
+            for j in np.flatnonzero(missing):
+                dangling[batch[j][1]].append(hash_key(batch[j][0]))
+
+        for path in self.files("edges"):
+            batch = []
+            for line in read_lines(self.build_dir / path):
+                m = EDGE_RE.match(line)
+                if m is None:
+                    continue
+                atom, label, source_type, source_id, target_type, target_id = m.groups()
+                if count_edges:
+                    report[label]["edges"] += 1
+                batch.append((atom, label, source_type.lower(), source_id, target_type.lower(), target_id))
+                if len(batch) >= self.batch_size:
+                    check_batch(batch)
+                    batch = []
+            if batch:
+                check_batch(batch)
+
+    def prune(self, hashes):
+        """
+        Remove the dangling edge atoms and the atoms of their properties from the edge files
+        :return: number of removed edges
+        """
+        removed = 0
+        for path in self.files("edges", atoms=("topology", "properties", None)):
+            entry = self.manifest["files"][path]
+            src = self.build_dir / path
+            tmp = src.with_name(src.name + ".tmp")
+            dropped = 0
+            last = None
+            out = BgzfWriter(str(tmp)) if entry.get("compression", None) == "bgzf" else \
+                (gzip.open(tmp, "wb") if src.suffix == ".gz" else open(tmp, "wb"))
+            try:
+                for line in read_lines(src):
+                    m = EDGE_RE.match(line) or EDGE_RECORD_RE.match(line)
+                    atom = m.group(1) if m is not None else property_subject(line)
+                    if atom is not None:
+                        h = hash_key(atom)
+                        i = np.searchsorted(hashes, np.uint64(h))
+                        if i < len(hashes) and int(hashes[i]) == h:
+                            # one record per atom, its property atoms follow it or each other
+                            if h != last:
+                                dropped += 1
+                                last = h
+                            continue
+                    out.write((line + "\n").encode())
+            finally:
+                out.close()
+            os.replace(tmp, src)
+            if isinstance(out, BgzfWriter):
+                os.replace(f"{tmp}.gzi", f"{src}.gzi")
+            entry["records"] -= dropped
+            if entry.get("atoms", None) != "properties":
+                removed += dropped
+            if dropped:
+                logger.info(f"{path}: removed {dropped} dangling edges")
+        with open(self.build_dir / "manifest.json", "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        if any(index["kind"] == "offset" for index in self.manifest.get("indexes", {}).values()):
+            logger.warning("The offset index of the build is out of date after pruning, rebuild it")
+        return removed
+
+
+app = typer.Typer()
+
+
+@app.command()
+def main(build_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=False, dir_okay=True)],
+         schema_config: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=True, dir_okay=False)]
+         = pathlib.Path("config/schema_config.yaml"),
+         by_label: bool = typer.Option(True, help="Resolve edge endpoints against the nodes of their type "
+                                                  "(and subtypes) only, else against all node IDs"),
+         memory: int = typer.Option(1024, help="Memory budget (MB) of the node ID sets"),
+         sample_size: int = typer.Option(5, help="Dangling endpoint IDs to report per edge label"),
+         prune: bool = typer.Option(False, help="Remove the dangling edges and their properties from the build")):
+    checker = IntegrityChecker(build_dir, schema_config, by_label=by_label, memory_mb=memory,
+                               sample_size=sample_size)
+    report, hashes = checker.check()
+    for label, entry in sorted(report.items()):
+        if entry["missing_sources"] or entry["missing_targets"]:
+            logger.info(f"{label}: {entry['missing_sources']} missing sources, {entry['missing_targets']} "
+                        f"missing targets of {entry['edges']} edges, e.g. {', '.join(entry['samples'])}")
+    logger.info(f"{len(hashes)} dangling edges")
+    if prune and len(hashes) > 0:
+        checker.prune(hashes)
+    with open(build_dir / "integrity.json", "w") as f:
+        json.dump({"dangling": int(len(hashes)), "pruned": prune, "labels": report}, f, indent=2)
+    logger.info("Done")
+
+
+if __name__ == "__main__":
+    app()
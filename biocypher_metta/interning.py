@@ -0,0 +1,50 @@
+import string
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+
+
+class IdInterner:
+    """
+    Assigns compact symbols to entity IDs in order of first appearance, so that long IDs such as
+    chr16_53800954_T_C_GRCh38 are written once in a dictionary file instead of in every atom.
+    Formats:
+        int    - 0, 1, 2, ...
+        base62 - _0, _1, ..., _Z, _10, ... (case sensitive)
+    """
+    FORMATS = ["int", "base62"]
+
+    def __init__(self, id_format="base62", prefix="_"):
+        if id_format not in IdInterner.FORMATS:
+            raise ValueError('Invalid id format. Allowed values: ' +
+                             ','.join(IdInterner.FORMATS))
+        self.id_format = id_format
+        self.prefix = prefix
+        self.ids = {}
+
+    def encode(self, n):
+        if self.id_format == "int":
+            return str(n)
+        digits = []
+        while True:
+            n, r = divmod(n, 62)
+            digits.append(BASE62_ALPHABET[r])
+            if n == 0:
+                break
+        return self.prefix + "".join(reversed(digits))
+
+    def intern(self, id):
+        n = self.ids.get(id, None)
+        if n is None:
+            n = len(self.ids)
+            self.ids[id] = n
+        return self.encode(n)
+
+    def items(self):
+        """
+        Yields (symbol, original id) tuples in order of assignment
+        """
+        for id, n in self.ids.items():
+            yield self.encode(n), id
+
+    def __len__(self):
+        return len(self.ids)
@@ -0,0 +1,182 @@
+"""
+Genomic interval index of positional nodes, written next to the output files of a build
+
+    <outdir>/interval_index/<label>/index.json
+    <outdir>/interval_index/<label>/<chr>.start.npy   sorted start positions
+    <outdir>/interval_index/<label>/<chr>.end.npy     end positions, same order
+    <outdir>/interval_index/<label>/<chr>.id.npy      node IDs, same order
+    <outdir>/interval_index/<label>/hashed_ids.json   with variant keys, the IDs that couldn't be packed
+
+The arrays are plain .npy files, loaded memory-mapped so a region query is a binary search:
+
+    python -m biocypher_metta.interval_index --index-dir out/gencode/interval_index/gene --region chr16:53000000-56000000
+"""
+import json
+import pathlib
+import shutil
+import tempfile
+from typing import List
+import numpy as np
+import typer
+from typing_extensions import Annotated
+from biocypher._logger import logger
+from biocypher_metta.adapters.helpers import VariantKeyTable, decode_variant_keys, encode_variant_ids, pack_variant_id
+
+INDEX_DIR = "interval_index"
+
+
+class IntervalIndexBuilder:
+    """
+    Collects the (chr, start, end, id) intervals of one label. Buffered intervals are spilled to chunk files
+    every chunk_size intervals, on close each chromosome is sorted by start on its own, so memory is bounded by
+    the size of the largest chromosome. If (nearly) all IDs are variant IDs they are stored as packed 64-bit
+    variant keys instead of strings, the few that can't be packed get collision-safe hashed keys.
+    """
+
+    def __init__(self, index_dir, spill_dir=None, chunk_size=1_000_000):
+        self.index_dir = pathlib.Path(index_dir)
+        self.chunk_size = chunk_size
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix="intervals_", dir=spill_dir))
+        self.buffers = {}
+        self.chunks = {}
+        self.buffered = 0
+        self.count = 0
+        self._chunk_count = 0
+        # the keys of the IDs that can't be packed, None once there are too many of them for variant keys
+        self.key_table = VariantKeyTable()
+
+    def add(self, chr, start, end, id):
+        buffer = self.buffers.get(chr, None)
+        if buffer is None:
+            buffer = ([], [], [])
+            self.buffers[chr] = buffer
+        buffer[0].append(start)
+        buffer[1].append(end)
+        buffer[2].append(id)
+        self.buffered += 1
+        self.count += 1
+        if self.key_table is not None and pack_variant_id(id) is None:
+            if len(self.key_table.hashed) >= max(1000, self.count // 100):
+                self.key_table = None
+            else:
+                self.key_table.key(id)
+        if self.buffered >= self.chunk_size:
+            self._spill()
+
+    def _spill(self):
+        for chr, (starts, ends, ids) in self.buffers.items():
+            chunks = self.chunks.setdefault(chr, [])
+            path = self.tmp_dir / f"chunk_{self._chunk_count}.npz"
+            self._chunk_count += 1
+            np.savez(path, start=np.array(starts, dtype=np.int64), end=np.array(ends, dtype=np.int64),
+                     id=np.array([id.encode() for id in ids], dtype=np.bytes_))
+            chunks.append(path)
+        self.buffers = {}
+        self.buffered = 0
+
+    def close(self):
+        """
+        Sort and write the index.
+        :return: the index metadata, chromosome -> {file, count, max_length}
+        """
+        self._spill()
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        chromosomes = {}
+        for i, (chr, chunks) in enumerate(self.chunks.items()):
+            loaded = [np.load(path) for path in chunks]
+            starts = np.concatenate([c["start"] for c in loaded])
+            ends = np.concatenate([c["end"] for c in loaded])
+            # the fixed size ID strings of the chunks are widened to the longest one
+            ids = np.concatenate([c["id"] for c in loaded])
+            if self.key_table is not None:
+                keys, packed = encode_variant_ids(ids)
+                for j in np.nonzero(~packed)[0]:
+                    keys[j] = self.key_table.key(ids[j].decode())
+                ids = keys
+            order = np.argsort(starts, kind="stable")
+            # chromosome names are used as file names, number them in case they aren't safe
+            name = chr if chr.replace("_", "").replace(".", "").isalnum() else f"chr_{i}"
+            np.save(self.index_dir / f"{name}.start.npy", starts[order])
+            np.save(self.index_dir / f"{name}.end.npy", ends[order])
+            np.save(self.index_dir / f"{name}.id.npy", ids[order])
+            chromosomes[chr] = {"file": name, "count": int(len(starts)),
+                                "max_length": int((ends - starts).max()) if len(starts) > 0 else 0}
+        id_format = "string"
+        if self.key_table is not None:
+            id_format = "variant_key"
+            with open(self.index_dir / "hashed_ids.json", "w") as f:
+                json.dump({str(k): id for k, id in self.key_table.hashed.items()}, f)
+        with open(self.index_dir / "index.json", "w") as f:
+            json.dump({"chromosomes": chromosomes, "ids": id_format}, f, indent=2)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        logger.info(f"Wrote interval index of {self.count} records to {self.index_dir}")
+        return chromosomes
+
+
+class IntervalIndex:
+    """
+    Read side of an interval index directory, the arrays are memory-mapped on first use
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = pathlib.Path(index_dir)
+        with open(self.index_dir / "index.json") as f:
+            index = json.load(f)
+        self.chromosomes = index["chromosomes"]
+        self.hashed_ids = None
+        if index.get("ids", "string") == "variant_key":
+            with open(self.index_dir / "hashed_ids.json") as f:
+                self.hashed_ids = {int(k): id for k, id in json.load(f).items()}
+        self.arrays = {}
+
+    def _load(self, chr):
+        arrays = self.arrays.get(chr, None)
+        if arrays is None:
+            name = self.chromosomes[chr]["file"]
+            arrays = tuple(np.load(self.index_dir / f"{name}.{k}.npy", mmap_mode="r") for k in ("start", "end", "id"))
+            self.arrays[chr] = arrays
+        return arrays
+
+    def query(self, chr, start, end):
+        """
+        :return: list of (id, start, end) of the intervals on chr overlapping [start, end], ordered by start
+        """
+        if chr not in self.chromosomes:
+            return []
+        starts, ends, ids = self._load(chr)
+        # intervals starting before start - max_length can't reach start
+        lo = np.searchsorted(starts, start - self.chromosomes[chr]["max_length"], side="left")
+        hi = np.searchsorted(starts, end, side="right")
+        hits = np.nonzero(ends[lo:hi] >= start)[0] + lo
+        if self.hashed_ids is not None:
+            keys = ids[hits]
+            hit_ids = [id if id is not None else self.hashed_ids[int(key)]
+                       for key, id in zip(keys, decode_variant_keys(keys))]
+        else:
+            hit_ids = [ids[i].decode() for i in hits]
+        return [(id, int(starts[i]), int(ends[i])) for id, i in zip(hit_ids, hits)]
+
+
+def parse_region(region):
+    """
+    Parse chr16:53000000-56000000 into ("chr16", 53000000, 56000000)
+    """
+    chr, _, span = region.rpartition(":")
+    start, _, end = span.partition("-")
+    return chr, int(start.replace(",", "")), int(end.replace(",", ""))
+
+
+app = typer.Typer()
+
+
+@app.command()
+def main(index_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=False, dir_okay=True)],
+         region: List[str] = typer.Option(..., help="Region(s) to query, e.g. chr16:53000000-56000000")):
+    index = IntervalIndex(index_dir)
+    for r in region:
+        for id, start, end in index.query(*parse_region(r)):
+            print(f"{id}\t{start}\t{end}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,149 @@
+import io
+import os
+import socket
+import stat
+from biocypher._logger import logger
+from biocypher_metta.metta_writer import MeTTaWriter
+
+
+class AtomConnection:
+    """
+    Sends MeTTa atoms to a loader process (scripts/metta_stream_loader.py) in batches.
+
+    Protocol: every batch is sent as "ATOMS <n bytes>\\n" followed by n bytes of atoms, one per line, and the
+    stream ends with "END\\n". Over a socket the loader answers "ACK\\n" once it imported a batch, or
+    "ERR <message>\\n"; at most window batches are in flight, so a slow loader throttles the build instead of
+    letting the kernel buffers decide. A named pipe is one way, there the blocking pipe is the only flow control.
+
+    :param address: unix:<socket path>, tcp:<host>:<port> or the path of a named pipe (fifo:<path>)
+    """
+
+    def __init__(self, address, batch_bytes=1 << 20, window=4):
+        self.address = address
+        self.batch_bytes = batch_bytes
+        self.window = window
+        self.in_flight = 0
+        self.buffer = io.StringIO()
+        self.atoms = 0
+        self.sock = None
+        self.pipe = None
+        if address.startswith("tcp:"):
+            host, _, port = address[len("tcp:"):].rpartition(":")
+            self.sock = socket.create_connection((host, int(port)))
+        elif address.startswith("fifo:") or (os.path.exists(address) and stat.S_ISFIFO(os.stat(address).st_mode)):
+            path = address[len("fifo:"):] if address.startswith("fifo:") else address
+            self.pipe = open(path, "wb")
+        else:
+            path = address[len("unix:"):] if address.startswith("unix:") else address
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+        if self.sock is not None:
+            self.replies = self.sock.makefile("rb")
+        logger.info(f"Streaming atoms to {address}")
+
+    def write(self, lines):
+        for line in lines:
+            self.buffer.write(line)
+            self.buffer.write("\n")
+        self.atoms += len(lines)
+        if self.buffer.tell() >= self.batch_bytes:
+            self.flush()
+
+    def flush(self):
+        payload = self.buffer.getvalue().encode()
+        if len(payload) == 0:
+            return
+        self.buffer = io.StringIO()
+        if self.sock is not None and self.in_flight >= self.window:
+            self.wait_ack()
+        self._send(f"ATOMS {len(payload)}\n".encode() + payload)
+        if self.sock is not None:
+            self.in_flight += 1
+
+    def wait_ack(self):
+        reply = self.replies.readline().decode().strip()
+        if reply != "ACK":
+            raise RuntimeError(f"The loader at {self.address} failed: {reply or 'connection closed'}")
+        self.in_flight -= 1
+
+    def _send(self, data):
+        if self.sock is not None:
+            self.sock.sendall(data)
+        else:
+            self.pipe.write(data)
+            self.pipe.flush()
+
+    def close(self):
+        self.flush()
+        while self.sock is not None and self.in_flight > 0:
+            self.wait_ack()
+        self._send(b"END\n")
+        if self.sock is not None:
+            self.replies.close()
+            self.sock.close()
+        else:
+            self.pipe.close()
+        logger.info(f"Streamed {self.atoms} atoms to {self.address}")
+
+
+class AtomStream:
+    """
+    Serializes the records of one adapter run into the connection of a MeTTaStreamWriter. It has no output file,
+    so it isn't listed in the manifest.
+    """
+    path = None
+
+    def __init__(self, writer, kind):
+        self.writer = writer
+        self.kind = kind
+        self.serialize = writer.write_edge if kind == "edges" else writer.write_node
+
+    def write(self, record, is_new=True):
+        if is_new:
+            self.writer.connection.write(self.serialize(record))
+        else:
+            self.writer.connection.write(self.writer.write_update(self.kind, record))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class MeTTaStreamWriter(MeTTaWriter):
+    """
+    MeTTa sink that streams the atoms to a running loader process (scripts/metta_stream_loader.py) instead of
+    writing .metta files, so a space can be built and loaded without intermediate files. The type definitions
+    are sent first (and still written to type_defs.metta).
+    """
+
+    def __init__(self, schema_config, biocypher_config,
+                 output_dir, bcy=None, address="unix:/tmp/metta_stream.sock", batch_bytes=1 << 20, window=4,
+                 **writer_args):
+        super().__init__(schema_config, biocypher_config, output_dir, bcy=bcy, **writer_args)
+        self.connection = AtomConnection(address, batch_bytes=batch_bytes, window=window)
+        with open(f"{self.output_path}/type_defs.metta") as f:
+            self.connection.write(f.read().splitlines())
+
+    def open_stream(self, kind, path_prefix=None, create_dir=True):
+        return AtomStream(self, kind)
+
+    def write_inverse_rules(self, inverses):
+        super().write_inverse_rules(inverses)
+        rules = io.StringIO()
+        self.create_inverse_rules(rules, inverses)
+        self.connection.write(rules.getvalue().splitlines())
+
+    def close(self):
+        # the rules have to be sent before the connection is closed
+        self.flush_inverse_rules()
+        if self.record_mode and self.record_layouts:
+            accessors = io.StringIO()
+            self.create_record_accessors(accessors)
+            self.connection.write(accessors.getvalue().splitlines())
+        self.connection.close()
+        super().close()
@@ -1,30 +1,26 @@
 # Author Abdulrahman S. Omar <xabush@singularitynet.io>
-from biocypher import BioCypher
-import pathlib
-import os
 from biocypher._logger import logger
-import networkx as nx
+from biocypher_metta.base_writer import BaseWriter
 
-class MeTTaWriter:
+class MeTTaWriter(BaseWriter):
+    file_extension = "metta"
+    inverse_rules = True
 
     def __init__(self, schema_config, biocypher_config,
-                 output_dir):
-        self.schema_config = schema_config
-        self.biocypher_config = biocypher_config
-        self.output_path = pathlib.Path(output_dir)
-
-        if not os.path.exists(output_dir):
-            self.output_path.mkdir()
-
-        self.bcy = BioCypher(schema_config_path=schema_config,
-                             biocypher_config_path=biocypher_config)
-
-        self.onotology = self.bcy._get_ontology()
+                 output_dir, bcy=None, record_mode=False, **pipeline_args):
+        super().__init__(schema_config, biocypher_config, output_dir, bcy=bcy, **pipeline_args)
+        # In record mode the properties of each node/edge are written as a single positional atom
+        # (<label>_record <node or edge atom> <value 1> ... <value n>) instead of one atom per property,
+        # next to the node/edge atom itself so existence and topology queries keep matching.
+        # The layout of the values is fixed per label (see create_record_layout) and accessor functions
+        # for every property are appended to type_defs.metta on close.
+        if record_mode and self.property_layout != "inline":
+            raise ValueError("Record atoms hold the property values, they can't be written with a separate "
+                             "property layout")
+        self.record_mode = record_mode
+        self.record_layouts = {}
         self.create_type_hierarchy()
 
-        #self.excluded_properties = ["licence", "version", "source"]
-        self.excluded_properties = []
-
     def create_type_hierarchy(self):
         G = self.onotology._nx_graph
         file_path = f"{self.output_path}/type_defs.metta"
@@ -46,7 +42,6 @@ class MeTTaWriter:
 
     def create_data_constructors(self, file):
         schema = self.bcy._get_ontology_mapping()._extend_schema()
-        self.edge_node_types = {}
         def edge_data_constructor(edge_type, source_type, target_type, label):
             return f"(: {label.lower()} (-> {source_type.upper()} {target_type.upper()} {edge_type.upper()}))"
 
@@ -70,11 +65,8 @@ class MeTTaWriter:
                         source_type = self.convert_input_labels(source_type)
                         target_type = self.convert_input_labels(target_type)
 
-                    output_label = v.get("output_label", None)
                     out_str = edge_data_constructor(edge_type, source_type, target_type, label)
                     file.write(out_str + "\n")
-                    self.edge_node_types[label.lower()] = {"source": source_type.lower(), "target":
-                        target_type.lower(), "output_label": output_label.lower() if output_label is not None else None}
 
             elif v["represented_as"] == "node":
                 label = v["input_label"]
@@ -87,62 +79,159 @@ class MeTTaWriter:
                     out_str = node_data_constructor(node_type, l)
                     file.write(out_str + "\n")
 
-
-    def write_nodes(self, nodes, path_prefix=None, create_dir=True):
-        if path_prefix is not None:
-            file_path = f"{self.output_path}/{path_prefix}/nodes.metta"
-            if create_dir:
-                if not os.path.exists(f"{self.output_path}/{path_prefix}"):
-                    pathlib.Path(f"{self.output_path}/{path_prefix}").mkdir(parents=True, exist_ok=True)
-        else:
-            file_path = f"{self.output_path}/nodes.metta"
-        with open(file_path, "a") as f:
-            for node in nodes:
-                out_str = self.write_node(node)
-                for s in out_str:
-                    f.write(s + "\n")
-
-            f.write("\n")
-
-        logger.info("Finished writing out nodes")
-
-
-
-    def write_edges(self, edges, path_prefix=None, create_dir=True):
-        if path_prefix is not None:
-            file_path = f"{self.output_path}/{path_prefix}/edges.metta"
-            if create_dir:
-                if not os.path.exists(f"{self.output_path}/{path_prefix}"):
-                    pathlib.Path(f"{self.output_path}/{path_prefix}").mkdir(parents=True, exist_ok=True)
-        else:
-            file_path = f"{self.output_path}/edges.metta"
-
-        with open(file_path, "a") as f:
-            for edge in edges:
-                out_str = self.write_edge(edge)
-                for s in out_str:
-                    f.write(s + "\n")
-
-            f.write("\n")
-
-    def write_node(self, node):
+    def write_node(self, node, record_mode=None):
         id, label, properties = node
         if "." in label:
             label = label.split(".")[1]
-        def_out = f"({self.convert_input_labels(label)} {id})"
+        label = self.convert_input_labels(label)
+        def_out = f"({label} {id})"
+        if record_mode if record_mode is not None else self.record_mode:
+            return self.write_record(label, def_out, f"({label} $id)", properties)
         return self.write_property(def_out, properties)
 
-    def write_edge(self, edge):
+    def write_edge(self, edge, record_mode=None):
         source_id, target_id, label, properties = edge
         label = label.lower()
+        input_label = label
         source_type = self.edge_node_types[label]["source"]
         target_type = self.edge_node_types[label]["target"]
         output_label = self.edge_node_types[label]["output_label"]
         if output_label is not None:
             label = output_label
         def_out = f"({label} ({source_type} {source_id}) ({target_type} {target_id}))"
+        if record_mode if record_mode is not None else self.record_mode:
+            # several input labels can share an output label, so records are named after the input label
+            return self.write_record(input_label, def_out, f"({label} ({source_type} $src) ({target_type} $tgt))",
+                                     properties)
         return self.write_property(def_out, properties)
 
+    def write_update(self, kind, record):
+        if not self.record_mode:
+            return super().write_update(kind, record)
+        # the record atom was already written, add the new properties as property atoms, which the record
+        # accessors read as well
+        if kind == "nodes":
+            return self.write_node(record, record_mode=False)[1:]
+        return self.write_edge(record, record_mode=False)[1:]
+
+    def create_record_layout(self, label, properties):
+        """
+        The positions of the values in the records of a label: the properties declared in the schema in
+        schema order, followed by the undeclared properties of the first record. Dict values get a
+        nested layout of their keys. Properties that are not in the layout are written as property atoms.
+        :return: list of (property, nested layout or None) tuples
+        """
+        def layout_of(keys, values):
+            return [(k, layout_of(values[k].keys(), values[k]) if isinstance(values.get(k), dict) else None)
+                    for k in keys if k not in self.excluded_properties]
+
+        keys = list(self.label_properties.get(label.lower(), {}))
+        keys.extend(k for k in properties if k not in keys)
+        return layout_of(keys, properties)
+
+    def write_record(self, label, def_out, head_pattern, properties):
+        if label not in self.record_layouts:
+            self.record_layouts[label] = (head_pattern, self.create_record_layout(label, properties))
+        _, layout = self.record_layouts[label]
+        values, rest = self.record_values(layout, properties)
+        out_str = [def_out, f"({label}_record {def_out} {' '.join(values)})"]
+        if rest:
+            out_str.extend(self.write_property(def_out, rest)[1:])
+        return out_str
+
+    def record_values(self, layout, properties):
+        """
+        :return: the values of properties in layout order, and a dict of the properties that don't fit the layout
+        """
+        values = []
+        rest = {}
+        for k, nested_layout in layout:
+            v = properties.get(k, None)
+            if v is None or v == "":
+                values.append("()")
+            elif nested_layout is not None and isinstance(v, dict):
+                nested_values, nested_rest = self.record_values(nested_layout, v)
+                values.append(f"({' '.join(nested_values)})")
+                if nested_rest:
+                    rest[k] = nested_rest
+            elif nested_layout is not None or isinstance(v, dict):
+                values.append("()")
+                rest[k] = v
+            else:
+                values.append(self.format_value(v))
+        in_layout = set(k for k, _ in layout)
+        for k, v in properties.items():
+            if k not in in_layout and k not in self.excluded_properties:
+                rest[k] = v
+        return values, rest
+
+    def create_record_accessors(self, file):
+        """
+        Write (= (<property> <node or edge atom>) <value>) functions that look up the values of records, and
+        the values of property atoms (written for the properties merged into a node by the deduplicator)
+        """
+        for label, (head_pattern, layout) in self.record_layouts.items():
+            accessors = []
+            counter = [0]
+
+            def pattern_of(layout, path):
+                variables = []
+                for k, nested_layout in layout:
+                    if nested_layout is not None:
+                        variables.append(f"({pattern_of(nested_layout, path + [k])})")
+                    else:
+                        var = f"$v{counter[0]}"
+                        counter[0] += 1
+                        variables.append(var)
+                        accessors.append((path + [k], var))
+                return " ".join(variables)
+
+            record_pattern = f"({label}_record {head_pattern} {pattern_of(layout, [])})"
+            for path, var in accessors:
+                subject = head_pattern
+                for k in path[:-1]:
+                    subject = f"({k} {subject})"
+                function = f"({path[-1]} {subject})"
+                file.write(f"(= {function} (match &self {record_pattern} {var}))\n")
+                file.write(f"(= {function} (match &self ({path[-1]} {subject} $value) $value))\n")
+
+    def create_inverse_rules(self, file, inverses):
+        """
+        Write (= (<inverse> (<target type> $t) (<source type> $s)) ...) functions that derive the inverse
+        edges from the stored ones
+        """
+        for label, inverse in inverses.items():
+            types = self.edge_node_types[label]
+            edge = f"({types['output_label'] or label} ({types['source']} $s) ({types['target']} $t))"
+            inverse_edge = f"({self.edge_node_types[inverse]['output_label'] or inverse} " \
+                           f"({types['target']} $t) ({types['source']} $s))"
+            file.write(f"(= {inverse_edge} (match &self {edge} {inverse_edge}))\n")
+
+    def write_inverse_rules(self, inverses):
+        with open(f"{self.output_path}/type_defs.metta", "a") as f:
+            self.create_inverse_rules(f, inverses)
+
+    def format_value(self, v):
+        if isinstance(v, list):
+            return "(" + " ".join(self.format_element(e) for e in v) + ")"
+        return f"{self.check_property(v)}"
+
+    def format_element(self, e):
+        # a missing element, e.g. of a property an aggregated edge (see EdgeAggregator) didn't have, is ()
+        return "()" if e is None else f"{self.check_property(e)}"
+
+    def write_id_dictionary(self, interner):
+        with open(f"{self.output_path}/id_dictionary.metta", "w") as f:
+            for symbol, id in interner.items():
+                f.write(f"(original_id {symbol} {self.check_property(id)})\n")
+
+    def close(self):
+        if self.record_mode and self.record_layouts:
+            with open(f"{self.output_path}/type_defs.metta", "a") as f:
+                self.create_record_accessors(f)
+            logger.info("Record accessors created successfully.")
+        super().close()
+
 
     def write_property(self, def_out, property):
         out_str = [def_out]
@@ -151,7 +240,7 @@ class MeTTaWriter:
             if isinstance(v, list):
                 prop = "("
                 for i, e in enumerate(v):
-                    prop += f'{self.check_property(e)}'
+                    prop += self.format_element(e)
                     if i != len(v) - 1: prop += " "
                 prop += ")"
                 out_str.append(f'({k} {def_out} {prop})')
@@ -161,35 +250,3 @@ class MeTTaWriter:
             else:
                 out_str.append(f'({k} {def_out} {self.check_property(v)})')
         return out_str
-
-    def check_property(self, prop):
-        if isinstance(prop, str):
-            if " " in prop:
-                prop = prop.replace(" ", "_")
-
-            special_chars = ["(", ")"]
-            escape_char = "\\"
-            return "".join(escape_char + c if c in special_chars or c == escape_char else c for c in prop)
-
-        return prop
-
-    def convert_input_labels(self, label, replace_char="_"):
-        """
-        A method that removes spaces in input labels and replaces them with replace_char
-        :param label: Input label of a node or edge
-        :param replace_char: the character to replace spaces with
-        :return:
-        """
-        return label.replace(" ", replace_char)
-
-    def get_parent(self, G, node):
-        """
-        Get the immediate parent of a node in the ontology.
-        """
-        return nx.dfs_preorder_nodes(G, node, depth_limit=2)
-
-    def show_ontology_structure(self):
-        self.bcy.show_ontology_structure()
-
-    def summary(self):
-        self.bcy.summary()
\ No newline at end of file
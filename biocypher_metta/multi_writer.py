@@ -0,0 +1,35 @@
+from biocypher_metta.base_writer import BaseWriter
+
+
+class MultiWriter(BaseWriter):
+    """
+    Fans a single adapter pass out to several writers, e.g. MeTTa and Prolog. Records are parsed and run
+    through the pipeline once, then every writer serializes them into its own dialect and file layout.
+    The writers should share one BioCypher instance (see the bcy argument of BaseWriter).
+    """
+
+    def __init__(self, writers, **pipeline_args):
+        if len(writers) == 0:
+            raise ValueError("MultiWriter needs at least one writer")
+        self.writers = writers
+        first = writers[0]
+        self.schema_config = first.schema_config
+        self.biocypher_config = first.biocypher_config
+        self.output_path = first.output_path
+        self.bcy = first.bcy
+        self.onotology = first.onotology
+        self.edge_node_types = first.edge_node_types
+        self.label_properties = first.label_properties
+        self.edge_inverses = first.edge_inverses
+        self.excluded_properties = []
+        self.sinks = writers
+        self.init_pipeline(**pipeline_args)
+        # the build manifest is kept here, the writers only serialize
+        for writer in writers:
+            writer.manifest = None
+
+    def close(self):
+        self.flush_inverse_rules()
+        for writer in self.writers:
+            writer.close()
+        super().close()
@@ -0,0 +1,304 @@
+import csv
+import gzip
+import os
+import pathlib
+import shlex
+import yaml
+from biocypher._logger import logger
+from biocypher_metta.base_writer import BaseWriter
+from biocypher_metta.sorting import RecordUpdates
+
+# schema_config.yaml property types -> neo4j-admin import header types
+NEO4J_TYPES = {"str": "string", "int": "long", "float": "double", "bool": "boolean"}
+
+
+def neo4j_type(type_name):
+    if type_name.endswith("[]"):
+        return NEO4J_TYPES.get(type_name[:-2], "string") + "[]"
+    return NEO4J_TYPES.get(type_name, "string")
+
+
+def flatten(properties, prefix=""):
+    """
+    Neo4j properties can't be maps, nested dict properties become <property>_<key> columns
+    """
+    flat = {}
+    for k, v in properties.items():
+        if isinstance(v, dict):
+            flat.update(flatten(v, f"{prefix}{k}_"))
+        else:
+            flat[f"{prefix}{k}"] = v
+    return flat
+
+
+def coerce(type_name, v):
+    """
+    Format a value as a value of a neo4j-admin import type
+    :raise ValueError: if it isn't one
+    """
+    if type_name == "long":
+        if isinstance(v, bool):
+            raise ValueError(v)
+        if isinstance(v, float) and v.is_integer():
+            v = int(v)
+        return str(v if isinstance(v, int) else int(str(v).strip()))
+    if type_name == "double":
+        if isinstance(v, bool):
+            raise ValueError(v)
+        return str(float(v))
+    if type_name == "boolean":
+        s = str(v).lower()
+        if s not in ("true", "false"):
+            raise ValueError(v)
+        return s
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    return str(v)
+
+
+class LabelCSV:
+    """
+    One neo4j-admin import part: a header file and a data file for the records of one label.
+    The rows are spilled to <part>.csv.tmp while the label is written, the columns grow with the properties
+    of the records. On finish the data file is written with the union of the columns. A list value turns the
+    column of a declared type into an array column, a value that doesn't parse as the declared type into a
+    string column.
+    """
+
+    def __init__(self, writer, path, kind, label, property_types):
+        self.writer = writer
+        self.kind = kind
+        self.label = label
+        self.header_path = f"{path}-header.csv"
+        self.data_path = f"{path}.csv.gz" if writer.compress else f"{path}.csv"
+        self.tmp_path = f"{path}.csv.tmp"
+        # column -> neo4j type of the declared properties
+        self.types = {k: neo4j_type(t) for k, t in property_types.items()}
+        self.columns = list(property_types)
+        self.column_index = {k: i for i, k in enumerate(self.columns)}
+        self.file = open(self.tmp_path, "w", newline="")
+        self.csv = csv.writer(self.file, lineterminator="\n")
+
+    def format_value(self, k, v):
+        if v is None or v == "":
+            return ""
+        type_name = self.types.get(k, "string")
+        element_type = type_name[:-2] if type_name.endswith("[]") else None
+        try:
+            if element_type is not None:
+                elements = v if isinstance(v, list) else [v]
+                if element_type != "string" and any(e is None for e in elements):
+                    raise ValueError(v)
+                return self.writer.array_delimiter.join("" if e is None else coerce(element_type, e)
+                                                        for e in elements)
+            if isinstance(v, list):
+                if k in self.types:
+                    # e.g. the values of an aggregated edge, the earlier values are arrays of one element
+                    self.types[k] = f"{type_name}[]"
+                    return self.format_value(k, v)
+                return self.writer.array_delimiter.join("" if e is None else coerce("string", e) for e in v)
+            return coerce(type_name, v)
+        except (TypeError, ValueError):
+            self.types[k] = "string[]" if element_type is not None else "string"
+            logger.warning(f"Property {k} of {self.label} has a value that isn't a {type_name}: {v}, "
+                           f"writing the column as {self.types[k]}")
+            return self.format_value(k, v)
+
+    def add_columns(self, properties):
+        for k in properties:
+            if k not in self.column_index:
+                self.column_index[k] = len(self.columns)
+                self.columns.append(k)
+
+    def write(self, keys, properties):
+        properties = flatten(properties)
+        self.add_columns(properties)
+        self.csv.writerow(list(keys) + [self.format_value(k, properties.get(k, None)) for k in self.columns])
+
+    def header(self):
+        if self.kind == "edges":
+            keys = [":START_ID", ":END_ID", ":TYPE"]
+        else:
+            keys = [":ID", ":LABEL"]
+        columns = [f"{k}:{self.types[k]}" if k in self.types else k for k in self.columns]
+        return keys + columns
+
+    def close(self):
+        self.file.close()
+
+    def finish(self, updates=None):
+        """
+        Write the data file with all columns and the header file
+        :param updates: RecordUpdates of the flattened properties of the later occurrences of the nodes (dedup
+        merge), filling the empty columns of their rows
+        """
+        if updates is not None:
+            self.add_columns(updates.properties)
+        n_keys = 3 if self.kind == "edges" else 2
+        with open(self.tmp_path, newline="") as tmp, \
+                (gzip.open(self.data_path, "wt", newline="") if self.writer.compress
+                 else open(self.data_path, "w", newline="")) as f:
+            out = csv.writer(f, delimiter=self.writer.delimiter, quotechar=self.writer.quote_character,
+                             lineterminator="\n")
+            rows = csv.reader(tmp)
+            merged = updates.merge(rows, lambda row: row[0]) if updates is not None else ((row, {}) for row in rows)
+            for row, update in merged:
+                row.extend([""] * (n_keys + len(self.columns) - len(row)))
+                for k, v in update.items():
+                    i = n_keys + self.column_index[k]
+                    if row[i] == "":
+                        row[i] = self.format_value(k, v)
+                out.writerow(row)
+        os.remove(self.tmp_path)
+        with open(self.header_path, "w", newline="") as f:
+            csv.writer(f, delimiter=self.writer.delimiter, quotechar=self.writer.quote_character,
+                       lineterminator="\n").writerow(self.header())
+        self.writer.import_parts.append((self.kind, self.header_path, self.data_path))
+
+
+class Neo4jCSVStream:
+    """
+    Writes the records of one adapter run to <prefix>/<nodes|edges>/<label>-partNNN(-header).csv files.
+    A node that was written before (dedup merge) doesn't get a row of its own, its new properties are
+    spilled to disk and merged into its first row when the writer is closed.
+    """
+
+    def __init__(self, writer, dir_path, kind):
+        self.writer = writer
+        self.path = dir_path
+        self.kind = kind
+        self.parts = {}
+
+    def write(self, record, is_new=True):
+        if self.kind == "edges":
+            source_id, target_id, label, properties = record
+            label = label.lower()
+            rel_type = self.writer.edge_node_types[label]["output_label"] or label
+            keys = (source_id, target_id, rel_type)
+        else:
+            id, label, properties = record
+            if "." in label:
+                label = label.split(".")[1]
+            label = self.writer.convert_input_labels(label).lower()
+            keys = (id, label)
+        properties = {k: v for k, v in properties.items() if k not in self.writer.excluded_properties}
+
+        if not is_new and self.kind == "nodes":
+            properties = flatten(properties)
+            if properties:
+                self.writer.updates_of(label).add(id, properties)
+            return
+        part = self.parts.get(label, None)
+        if part is None:
+            part = self.open_part(label)
+            self.parts[label] = part
+        part.write(keys, properties)
+
+    def open_part(self, label):
+        # several adapters can write the same label into the same directory, each run gets its own part
+        n = 0
+        while os.path.exists(f"{self.path}/{label}-part{n:03d}-header.csv") or \
+                os.path.exists(f"{self.path}/{label}-part{n:03d}.csv.tmp"):
+            n += 1
+        property_types = {k: t for k, t in self.writer.label_properties.get(label, {}).items()}
+        part = LabelCSV(self.writer, f"{self.path}/{label}-part{n:03d}", self.kind, label, property_types)
+        self.writer.parts.append(part)
+        return part
+
+    def close(self):
+        for part in self.parts.values():
+            part.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Neo4jCSVWriter(BaseWriter):
+    """
+    Streams the adapter records into neo4j-admin import files (a header and a data csv per label and
+    adapter run), finished and listed in neo4j-admin-import-call.sh on close. Delimiters and import options are
+    read from the neo4j section of biocypher_config.yaml.
+    """
+    file_extension = "csv"
+
+    def __init__(self, schema_config, biocypher_config,
+                 output_dir, bcy=None, compress=False, **pipeline_args):
+        super().__init__(schema_config, biocypher_config, output_dir, bcy=bcy, **pipeline_args)
+        self.compress = compress
+        with open(biocypher_config, "r") as f:
+            config = (yaml.safe_load(f) or {}).get("neo4j", None) or {}
+        self.neo4j_config = config
+        # the config holds escaped characters, e.g. '\t'
+        self.delimiter = str(config.get("delimiter", ",")).encode().decode("unicode_escape")
+        self.array_delimiter = str(config.get("array_delimiter", "|")).encode().decode("unicode_escape")
+        self.quote_character = str(config.get("quote_character", '"'))
+        self.import_parts = []
+        # the parts written so far, finished on close
+        self.parts = []
+        # label -> RecordUpdates of the properties of the later occurrences of its nodes (dedup merge)
+        self.updates = {}
+
+    def get_output_path(self, kind, path_prefix=None, create_dir=True):
+        if path_prefix is not None:
+            dir_path = f"{self.output_path}/{path_prefix}/{kind}"
+        else:
+            dir_path = f"{self.output_path}/{kind}"
+        if create_dir and not os.path.exists(dir_path):
+            pathlib.Path(dir_path).mkdir(parents=True, exist_ok=True)
+        return dir_path
+
+    def updates_of(self, label):
+        updates = self.updates.get(label, None)
+        if updates is None:
+            updates = RecordUpdates(memory_mb=self.dedup_memory_mb, spill_dir=self.output_path)
+            self.updates[label] = updates
+        return updates
+
+    def open_stream(self, kind, path_prefix=None, create_dir=True):
+        return Neo4jCSVStream(self, self.get_output_path(kind, path_prefix, create_dir), kind)
+
+    def write_import_call(self):
+        """
+        Write the neo4j-admin import call for all parts. The file paths are relative to the output
+        directory, or below import_call_file_prefix if it's set (e.g. the path of the output inside
+        the neo4j container).
+        """
+        prefix = self.neo4j_config.get("import_call_file_prefix", None)
+
+        def import_path(path):
+            path = os.path.relpath(path, self.output_path)
+            return f"{prefix.rstrip('/')}/{path}" if prefix else path
+
+        delimiter = "TAB" if self.delimiter == "\t" else self.delimiter
+        args = [f"--database={self.neo4j_config.get('database_name', 'neo4j')}",
+                f"--delimiter={shlex.quote(delimiter)}",
+                f"--array-delimiter={shlex.quote(self.array_delimiter)}",
+                f"--quote={shlex.quote(self.quote_character)}",
+                f"--skip-duplicate-nodes={str(self.neo4j_config.get('skip_duplicate_nodes', False)).lower()}",
+                f"--skip-bad-relationships={str(self.neo4j_config.get('skip_bad_relationships', False)).lower()}"]
+        if self.neo4j_config.get("wipe", False):
+            args.append("--force=true")
+        for kind, header_path, data_path in self.import_parts:
+            option = "--relationships" if kind == "edges" else "--nodes"
+            args.append(f"{option}={shlex.quote(import_path(header_path) + ',' + import_path(data_path))}")
+
+        bin_prefix = self.neo4j_config.get("import_call_bin_prefix", "")
+        file_path = f"{self.output_path}/neo4j-admin-import-call.sh"
+        with open(file_path, "w") as f:
+            f.write("#!/bin/bash\n")
+            if not prefix:
+                f.write('cd "$(dirname "$0")"\n')
+            f.write(f"{bin_prefix}neo4j-admin import " + " \\\n    ".join(args) + "\n")
+        os.chmod(file_path, 0o755)
+        logger.info(f"Wrote neo4j-admin import call to {file_path}")
+
+    def close(self):
+        for part in self.parts:
+            part.finish(self.updates.get(part.label, None) if part.kind == "nodes" else None)
+        for updates in self.updates.values():
+            updates.close()
+        self.write_import_call()
+        super().close()
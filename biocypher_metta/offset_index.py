@@ -0,0 +1,200 @@
+"""
+Entity ID -> byte range index of the text output files of a build, for random access to the atoms of an entity
+
+    <output>/offset_index/<format>/keys.npy     sorted entity IDs (node IDs, edge source and target IDs)
+    <output>/offset_index/<format>/file.npy     index into files.json of the file holding the atoms
+    <output>/offset_index/<format>/offset.npy   byte offset of the atoms in that file
+    <output>/offset_index/<format>/length.npy   byte length of the atoms
+    <output>/offset_index/<format>/files.json   output file paths, relative to the output directory
+
+The arrays are plain .npy files, loaded memory-mapped:
+
+    python -m biocypher_metta.offset_index --index-dir out/offset_index/metta --id ENSG00000290825
+"""
+import json
+import pathlib
+import shutil
+import tempfile
+from typing import List
+import numpy as np
+import typer
+from typing_extensions import Annotated
+from biocypher._logger import logger
+from biocypher_metta.bgzf import BgzfReader
+from biocypher_metta.sorting import ExternalSorter
+
+INDEX_DIR = "offset_index"
+
+
+class OffsetIndexedStream:
+    """
+    Wraps a text output stream and adds the byte range of every record it writes to an OffsetIndexBuilder,
+    keyed by the node ID or by the source and target IDs of an edge. With a separate property layout only
+    the topology file is indexed.
+    """
+
+    def __init__(self, stream, builder):
+        self.stream = stream
+        self.builder = builder
+        self.path = stream.path
+
+    @property
+    def property_counts(self):
+        return self.stream.property_counts
+
+    @property
+    def record_paths(self):
+        return self.stream.record_paths
+
+    def write(self, record, is_new=True):
+        offset = self.stream.tell()
+        self.stream.write(record, is_new)
+        length = self.stream.tell() - offset
+        if length > 0:
+            self.builder.add(record[0], self.path, offset, length)
+            if self.stream.kind == "edges":
+                self.builder.add(record[1], self.path, offset, length)
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class OffsetIndexBuilder:
+    """
+    Collects the (id, file, offset, length) entries of one output format in a temporary file during the build.
+    On close they are sorted by ID with an external merge sort and written to the index arrays.
+    """
+
+    def __init__(self, index_dir, output_path, spill_dir=None, sort_memory_mb=1024):
+        self.index_dir = pathlib.Path(index_dir)
+        self.output_path = pathlib.Path(output_path)
+        self.sort_memory_mb = sort_memory_mb
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix="offsets_", dir=spill_dir))
+        self.entries = open(self.tmp_dir / "entries.tsv", "w")
+        self.files = {}
+        self.count = 0
+        self.key_width = 1
+
+    def add(self, id, path, offset, length):
+        file = self.files.get(path, None)
+        if file is None:
+            file = len(self.files)
+            self.files[path] = file
+        id = str(id)
+        self.key_width = max(self.key_width, len(id.encode()))
+        self.entries.write(f"{id}\t{file}\t{offset}\t{length}\n")
+        self.count += 1
+
+    def _read_entries(self):
+        with open(self.tmp_dir / "entries.tsv") as f:
+            for line in f:
+                id, file, offset, length = line.rstrip("\n").rsplit("\t", 3)
+                yield id.encode(), int(file), int(offset), int(length)
+
+    def close(self, block_size=1 << 20):
+        self.entries.close()
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        keys = np.lib.format.open_memmap(self.index_dir / "keys.npy", mode="w+", dtype=f"S{self.key_width}",
+                                         shape=(self.count,))
+        arrays = {k: np.lib.format.open_memmap(self.index_dir / f"{k}.npy", mode="w+", dtype=dtype,
+                                               shape=(self.count,))
+                  for k, dtype in (("file", np.int32), ("offset", np.int64), ("length", np.int64))}
+        sorter = ExternalSorter(memory_mb=self.sort_memory_mb, spill_dir=self.tmp_dir)
+        block = []
+        i = 0
+        for entry in sorter.sort(self._read_entries(), key=lambda e: e[0]):
+            block.append(entry)
+            if len(block) >= block_size:
+                i = self._write_block(block, i, keys, arrays)
+                block = []
+        self._write_block(block, i, keys, arrays)
+        keys.flush()
+        for array in arrays.values():
+            array.flush()
+        with open(self.index_dir / "files.json", "w") as f:
+            json.dump([str(pathlib.Path(path).relative_to(self.output_path)) for path in self.files], f, indent=2)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        logger.info(f"Wrote offset index of {self.count} entries to {self.index_dir}")
+
+    @staticmethod
+    def _write_block(block, i, keys, arrays):
+        j = i + len(block)
+        keys[i:j] = [e[0] for e in block]
+        arrays["file"][i:j] = [e[1] for e in block]
+        arrays["offset"][i:j] = [e[2] for e in block]
+        arrays["length"][i:j] = [e[3] for e in block]
+        return j
+
+
+class OffsetIndex:
+    """
+    Read side of an offset index directory. The paths in files.json are resolved against output_dir,
+    by default the build output directory two levels above the index.
+    """
+
+    def __init__(self, index_dir, output_dir=None):
+        self.index_dir = pathlib.Path(index_dir)
+        self.output_dir = pathlib.Path(output_dir) if output_dir is not None else self.index_dir.parent.parent
+        with open(self.index_dir / "files.json") as f:
+            self.files = json.load(f)
+        self.keys = np.load(self.index_dir / "keys.npy", mmap_mode="r")
+        self.file = np.load(self.index_dir / "file.npy", mmap_mode="r")
+        self.offset = np.load(self.index_dir / "offset.npy", mmap_mode="r")
+        self.length = np.load(self.index_dir / "length.npy", mmap_mode="r")
+
+    def locate(self, id):
+        """
+        :return: list of (file path, byte offset, byte length) of the atoms of id
+        """
+        key = str(id).encode()
+        if len(key) > self.keys.dtype.itemsize:
+            return []
+        key = np.array(key, dtype=self.keys.dtype)
+        lo = np.searchsorted(self.keys, key, side="left")
+        hi = np.searchsorted(self.keys, key, side="right")
+        return [(self.output_dir / self.files[self.file[i]], int(self.offset[i]), int(self.length[i]))
+                for i in range(lo, hi)]
+
+    def atoms(self, ids):
+        """
+        Read the atoms of every id by seeking into the output files, for block compressed (.gz) files only the
+        blocks holding them are decompressed.
+        :return: generator of (id, text) tuples, one per stored byte range
+        """
+        handles = {}
+        try:
+            for id in ids:
+                for path, offset, length in self.locate(id):
+                    f = handles.get(path, None)
+                    if f is None:
+                        f = BgzfReader(path) if path.suffix == ".gz" else open(path, "rb")
+                        handles[path] = f
+                    if isinstance(f, BgzfReader):
+                        yield id, f.read(offset, length).decode()
+                    else:
+                        f.seek(offset)
+                        yield id, f.read(length).decode()
+        finally:
+            for f in handles.values():
+                f.close()
+
+
+app = typer.Typer()
+
+
+@app.command()
+def main(index_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=False, dir_okay=True)],
+         id: List[str] = typer.Option(..., help="Entity ID(s) to look up")):
+    index = OffsetIndex(index_dir)
+    for _, text in index.atoms(id):
+        print(text, end="")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,91 @@
+"""
+Render MeTTa/Prolog output from a parquet build written by ParquetWriter, without running the adapters again
+
+    python -m biocypher_metta.parquet_renderer --input-dir parquet_out --output-dir metta_out --output-format metta
+"""
+import json
+import pathlib
+from typing import List
+import typer
+from typing_extensions import Annotated
+from biocypher._logger import logger
+from biocypher_metta.parquet_writer import read_records
+from biocypher_metta.writers import create_writer
+
+app = typer.Typer()
+
+
+def find_label_dirs(input_dir):
+    """
+    Find the label directories of a parquet build.
+    :return: list of (path_prefix, kind, label_dir) tuples, datasets first, then nodes, then edges
+    """
+    kinds = ["datasets", "nodes", "edges"]
+    input_dir = pathlib.Path(input_dir)
+    label_dirs = {}
+    for part in sorted(input_dir.rglob("part-*.parquet")):
+        label_dir = part.parent
+        kind = label_dir.parent.name
+        if kind not in kinds:
+            continue
+        prefix = label_dir.parent.parent.relative_to(input_dir)
+        label_dirs[(str(prefix) if str(prefix) != "." else None, kind, label_dir)] = None
+    return sorted(label_dirs, key=lambda x: (kinds.index(x[1]), str(x[0]), x[2].name))
+
+
+def render(input_dir, writer):
+    """
+    Pass every label of a parquet build to writer, keeping the directory layout of the build. With the
+    manifest.json of the build the datasets are rendered in the order of the adapter run, each with its
+    manifest entry.
+    """
+    input_dir = pathlib.Path(input_dir)
+    label_dirs = find_label_dirs(input_dir)
+    manifest_path = input_dir / "manifest.json"
+    if not manifest_path.exists():
+        render_label_dirs(label_dirs, writer)
+        return
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    # output directory of a kind (<prefix>/<kind>) -> its label directories
+    by_dir = {}
+    for entry in label_dirs:
+        by_dir.setdefault(str(entry[2].parent.relative_to(input_dir)), []).append(entry)
+    for name, dataset in manifest["datasets"].items():
+        writer.start_dataset(name, path_prefix=dataset.get("outdir", None))
+        # keep the source, version and build date of the parquet build
+        writer.manifest["datasets"][name] = dict(dataset)
+        for path, entry in manifest["files"].items():
+            if name in entry["datasets"]:
+                render_label_dirs(by_dir.pop(path, []), writer)
+    writer.dataset = None
+    for entries in by_dir.values():
+        render_label_dirs(entries, writer)
+
+
+def render_label_dirs(label_dirs, writer):
+    for prefix, kind, label_dir in label_dirs:
+        records = read_records(label_dir, kind)
+        if kind == "nodes":
+            writer.write_nodes(records, path_prefix=prefix)
+        elif kind == "edges":
+            writer.write_edges(records, path_prefix=prefix)
+        else:
+            writer.write_records(kind, ((record, True) for record in records), path_prefix=prefix)
+
+
+@app.command()
+def main(input_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=False, dir_okay=True)],
+         output_dir: Annotated[pathlib.Path, typer.Option(file_okay=False, dir_okay=True)],
+         output_format: List[str] = typer.Option(["metta"], help="Output format(s) to render"),
+         schema_config: str = "config/schema_config.yaml",
+         biocypher_config: str = "config/biocypher_config.yaml"):
+    writer = create_writer(output_format, schema_config=schema_config,
+                           biocypher_config=biocypher_config, output_dir=output_dir)
+    render(input_dir, writer)
+    writer.close()
+    logger.info("Done")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,298 @@
+import json
+import os
+import pathlib
+from biocypher._logger import logger
+from biocypher_metta.base_writer import BaseWriter
+from biocypher_metta.sorting import RecordUpdates
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+NODE_KEYS = ["id"]
+EDGE_KEYS = ["source_id", "target_id"]
+# properties that don't fit the column types are kept as a json object in this column
+EXTRA_COLUMN = "_extra"
+
+
+def arrow_type(type_name):
+    """
+    Map a property type from schema_config.yaml (str, int, float, bool, str[] ...) to an arrow type
+    """
+    types = {"str": pa.string(), "int": pa.int64(), "float": pa.float64(), "bool": pa.bool_()}
+    if type_name.endswith("[]"):
+        return pa.list_(types.get(type_name[:-2], pa.string()))
+    return types.get(type_name, pa.string())
+
+
+def coerce(value, type_name):
+    """
+    Convert a property value to the python type of its declared schema type. Raises ValueError/TypeError
+    if that's not possible.
+    """
+    if value is None or isinstance(value, (list, dict)):
+        return value
+    if type_name == "str":
+        return str(value)
+    if type_name == "int":
+        return int(value)
+    if type_name == "float":
+        return float(value)
+    return value
+
+
+class LabelTable:
+    """
+    Buffers the rows of one label and writes them to a parquet file one row group at a time.
+    The columns are the key columns, the properties declared in the schema and any other property
+    seen in the first row group. The column types are fixed when the first row group is written.
+    """
+
+    def __init__(self, path, key_columns, property_types, row_group_size):
+        self.path = path
+        self.key_columns = key_columns
+        self.property_types = property_types
+        self.row_group_size = row_group_size
+        self.rows = []
+        self.schema = None
+        self.parquet_writer = None
+
+    def append(self, keys, properties):
+        self.rows.append((keys, properties))
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def create_schema(self):
+        fields = [pa.field(k, pa.string()) for k in self.key_columns]
+        fields.extend(pa.field(k, arrow_type(t)) for k, t in self.property_types.items())
+        undeclared = {}
+        for _, props in self.rows:
+            for k in props:
+                if k not in self.property_types and k not in self.key_columns and k not in undeclared:
+                    undeclared[k] = None
+        for k in undeclared:
+            try:
+                col_type = pa.array([props.get(k) for _, props in self.rows]).type
+            except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+                # mixed value types, keep these values in the extra column
+                continue
+            fields.append(pa.field(k, pa.string() if pa.types.is_null(col_type) else col_type))
+        fields.append(pa.field(EXTRA_COLUMN, pa.string()))
+        return pa.schema(fields)
+
+    def flush(self):
+        if len(self.rows) == 0:
+            return
+        if self.schema is None:
+            self.schema = self.create_schema()
+            self.parquet_writer = pq.ParquetWriter(self.path, self.schema)
+
+        extras = [{} for _ in self.rows]
+        columns = []
+        for i, k in enumerate(self.key_columns):
+            columns.append(pa.array([str(keys[i]) for keys, _ in self.rows], type=pa.string()))
+
+        for field in self.schema:
+            if field.name in self.key_columns or field.name == EXTRA_COLUMN:
+                continue
+            values = []
+            type_name = self.property_types.get(field.name)
+            for j, (_, props) in enumerate(self.rows):
+                v = props.get(field.name)
+                if type_name is not None:
+                    try:
+                        v = coerce(v, type_name)
+                    except (ValueError, TypeError):
+                        extras[j][field.name] = v
+                        v = None
+                values.append(v)
+            try:
+                columns.append(pa.array(values, type=field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+                columns.append(self.fallback_column(values, field, extras))
+
+        for j, (_, props) in enumerate(self.rows):
+            for k, v in props.items():
+                if k in self.key_columns or self.schema.get_field_index(k) == -1:
+                    extras[j][k] = v
+        columns.append(pa.array([json.dumps(e, default=str) if e else None for e in extras], type=pa.string()))
+
+        self.parquet_writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+        self.rows = []
+
+    def fallback_column(self, values, field, extras):
+        """
+        Convert values one by one, the ones that don't fit the column type go to the extra column
+        """
+        checked = []
+        for j, v in enumerate(values):
+            try:
+                pa.array([v], type=field.type)
+                checked.append(v)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+                extras[j][field.name] = v
+                checked.append(None)
+        return pa.array(checked, type=field.type)
+
+    def close(self):
+        self.flush()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+class ParquetStream:
+    """
+    Writes the records of one adapter run to <prefix>/<nodes|edges>/<label>/part-NNNNN.parquet. A node that
+    was written before (dedup merge) doesn't get a row of its own, its new properties are spilled to disk and
+    merged into its first row when the writer is closed.
+    """
+
+    def __init__(self, writer, dir_path, kind):
+        self.writer = writer
+        self.path = dir_path
+        self.dir_path = dir_path
+        self.kind = kind
+        self.tables = {}
+
+    def write(self, record, is_new=True):
+        if self.kind != "edges":
+            id, label, properties = record
+            if "." in label:
+                label = label.split(".")[1]
+            keys = (id,)
+        else:
+            source_id, target_id, label, properties = record
+            keys = (source_id, target_id)
+        label = self.writer.convert_input_labels(label)
+        properties = {k: v for k, v in properties.items()
+                      if k not in self.writer.excluded_properties and v is not None and v != ""}
+
+        if not is_new and self.kind == "nodes":
+            if properties:
+                self.writer.updates_of(label).add(keys[0], properties)
+            return
+        table = self.tables.get(label, None)
+        if table is None:
+            table = self.open_table(label)
+            self.tables[label] = table
+        table.append(keys, properties)
+
+    def open_table(self, label):
+        label_dir = pathlib.Path(self.dir_path) / label
+        label_dir.mkdir(parents=True, exist_ok=True)
+        # several adapters can write the same label into the same directory, each run gets its own part
+        part = 0
+        while (label_dir / f"part-{part:05d}.parquet").exists():
+            part += 1
+        key_columns = EDGE_KEYS if self.kind == "edges" else NODE_KEYS
+        property_types = {k: t for k, t in self.writer.label_properties.get(label.lower(), {}).items()
+                          if k not in key_columns}
+        table = LabelTable(label_dir / f"part-{part:05d}.parquet", key_columns, property_types,
+                           self.writer.row_group_size)
+        if self.kind == "nodes":
+            self.writer.node_tables.setdefault(label, []).append(table)
+        return table
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ParquetWriter(BaseWriter):
+    """
+    Columnar output: nodes and edges are stored per label as parquet files with typed columns derived
+    from the properties in schema_config.yaml. Use biocypher_metta.parquet_renderer to produce MeTTa or
+    Prolog files from them.
+    """
+    file_extension = "parquet"
+
+    def __init__(self, schema_config, biocypher_config,
+                 output_dir, bcy=None, row_group_size=100_000, **pipeline_args):
+        if pa is None:
+            raise ImportError("ParquetWriter requires pyarrow, install it with `poetry install -E parquet`")
+        super().__init__(schema_config, biocypher_config, output_dir, bcy=bcy, **pipeline_args)
+        self.row_group_size = row_group_size
+        # label -> the node tables written so far
+        self.node_tables = {}
+        # label -> RecordUpdates of the properties of the later occurrences of its nodes (dedup merge)
+        self.updates = {}
+
+    def get_output_path(self, kind, path_prefix=None, create_dir=True):
+        if path_prefix is not None:
+            dir_path = f"{self.output_path}/{path_prefix}/{kind}"
+        else:
+            dir_path = f"{self.output_path}/{kind}"
+        if create_dir and not os.path.exists(dir_path):
+            pathlib.Path(dir_path).mkdir(parents=True, exist_ok=True)
+        return dir_path
+
+    def open_stream(self, kind, path_prefix=None, create_dir=True):
+        return ParquetStream(self, self.get_output_path(kind, path_prefix, create_dir), kind)
+
+    def updates_of(self, label):
+        updates = self.updates.get(label, None)
+        if updates is None:
+            updates = RecordUpdates(memory_mb=self.dedup_memory_mb, spill_dir=self.output_path)
+            self.updates[label] = updates
+        return updates
+
+    def merge_updates(self, table, updates):
+        """
+        Rewrite a node table with the properties of the later occurrences of its nodes added to their rows
+        """
+        tmp_path = table.path.with_name(table.path.name + ".tmp")
+        merged = LabelTable(tmp_path, table.key_columns, table.property_types, self.row_group_size)
+        for (keys, properties), update in updates.merge(read_part(table.path, table.key_columns),
+                                                        lambda row: row[0][0]):
+            for k, v in update.items():
+                properties.setdefault(k, v)
+            merged.append(keys, properties)
+        merged.close()
+        os.replace(tmp_path, table.path)
+
+    def close(self):
+        for label, updates in self.updates.items():
+            for table in self.node_tables.get(label, []):
+                if table.path.exists():
+                    self.merge_updates(table, updates)
+            updates.close()
+        if self.updates:
+            logger.info(f"Merged the properties of {sum(u.count for u in self.updates.values())} repeated nodes")
+        super().close()
+
+
+def read_part(path, key_columns):
+    """
+    Read back the rows of one parquet file written by ParquetWriter, as (keys, props) tuples
+    """
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches():
+        for row in batch.to_pylist():
+            properties = {k: v for k, v in row.items()
+                          if k not in key_columns and k != EXTRA_COLUMN and v is not None}
+            if row.get(EXTRA_COLUMN):
+                properties.update(json.loads(row[EXTRA_COLUMN]))
+            yield tuple(row[k] for k in key_columns), properties
+
+
+def read_records(label_dir, kind):
+    """
+    Read back the records of one label directory written by ParquetWriter, as (id, label, props)
+    tuples for nodes and datasets and (source_id, target_id, label, props) tuples for edges
+    """
+    label_dir = pathlib.Path(label_dir)
+    label = label_dir.name
+    key_columns = EDGE_KEYS if kind == "edges" else NODE_KEYS
+    for part in sorted(label_dir.glob("part-*.parquet")):
+        for keys, properties in read_part(part, key_columns):
+            yield (*keys, label, properties)
+    logger.info(f"Finished reading {label_dir}")
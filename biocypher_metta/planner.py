@@ -0,0 +1,170 @@
+"""
+Predict the peak memory and load time of loading (a subset of) a build into a MeTTa space
+
+    python scripts/metta_space_import.py --input-dir sample --type-def-path sample/type_defs.metta \\
+        --calibration-file calibration.json
+    python -m biocypher_metta.planner --build-dir out --calibration calibration.json --dir gencode --dir gtex \\
+        --memory-limit 64
+
+The calibration file of a sample load holds the atoms, bytes, load time and resident memory growth of every
+loaded file. Memory and time are fitted as c_atoms * atoms + c_bytes * bytes over these samples, then applied to the
+MeTTa files of the build listed in manifest.json. The atoms of a file are estimated from its (uncompressed) size
+and the average atom size of the labels of the file (listed in its manifest entry) in the stats.json of the build
+(--stats), or counted if the build has no statistics; topology files (--property-layout) hold one atom per record.
+With --memory-limit the number of spaces needed to load the selection within that memory is reported.
+"""
+import gzip
+import json
+import math
+import pathlib
+from typing import List, Optional
+import numpy as np
+import typer
+from typing_extensions import Annotated
+from biocypher._logger import logger
+from biocypher_metta.bgzf import read_index
+from biocypher_metta.stats import STATS_FILE
+
+# fraction of the memory limit a space may use, the rest is left for the loader and the OS
+MEMORY_HEADROOM = 0.8
+
+
+def fit(samples, target):
+    """
+    Least squares fit of target ~ c_atoms * atoms + c_bytes * bytes without intercept. Falls back to a cost per
+    atom if there are too few samples or a coefficient comes out negative.
+    :return: (c_atoms, c_bytes)
+    """
+    x = np.array([[s["atoms"], s["bytes"]] for s in samples], dtype=np.float64)
+    y = np.array([s[target] for s in samples], dtype=np.float64)
+    if len(samples) >= 2 and np.linalg.matrix_rank(x) == 2:
+        coefficients = np.linalg.lstsq(x, y, rcond=None)[0]
+        if np.all(coefficients >= 0):
+            return float(coefficients[0]), float(coefficients[1])
+    atoms = x[:, 0].sum()
+    return (float(y.sum() / atoms) if atoms > 0 else 0.0), 0.0
+
+
+class LoadModel:
+    def __init__(self, calibration_paths):
+        samples = []
+        baselines = []
+        for path in calibration_paths:
+            with open(path) as f:
+                calibration = json.load(f)
+            baselines.append(calibration["baseline_mb"])
+            samples.extend(s for s in calibration["files"] if s["atoms"] > 0)
+        if len(samples) == 0:
+            raise ValueError("The calibration files have no loaded files")
+        self.baseline_mb = max(baselines)
+        self.memory = fit(samples, "memory_mb")
+        self.time = fit(samples, "seconds")
+
+    def predict(self, atoms, size):
+        """
+        :return: (memory MB, seconds) of loading atoms atoms of size bytes
+        """
+        return (self.memory[0] * atoms + self.memory[1] * size,
+                self.time[0] * atoms + self.time[1] * size)
+
+
+def text_size(path, entry):
+    """
+    :return: uncompressed size of an output file
+    """
+    if entry.get("compression", None) == "bgzf":
+        # the last block index entry is the end-of-file block at the uncompressed size
+        return int(read_index(path)[1][-1])
+    if path.suffix == ".gz":
+        with gzip.open(path, "rb") as f:
+            return sum(len(chunk) for chunk in iter(lambda: f.read(1 << 20), b""))
+    return path.stat().st_size
+
+
+def count_atoms(path):
+    with (gzip.open(path, "rb") if path.suffix == ".gz" else open(path, "rb")) as f:
+        return sum(1 for line in f if line.strip())
+
+
+def atom_size(stats, kind, labels=None):
+    """
+    :param labels: labels of the file, all labels of the kind if None (manifests of builds without labels)
+    :return: average bytes per atom of the MeTTa output of the labels, None if unknown
+    """
+    kind_stats = stats.get(kind, {})
+    selected = [kind_stats[label] for label in (labels if labels is not None else kind_stats) if label in kind_stats]
+    atoms = sum(label["atoms"] for label in selected)
+    size = sum(label["bytes"].get("metta", 0) for label in selected)
+    return size / atoms if atoms > 0 and size > 0 else None
+
+
+def plan(build_dir, model, dirs=None):
+    """
+    :param dirs: output directories (relative to build_dir) to load, all if None
+    :return: list of (path, atoms, bytes, memory MB, seconds) of the MeTTa files to load
+    """
+    build_dir = pathlib.Path(build_dir)
+    with open(build_dir / "manifest.json") as f:
+        manifest = json.load(f)
+    stats = {}
+    stats_path = build_dir / manifest.get("stats", STATS_FILE)
+    if stats_path.exists():
+        with open(stats_path) as f:
+            stats = json.load(f)
+    files = []
+    for path, entry in sorted(manifest["files"].items()):
+        if entry["format"] != "metta":
+            continue
+        if dirs is not None and not any(path == d or path.startswith(d.rstrip("/") + "/") for d in dirs):
+            continue
+        full_path = build_dir / path
+        size = text_size(full_path, entry)
+        atom_bytes = atom_size(stats, entry["kind"], entry.get("labels", None))
+        if entry.get("atoms", None) == "topology":
+            # one node/edge atom per record
+            atoms = entry["records"]
+        elif atom_bytes is not None:
+            atoms = int(round(size / atom_bytes))
+        else:
+            atoms = count_atoms(full_path)
+        memory, seconds = model.predict(atoms, size)
+        files.append((path, atoms, size, memory, seconds))
+    return files
+
+
+app = typer.Typer()
+
+
+@app.command()
+def main(build_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=False, dir_okay=True)],
+         calibration: List[pathlib.Path] = typer.Option(..., exists=True, file_okay=True, dir_okay=False,
+                                                        help="Calibration file(s) written by "
+                                                             "scripts/metta_space_import.py --calibration-file"),
+         dir: Optional[List[str]] = typer.Option(None, help="Output directory to load, relative to the build "
+                                                            "directory. Repeat for several, all by default"),
+         memory_limit: Optional[float] = typer.Option(None, help="Memory (GB) of the load machine, reports the "
+                                                                 "number of spaces needed to stay below it")):
+    model = LoadModel(calibration)
+    files = plan(build_dir, model, dir or None)
+    atoms = sum(f[1] for f in files)
+    size = sum(f[2] for f in files)
+    memory = sum(f[3] for f in files)
+    seconds = sum(f[4] for f in files)
+    for path, n, file_size, file_memory, file_seconds in files:
+        logger.info(f"{path}: {n} atoms, {file_size / 2 ** 20:.1f} MB, {file_memory:.1f} MB memory, "
+                    f"{file_seconds:.1f} s")
+    peak = model.baseline_mb + memory
+    logger.info(f"{len(files)} files, {atoms} atoms, {size / 2 ** 30:.2f} GB of atoms")
+    logger.info(f"Predicted peak memory {peak / 1024:.2f} GB, load time {seconds / 3600:.2f} h in one space")
+    if memory_limit is not None:
+        available = memory_limit * 1024 * MEMORY_HEADROOM - model.baseline_mb
+        if available <= 0 or any(f[3] > available for f in files):
+            logger.warning(f"A single file doesn't fit into {memory_limit} GB")
+        else:
+            spaces = max(1, math.ceil(memory / available))
+            logger.info(f"{spaces} space(s) of at most {memory_limit} GB, about {seconds / spaces / 3600:.2f} h "
+                        f"when loaded in parallel")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,183 @@
+import heapq
+import pathlib
+import pickle
+import shutil
+import tempfile
+from biocypher._logger import logger
+from biocypher_metta.adapters.helpers import pack_variant_id, variant_position
+
+# Rough in-memory cost of a buffered record (tuple, property dict and its values)
+_RECORD_BYTES = 1024
+
+
+def chr_key(chr):
+    """
+    Sort key giving the natural order of chromosome names: chr1 < chr2 < chr10 < chrM < chrX < chrY
+    """
+    name = str(chr)
+    if name.lower().startswith("chr"):
+        name = name[3:]
+    if name.isdigit():
+        return 0, int(name), ""
+    return 1, 0, name.upper()
+
+
+def genomic_key(record):
+    """
+    Sort key of a node or edge record: positional records (with a chr property) by (chr, start, id),
+    followed by the other records by their ID, i.e. the source ID for edges. Records without a chr whose
+    (source) ID is a variant ID are positional too, at the position packed in the ID's variant key.
+    """
+    properties = record[-1]
+    chr = properties.get("chr", None)
+    if chr is None or chr == "":
+        key = pack_variant_id(record[0]) if isinstance(record[0], str) else None
+        if key is not None:
+            chr, start = variant_position(key)
+            return 0, chr_key(chr), start, record[0]
+        return 1, (1, 0, ""), 0, str(record[0])
+    try:
+        start = int(properties.get("start", None) or 0)
+    except (TypeError, ValueError):
+        start = 0
+    return 0, chr_key(chr), start, str(record[0])
+
+
+class ExternalSorter:
+    """
+    Sorts a stream of items with bounded memory. Items are buffered until the memory budget is used up,
+    then each buffer is sorted and spilled to disk as a run; the runs are merged back with a k-way merge,
+    in several passes if there are more than max_open_runs of them. Items with equal keys keep their
+    input order.
+    """
+
+    def __init__(self, memory_mb=1024, spill_dir=None, max_open_runs=64):
+        self.max_in_memory = max(1, memory_mb * 1024 * 1024 // _RECORD_BYTES)
+        self.spill_dir = spill_dir
+        self.max_open_runs = max_open_runs
+
+    def sort(self, items, key):
+        """
+        :return: generator of the items ordered by key(item)
+        """
+        buffer = []
+        runs = []
+        tmp_dir = None
+        try:
+            for seq, item in enumerate(items):
+                # the sequence number is unique, so items themselves are never compared
+                buffer.append((key(item), seq, item))
+                if len(buffer) >= self.max_in_memory:
+                    if tmp_dir is None:
+                        tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix="sort_", dir=self.spill_dir))
+                    runs.append(self._spill(buffer, tmp_dir / f"run_{len(runs)}.pkl"))
+                    buffer = []
+            buffer.sort()
+            if len(runs) == 0:
+                for _, _, item in buffer:
+                    yield item
+                return
+            if len(buffer) > 0:
+                runs.append(self._spill(buffer, tmp_dir / f"run_{len(runs)}.pkl"))
+            buffer = []
+            n = len(runs)
+            while len(runs) > self.max_open_runs:
+                merged = tmp_dir / f"run_{n}.pkl"
+                n += 1
+                self._write_run(heapq.merge(*(self._read_run(run) for run in runs[:self.max_open_runs])), merged)
+                for run in runs[:self.max_open_runs]:
+                    run.unlink()
+                runs = runs[self.max_open_runs:] + [merged]
+            for _, _, item in heapq.merge(*(self._read_run(run) for run in runs)):
+                yield item
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _spill(self, buffer, path):
+        buffer.sort()
+        self._write_run(buffer, path)
+        logger.info(f"Spilled {len(buffer)} records to {path}")
+        return path
+
+    @staticmethod
+    def _write_run(entries, path):
+        with open(path, "wb") as f:
+            for entry in entries:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _read_run(path):
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+
+class RecordUpdates:
+    """
+    Properties to merge into rows that were already written, e.g. of the later occurrences of a node with the
+    merge dedup policy. They are appended to a file as they arrive, so memory doesn't grow with their number,
+    and joined with the rows by merge(), which sorts both by ID with an ExternalSorter and restores the order
+    of the rows afterwards.
+    """
+
+    def __init__(self, memory_mb=1024, spill_dir=None):
+        self.memory_mb = memory_mb
+        self.spill_dir = spill_dir
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix="updates_", dir=spill_dir))
+        self.file = open(self.tmp_dir / "updates.pkl", "wb")
+        self.count = 0
+        # names of the properties of the updates, in order of appearance
+        self.properties = {}
+
+    def add(self, id, properties):
+        pickle.dump((str(id), properties), self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+        self.properties.update(dict.fromkeys(properties))
+
+    def _read(self):
+        self.file.flush()
+        with open(self.file.name, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def merge(self, rows, id_of):
+        """
+        :param id_of: function returning the ID of a row
+        :return: generator of (row, properties of the updates of its ID) in the order of rows; of several updates
+        setting a property the first one is kept
+        """
+        sorter = ExternalSorter(memory_mb=max(1, self.memory_mb // 2), spill_dir=self.tmp_dir)
+        # equal keys keep their input order, so the first update of an ID comes first
+        updates = sorter.sort(self._read(), key=lambda update: update[0])
+        rows = sorter.sort(enumerate(rows), key=lambda row: str(id_of(row[1])))
+
+        def joined():
+            pending = next(updates, None)
+            id = None
+            properties = {}
+            for i, row in rows:
+                row_id = str(id_of(row))
+                if row_id != id:
+                    id = row_id
+                    properties = {}
+                    while pending is not None and pending[0] < id:
+                        pending = next(updates, None)
+                    while pending is not None and pending[0] == id:
+                        for k, v in pending[1].items():
+                            properties.setdefault(k, v)
+                        pending = next(updates, None)
+                yield i, row, properties
+
+        for _, row, properties in sorter.sort(joined(), key=lambda entry: entry[0]):
+            yield row, properties
+
+    def close(self):
+        self.file.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
@@ -0,0 +1,265 @@
+"""
+Statistics of the records of a build, collected while they are written and saved to <output>/stats.json:
+
+    {"nodes": {<label>: {"count", "atoms", "bytes": {<format>: n}, "properties": {<property>: {...}}}},
+     "edges": {<label>: {..., "degrees": {"out": {...}, "in": {...}}}}}
+
+Per property the number of records having it, the approximate number of distinct values (HyperLogLog) and
+the min/max of numeric values are kept. The degree distributions of the edges (distinct sources/targets, mean,
+max and a histogram of power of two buckets) are computed on close from the endpoint hashes, which are
+spilled to hash partitions on disk so the memory stays bounded. atoms is the number of atoms of the records
+in the one atom per property layout, bytes the size of their text output per format.
+"""
+import collections
+import json
+import pathlib
+import shutil
+import tempfile
+import numpy as np
+from biocypher_metta.dedup import hash_key
+
+STATS_FILE = "stats.json"
+
+
+class HyperLogLog:
+    """
+    Approximate distinct count of 64-bit hashes in 2^p one byte registers, standard error 1.04 / sqrt(2^p)
+    """
+
+    def __init__(self, p=12):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def add(self, h):
+        index = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros > 0:
+            # small range correction
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class PropertyStats:
+    def __init__(self, p):
+        self.count = 0
+        self.distinct = HyperLogLog(p)
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        for v in value if isinstance(value, list) else [value]:
+            self.distinct.add(hash_key(str(v)))
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and v == v:
+                if self.min is None or v < self.min:
+                    self.min = v
+                if self.max is None or v > self.max:
+                    self.max = v
+
+    def summary(self):
+        summary = {"count": self.count, "distinct": min(self.count, self.distinct.count())}
+        if self.min is not None:
+            summary["min"] = self.min
+            summary["max"] = self.max
+        return summary
+
+
+class DegreeCounter:
+    """
+    Degree distribution of the endpoints of one edge label and direction. The endpoint hashes are buffered and
+    spilled to partitions by their top bits, each partition is counted on its own on close.
+    """
+
+    def __init__(self, tmp_dir, buffer_size=1_000_000, partition_bits=6):
+        self.tmp_dir = pathlib.Path(tmp_dir)
+        self.buffer_size = buffer_size
+        self.partition_bits = partition_bits
+        self.buffer = []
+        self.spilled = False
+
+    def add(self, id):
+        self.buffer.append(hash_key(str(id)))
+        if len(self.buffer) >= self.buffer_size:
+            self._spill()
+
+    def _spill(self):
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        hashes = np.array(self.buffer, dtype=np.uint64)
+        partitions = hashes >> np.uint64(64 - self.partition_bits)
+        for part in np.unique(partitions):
+            with open(self.tmp_dir / f"part_{part}.bin", "ab") as f:
+                hashes[partitions == part].tofile(f)
+        self.buffer = []
+        self.spilled = True
+
+    def summary(self):
+        if self.spilled:
+            self._spill()
+            parts = (np.fromfile(path, dtype=np.uint64) for path in sorted(self.tmp_dir.glob("part_*.bin")))
+        else:
+            parts = [np.array(self.buffer, dtype=np.uint64)]
+        nodes = 0
+        edges = 0
+        max_degree = 0
+        histogram = collections.Counter()
+        for hashes in parts:
+            _, counts = np.unique(hashes, return_counts=True)
+            if len(counts) == 0:
+                continue
+            nodes += len(counts)
+            edges += int(counts.sum())
+            max_degree = max(max_degree, int(counts.max()))
+            # bucket b holds the degrees 2^b .. 2^(b+1) - 1
+            buckets, n = np.unique(np.floor(np.log2(counts)).astype(np.int64), return_counts=True)
+            histogram.update(dict(zip(buckets.tolist(), n.tolist())))
+        self.buffer = []
+        return {"nodes": nodes, "mean": edges / nodes if nodes else 0, "max": max_degree,
+                "histogram": {(f"{1 << b}" if b == 0 else f"{1 << b}-{(1 << (b + 1)) - 1}"): histogram[b]
+                              for b in sorted(histogram)}}
+
+
+class LabelStats:
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.atoms = 0
+        self.bytes = collections.Counter()
+        self.properties = {}
+        self.degrees = None
+
+    def add_properties(self, properties, prefix=""):
+        atoms = 0
+        for k, v in properties.items():
+            if v is None or v == "":
+                continue
+            if isinstance(v, dict):
+                # the (<property> <record>) atom heading the keys
+                atoms += 1 + self.add_properties(v, f"{prefix}{k}.")
+                continue
+            stats = self.properties.get(prefix + k, None)
+            if stats is None:
+                stats = PropertyStats(self.p)
+                self.properties[prefix + k] = stats
+            stats.add(v)
+            atoms += 1
+        return atoms
+
+    def summary(self):
+        summary = {"count": self.count, "atoms": self.atoms, "bytes": dict(self.bytes),
+                   "properties": {k: v.summary() for k, v in self.properties.items()}}
+        if self.degrees is not None:
+            summary["degrees"] = {side: counter.summary() for side, counter in self.degrees.items()}
+        return summary
+
+
+def record_label(kind, record):
+    label = record[1] if kind == "nodes" else record[2]
+    if "." in label:
+        label = label.split(".")[1]
+    return label.replace(" ", "_").lower()
+
+
+class StatsCollector:
+    """
+    :param p: precision of the distinct count sketches, 2^p bytes per property
+    """
+
+    def __init__(self, output_path, p=12):
+        self.output_path = pathlib.Path(output_path)
+        self.p = p
+        self.labels = {"nodes": {}, "edges": {}}
+        self.tmp_dir = None
+
+    def label_stats(self, kind, label):
+        stats = self.labels[kind].get(label, None)
+        if stats is None:
+            stats = LabelStats(self.p)
+            if kind == "edges":
+                if self.tmp_dir is None:
+                    self.tmp_dir = pathlib.Path(tempfile.mkdtemp(prefix="stats_", dir=self.output_path))
+                stats.degrees = {side: DegreeCounter(self.tmp_dir / f"{len(self.labels[kind])}_{side}")
+                                 for side in ("out", "in")}
+            self.labels[kind][label] = stats
+        return stats
+
+    def observe(self, kind, records):
+        """
+        Pass through the (record, is_new) tuples of records, adding them to the statistics
+        """
+        for record, is_new in records:
+            stats = self.label_stats(kind, record_label(kind, record))
+            if is_new:
+                stats.count += 1
+                stats.atoms += 1
+                if kind == "edges":
+                    stats.degrees["out"].add(record[0])
+                    stats.degrees["in"].add(record[1])
+            stats.atoms += stats.add_properties(record[-1])
+            yield record, is_new
+
+    def add_bytes(self, format, kind, record, n):
+        self.label_stats(kind, record_label(kind, record)).bytes[format] += n
+
+    def close(self):
+        """
+        Write the statistics to <output>/stats.json
+        :return: the path of the file relative to the output directory
+        """
+        summary = {kind: {label: stats.summary() for label, stats in sorted(labels.items())}
+                   for kind, labels in self.labels.items() if labels}
+        with open(self.output_path / STATS_FILE, "w") as f:
+            json.dump(summary, f, indent=2)
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        return STATS_FILE
+
+
+class MeasuredStream:
+    """
+    Wraps a text output stream and adds the number of bytes written for every record to a StatsCollector
+    """
+
+    def __init__(self, stream, collector, format):
+        self.stream = stream
+        self.collector = collector
+        self.format = format
+        self.path = stream.path
+        self.kind = stream.kind
+
+    @property
+    def property_counts(self):
+        return self.stream.property_counts
+
+    @property
+    def record_paths(self):
+        return self.stream.record_paths
+
+    def tell(self):
+        return self.stream.tell()
+
+    def written(self):
+        # with a separate property layout the property atoms go to other files
+        return self.stream.tell() + sum(f.tell() for f in getattr(self.stream, "property_files", {}).values())
+
+    def write(self, record, is_new=True):
+        offset = self.written()
+        self.stream.write(record, is_new)
+        self.collector.add_bytes(self.format, self.kind, record, self.written() - offset)
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
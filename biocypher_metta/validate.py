@@ -0,0 +1,309 @@
+"""
+Syntax and type check of the MeTTa files of a build, to find malformed atoms before a multi-hour load
+
+    python -m biocypher_metta.validate --build-dir out [--workers 8]
+
+Every line of the .metta(.gz) files must hold one well formed atom: balanced parentheses, terminated strings, no
+dangling escape. Node and edge atoms are checked against the data constructors of type_defs.metta: the head has
+to be declared, with its number of arguments, and the endpoints of an edge have to be of the declared source and
+target type (or a subtype). The constructors are declared per input label, edges written with an output label
+(schema output_label) are checked against the constructors of its input labels. An atom whose head doesn't take
+its number of arguments is read as a property atom. Property atoms (<property> <node, edge or property> <value>)
+and record atoms (<label>_record <node or edge> <values>) are checked by their subject. Plain files are cut into
+chunks so a large file is checked by several workers. Errors are reported as <file>:<line>: <message>.
+"""
+import collections
+import gzip
+import multiprocessing
+import os
+import pathlib
+import re
+import typer
+import yaml
+from typing import Optional
+from typing_extensions import Annotated
+from biocypher._logger import logger
+
+TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|\(|\)|(?:[^\s()"\\]|\\.)+|\\$|"')
+# heads written without a data constructor: dataset atoms (--provenance dataset) and id dictionaries
+EXTRA_CONSTRUCTORS = {"dataset": [([None], "DATASET")], "original_id": [([None, None], "ORIGINAL_ID")]}
+# heads of the definitions in type_defs.metta
+DEFINITION_HEADS = {":", "<:", "="}
+
+
+def parse_atom(line):
+    """
+    Parse a line holding a single atom into nested lists of symbols
+    :raise ValueError: if the line isn't one well formed atom
+    """
+    stack = [[]]
+    for token in TOKEN_RE.findall(line):
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            if len(stack) == 1:
+                raise ValueError("unbalanced parentheses: unexpected )")
+            expr = stack.pop()
+            stack[-1].append(expr)
+        elif token == '"':
+            raise ValueError("unterminated string")
+        elif token == "\\":
+            raise ValueError("dangling escape at the end of the line")
+        else:
+            stack[-1].append(token)
+    if len(stack) > 1:
+        raise ValueError(f"unbalanced parentheses: {len(stack) - 1} ( not closed")
+    atoms = stack[0]
+    if len(atoms) != 1 or not isinstance(atoms[0], list):
+        raise ValueError(f"expected one expression per line, found {len(atoms)} atoms")
+    return atoms[0]
+
+
+def output_labels(schema_config):
+    """
+    :return: dict of edge output label -> the input labels written with it
+    """
+    with open(schema_config) as f:
+        schema = yaml.safe_load(f)
+
+    def name(s):
+        return s.replace(" ", "_").lower()
+
+    labels = collections.defaultdict(list)
+    for v in schema.values():
+        if not isinstance(v, dict) or v.get("represented_as", None) != "edge" or not v.get("output_label", None):
+            continue
+        input_label = v["input_label"][0] if isinstance(v["input_label"], list) else v["input_label"]
+        labels[name(v["output_label"])].append(name(input_label))
+    return dict(labels)
+
+
+def read_type_defs(path, output_labels=None):
+    """
+    :param output_labels: dict of edge output label -> input labels, see output_labels
+    :return: (dict of constructor -> list of (argument types, result type), dict of type -> parent types)
+    """
+    constructors = {k: list(v) for k, v in EXTRA_CONSTRUCTORS.items()}
+    parents = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            atom = parse_atom(line)
+            if atom[0] == ":" and len(atom) == 3 and isinstance(atom[2], list) and atom[2][:1] == ["->"]:
+                types = [t if isinstance(t, str) and not t.startswith("$") else None for t in atom[2][1:]]
+                constructors.setdefault(atom[1], []).append((types[:-1], types[-1]))
+            elif atom[0] == "<:" and len(atom) == 3:
+                parents.setdefault(atom[1], []).append(atom[2])
+    for output_label, input_labels in (output_labels or {}).items():
+        signatures = constructors.setdefault(output_label, [])
+        for label in input_labels:
+            signatures.extend(s for s in constructors.get(label, []) if s not in signatures)
+    return constructors, parents
+
+
+class AtomChecker:
+    def __init__(self, constructors, parents):
+        self.constructors = constructors
+        self.parents = parents
+
+    def is_subtype(self, type, expected):
+        seen = set()
+        todo = [type]
+        while todo:
+            t = todo.pop()
+            if t == expected:
+                return True
+            if t not in seen:
+                seen.add(t)
+                todo.extend(self.parents.get(t, []))
+        return False
+
+    def takes(self, head, n):
+        """
+        :return: whether head is a constructor of n arguments
+        """
+        return isinstance(head, str) and any(len(arg_types) == n for arg_types, _ in self.constructors.get(head, []))
+
+    def check_constructor(self, atom):
+        """
+        Check a node or edge atom against the signatures of its head
+        :return: its result type
+        """
+        head = atom[0]
+        if not isinstance(head, str) or head not in self.constructors:
+            raise ValueError(f"unknown label {render(head)}, not declared in type_defs.metta")
+        signatures = [s for s in self.constructors[head] if len(s[0]) == len(atom) - 1]
+        if len(signatures) == 0:
+            arities = " or ".join(str(n) for n in sorted(set(len(s[0]) for s in self.constructors[head])))
+            raise ValueError(f"{head} takes {arities} argument(s), got {len(atom) - 1}")
+        error = None
+        for arg_types, result in signatures:
+            try:
+                self.check_arguments(atom, arg_types)
+                return result
+            except ValueError as e:
+                error = error or e
+        raise error
+
+    def check_arguments(self, atom, arg_types):
+        head = atom[0]
+        for arg, expected in zip(atom[1:], arg_types):
+            if isinstance(arg, list):
+                type = self.check_constructor(arg)
+                if expected is not None and type is not None and not self.is_subtype(type, expected):
+                    raise ValueError(f"{head} expects {expected}, got {render(arg)} of type {type}")
+            elif expected is not None and len(arg_types) > 1:
+                raise ValueError(f"{head} expects a ({expected.lower()} <id>) argument, got {arg}")
+
+    def check_subject(self, atom):
+        # a node or edge, or (<property> <subject>) for the keys of dict properties
+        if not isinstance(atom, list) or len(atom) == 0:
+            raise ValueError(f"property subject {render(atom)} isn't a node or edge")
+        if self.takes(atom[0], len(atom) - 1):
+            self.check_constructor(atom)
+        elif len(atom) == 2 and isinstance(atom[1], list):
+            self.check_subject(atom[1])
+        else:
+            # neither a node or edge nor the key of a dict property: an unknown label or a wrong arity
+            self.check_constructor(atom)
+
+    def check(self, atom):
+        head = atom[0] if len(atom) > 0 else None
+        if not isinstance(head, str):
+            raise ValueError("the head of an atom must be a symbol")
+        if head in DEFINITION_HEADS:
+            return
+        # a property can share its name with a label of another arity, e.g. the dataset property of
+        # --provenance reference
+        if self.takes(head, len(atom) - 1):
+            self.check_constructor(atom)
+        elif head.endswith("_record") and len(atom) >= 2:
+            self.check_subject(atom[1])
+        elif len(atom) in (2, 3):
+            # (<property> <subject> <value>), or (<property> <subject>) heading the keys of a dict property
+            self.check_subject(atom[1])
+        elif head in self.constructors:
+            self.check_constructor(atom)
+        else:
+            raise ValueError(f"unknown label {head}, not declared in type_defs.metta")
+
+
+def render(atom):
+    if isinstance(atom, list):
+        return "(" + " ".join(render(a) for a in atom) + ")"
+    return str(atom)
+
+
+_checker = None
+
+
+def _init_worker(constructors, parents):
+    global _checker
+    _checker = AtomChecker(constructors, parents)
+
+
+def check_chunk(task):
+    """
+    Check the lines of a file, or of the byte range [start, end) of a plain file
+    :return: (path, number of lines, total errors, list of (line number in the chunk, message))
+    """
+    path, start, end, max_errors = task
+    if path.endswith(".gz"):
+        with gzip.open(path, "rt", errors="replace") as f:
+            return check_lines(path, f, max_errors)
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = data.decode("utf-8", errors="replace").split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return check_lines(path, lines, max_errors)
+
+
+def check_lines(path, lines, max_errors):
+    errors = []
+    total = 0
+    n = 0
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            _checker.check(parse_atom(line))
+        except ValueError as e:
+            total += 1
+            if len(errors) < max_errors:
+                errors.append((n - 1, str(e)))
+    return path, n, total, errors
+
+
+def chunks_of(path, chunk_bytes):
+    """
+    :return: list of (start, end) byte ranges of a plain file, cut at line ends
+    """
+    size = os.path.getsize(path)
+    if path.endswith(".gz") or size <= chunk_bytes:
+        return [(0, size)]
+    bounds = [0]
+    with open(path, "rb") as f:
+        while bounds[-1] + chunk_bytes < size:
+            f.seek(bounds[-1] + chunk_bytes)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def validate_build(build_dir, schema_config=None, workers=None, chunk_bytes=64 << 20, max_errors=100):
+    """
+    :param schema_config: schema of the build, to check the edges written with an output label
+    :return: (number of errors, list of (file, line, message) of the first max_errors errors of every file)
+    """
+    build_dir = pathlib.Path(build_dir)
+    constructors, parents = read_type_defs(build_dir / "type_defs.metta",
+                                           output_labels(schema_config) if schema_config is not None else None)
+    files = sorted(str(p) for p in build_dir.rglob("*") if p.is_file() and (p.name.endswith(".metta") or
+                                                                         p.name.endswith(".metta.gz")))
+    tasks = [(path, start, end, max_errors) for path in files for start, end in chunks_of(path, chunk_bytes)]
+    logger.info(f"Validating {len(files)} files in {len(tasks)} chunks")
+    # line offset of the current chunk in its file
+    offsets = {}
+    reported = {}
+    errors = []
+    total = 0
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(constructors, parents)) as pool:
+        for path, lines, n, chunk_errors in pool.imap(check_chunk, tasks):
+            offset = offsets.get(path, 0)
+            total += n
+            for i, message in chunk_errors:
+                if reported.get(path, 0) < max_errors:
+                    reported[path] = reported.get(path, 0) + 1
+                    errors.append((os.path.relpath(path, build_dir), offset + i + 1, message))
+            offsets[path] = offset + lines
+    return total, errors
+
+
+app = typer.Typer()
+
+
+@app.command()
+def main(build_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=False, dir_okay=True)],
+         schema_config: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=True, dir_okay=False)]
+         = pathlib.Path("config/schema_config.yaml"),
+         workers: Optional[int] = typer.Option(None, help="Number of worker processes, by default one per core"),
+         max_errors: int = typer.Option(100, help="Errors to report per file")):
+    total, errors = validate_build(build_dir, schema_config, workers=workers, max_errors=max_errors)
+    for path, line, message in errors:
+        print(f"{path}:{line}: {message}")
+    if total > 0:
+        logger.error(f"{total} malformed atoms")
+        raise typer.Exit(code=1)
+    logger.info("No errors found")
+
+
+if __name__ == "__main__":
+    app()
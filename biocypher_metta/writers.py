@@ -0,0 +1,40 @@
+from biocypher import BioCypher
+from biocypher_metta.metta_writer import MeTTaWriter
+from biocypher_metta.metta_stream_writer import MeTTaStreamWriter
+from biocypher_metta.prolog_writer import PrologWriter
+from biocypher_metta.parquet_writer import ParquetWriter
+from biocypher_metta.neo4j_csv_writer import Neo4jCSVWriter
+from biocypher_metta.multi_writer import MultiWriter
+
+WRITERS = {"metta": MeTTaWriter, "prolog": PrologWriter, "parquet": ParquetWriter, "neo4j": Neo4jCSVWriter,
+           "metta_stream": MeTTaStreamWriter}
+
+
+def create_writer(output_formats, schema_config, biocypher_config, output_dir, format_args=None, **pipeline_args):
+    """
+    Create the writer for the given output format(s). For more than one format the writers share one
+    BioCypher instance and are driven by a MultiWriter, so every adapter only runs once.
+    :param output_formats: list of keys of WRITERS
+    :param format_args: dict of output format -> extra constructor arguments of that writer
+    :param pipeline_args: record pipeline options (dedup_policy, ...) applied once before serialization
+    """
+    format_args = format_args or {}
+    for fmt in output_formats:
+        if fmt not in WRITERS:
+            raise ValueError(f"Unknown output format {fmt}. Allowed values: {', '.join(WRITERS)}")
+
+    output_formats = list(dict.fromkeys(output_formats))
+    if len(output_formats) == 1:
+        return WRITERS[output_formats[0]](schema_config=schema_config,
+                                          biocypher_config=biocypher_config,
+                                          output_dir=output_dir, **format_args.get(output_formats[0], {}),
+                                          **pipeline_args)
+
+    # load the schema once and run every adapter once, each writer only serializes the records
+    bcy = BioCypher(schema_config_path=schema_config,
+                    biocypher_config_path=biocypher_config)
+    writers = [WRITERS[fmt](schema_config=schema_config,
+                            biocypher_config=biocypher_config,
+                            output_dir=output_dir, bcy=bcy, **format_args.get(fmt, {}))
+               for fmt in output_formats]
+    return MultiWriter(writers, **pipeline_args)
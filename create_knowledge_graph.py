@@ -1,9 +1,11 @@
 """
 Knowledge graph generation through BioCypher script
 """
-from biocypher_metta.metta_writer import *
+from biocypher_metta.writers import WRITERS, create_writer
 from biocypher._logger import logger
+import pathlib
 import typer
+from typing import List, Optional
 import yaml
 import importlib #for reflection
 from typing_extensions import Annotated
@@ -18,7 +20,51 @@ def main(output_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay
          dbsnp_rsids: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=True, dir_okay=False)],
          dbsnp_pos: Annotated[pathlib.Path, typer.Option(exists=True, file_okay=True, dir_okay=False)],
          write_properties: bool = typer.Option(True, help="Write properties to nodes and edges"),
-         add_provenance: bool = typer.Option(True, help="Add provenance to nodes and edges")):
+         add_provenance: bool = typer.Option(True, help="Add provenance to nodes and edges"),
+         dedup: bool = typer.Option(False, help="Write each (label, id) node only once across all adapters"),
+         dedup_policy: str = typer.Option("first", help="How to handle properties of duplicate nodes: "
+                                                         "first (keep the first occurrence) or merge (union of all occurrences)"),
+         dedup_memory: int = typer.Option(1024, help="Memory budget (MB) of the dedup seen-set before it spills to disk"),
+         output_format: List[str] = typer.Option(["metta"], help="Output format(s) to write in a single adapter pass. "
+                                                                  f"Repeat the option for several formats: {', '.join(WRITERS)}"),
+         record_atoms: bool = typer.Option(False, help="MeTTa output: write one positional record atom per node/edge "
+                                                        "instead of one atom per property"),
+         id_format: Optional[str] = typer.Option(None, help="Replace entity IDs by compact symbols (int or base62) "
+                                                             "and write the mapping to an id_dictionary file"),
+         provenance: str = typer.Option("record", help="Where to write provenance: record (source properties on every "
+                                                       "node and edge), dataset (one dataset atom per adapter entry "
+                                                       "next to its output files) or reference (dataset atoms and a "
+                                                       "dataset property on every node and edge)"),
+         neo4j_compress: bool = typer.Option(False, help="neo4j output: gzip the data csv files"),
+         stream_address: str = typer.Option("unix:/tmp/metta_stream.sock",
+                                            help="metta_stream output: address of the loader, unix:<socket path>, "
+                                                 "tcp:<host>:<port> or fifo:<named pipe>"),
+         block_compress: bool = typer.Option(False, help="MeTTa/Prolog output: write block compressed (BGZF) files "
+                                                         "with a block index for random access"),
+         property_layout: str = typer.Option("inline", help="MeTTa/Prolog output: write property atoms next to their "
+                                                            "node/edge atom (inline), to a separate file (separate) "
+                                                            "or to one file per property (per_property)"),
+         partition_by_chr: bool = typer.Option(False, help="Write nodes and edges to one directory per chromosome "
+                                                           "(from their chr property) below the adapter output directory"),
+         sort: bool = typer.Option(False, help="Sort the nodes and edges of every adapter by (chr, start), "
+                                               "records without a chr by their (source) ID"),
+         sort_memory: int = typer.Option(1024, help="Memory budget (MB) of the sort before it spills runs to disk"),
+         shard_size: Optional[int] = typer.Option(None, help="Cut the output of every adapter (and chromosome "
+                                                              "partition) into shards of at most this many records"),
+         interval_index: bool = typer.Option(False, help="Write a memory-mappable chr/start/end interval index of "
+                                                         "the positional nodes of every adapter and label"),
+         offset_index: bool = typer.Option(False, help="Write an entity ID -> file and byte range index of the "
+                                                       "MeTTa/Prolog output files"),
+         inverse_edges: Optional[str] = typer.Option(None, help="Derive the inverse of edges with an inverse relation "
+                                                                "in the schema: emit (write both directions) or rule "
+                                                                "(MeTTa/Prolog: write an inverse rule). Adapter entries "
+                                                                "writing the inverse of an earlier entry are skipped"),
+         aggregate_memory: int = typer.Option(1024, help="Memory budget (MB) of the edge aggregation of the adapter "
+                                                         "entries with an aggregate setting before it spills to disk"),
+         stats: bool = typer.Option(False, help="Write statistics of the build (counts, distinct values, numeric "
+                                                "ranges, edge degrees per label and property) to stats.json"),
+         bloom_fpr: Optional[float] = typer.Option(None, help="Write a bloom filter of the entity IDs of every output "
+                                                              "file (<file>.bloom) with this false positive rate")):
     """
     Main function. Call individual adapters to download and process data. Build
     via BioCypher from node and edge data.
@@ -31,9 +77,33 @@ def main(output_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay
     dbsnp_pos_dict = pickle.load(open(dbsnp_pos, 'rb'))
 
 
-    bc = MeTTaWriter(schema_config="config/schema_config.yaml",
-                     biocypher_config="config/biocypher_config.yaml",
-                     output_dir=output_dir)
+    try:
+        bc = create_writer(output_format,
+                           schema_config="config/schema_config.yaml",
+                           biocypher_config="config/biocypher_config.yaml",
+                           output_dir=output_dir,
+                           format_args={"metta": {"record_mode": record_atoms, "block_compress": block_compress,
+                                                  "property_layout": property_layout},
+                                        "prolog": {"block_compress": block_compress,
+                                                   "property_layout": property_layout},
+                                        "neo4j": {"compress": neo4j_compress},
+                                        "metta_stream": {"record_mode": record_atoms, "address": stream_address}},
+                           dedup_policy=dedup_policy if dedup else None,
+                           dedup_memory_mb=dedup_memory,
+                           id_format=id_format,
+                           provenance=provenance,
+                           partition_by_chr=partition_by_chr,
+                           sort_records=sort,
+                           sort_memory_mb=sort_memory,
+                           shard_size=shard_size,
+                           interval_index=interval_index,
+                           offset_index=offset_index,
+                           inverse_edges=inverse_edges,
+                           aggregate_memory_mb=aggregate_memory,
+                           stats=stats,
+                           bloom_fpr=bloom_fpr)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
 
     # bc.show_ontology_structure()
 
@@ -46,9 +116,18 @@ def main(output_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay
             logger.error(f"Error while trying to load adapter config")
             logger.error(e)
 
+    # edge labels written by the entries run so far
+    edge_labels = set()
     for c in adapters_dict:
-        logger.info(f"Running adapter: {c}")
         adapter_config = adapters_dict[c]["adapter"]
+        label = adapter_config["args"].get("label", None)
+        if inverse_edges is not None and adapters_dict[c]["edges"] and not adapters_dict[c]["nodes"] \
+                and bc.edge_inverses.get(label, None) in edge_labels:
+            logger.info(f"Skipping adapter: {c}, its {label} edges are derived from {bc.edge_inverses[label]}")
+            continue
+        if adapters_dict[c]["edges"] and label is not None:
+            edge_labels.add(label)
+        logger.info(f"Running adapter: {c}")
         adapter_module = importlib.import_module(adapter_config["module"])
         adapter_cls = getattr(adapter_module, adapter_config["cls"])
         ctr_args = adapter_config["args"]
@@ -57,20 +136,42 @@ def main(output_dir: Annotated[pathlib.Path, typer.Option(exists=True, file_okay
         if "dbsnp_pos_map" in ctr_args:
             ctr_args["dbsnp_pos_map"] = dbsnp_pos_dict
         ctr_args["write_properties"] = write_properties
-        ctr_args["add_provenance"] = add_provenance
+        # with dataset level provenance the adapters don't need to add it to every record
+        ctr_args["add_provenance"] = add_provenance and provenance == "record"
         adapter = adapter_cls(**ctr_args)
+        # properties: [..] (include list) or properties: {include: [..], exclude: [..]}
+        projection = adapters_dict[c].get("properties", None)
+        if projection is not None:
+            if isinstance(projection, list):
+                projection = {"include": projection}
+            adapter.set_property_projection(include=projection.get("include", None),
+                                            exclude=projection.get("exclude", None))
         write_nodes = adapters_dict[c]["nodes"]
         write_edges = adapters_dict[c]["edges"]
         outdir = adapters_dict[c]["outdir"]
+        # aggregate: true, aggregate: <sort|hash> or aggregate: {method: <sort|hash>, distinct: <bool>}
+        aggregate = adapters_dict[c].get("aggregate", None)
+        if aggregate is True:
+            aggregate = {}
+        elif aggregate is False:
+            aggregate = None
+        elif isinstance(aggregate, str):
+            aggregate = {"method": aggregate}
+        bc.start_dataset(c, adapter if add_provenance and write_properties else None, path_prefix=outdir)
 
         if write_nodes:
             nodes = adapter.get_nodes()
+            if projection is not None:
+                nodes = adapter.project(nodes)
             bc.write_nodes(nodes, path_prefix=outdir)
 
         if write_edges:
             edges = adapter.get_edges()
-            bc.write_edges(edges, path_prefix=outdir)
+            if projection is not None:
+                edges = adapter.project(edges)
+            bc.write_edges(edges, path_prefix=outdir, aggregate=aggregate)
 
+    bc.close()
 
     logger.info("Done")
 
@@ -2,11 +2,16 @@ from hyperon import *
 import typer
 from typing_extensions import Annotated
 import pathlib
+import gzip
 import os
 import time
 import datetime
 import resource
 import logging
+import json
+import re
+import multiprocessing
+from typing import Optional
 
 app = typer.Typer()
 
@@ -32,6 +37,52 @@ def memory_usage(point=""):
                 usage[2]/1024.0 )
 
 
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def rss_mb():
+    """
+    Current resident memory, unlike ru_maxrss (a high-water mark) it grows by what a load keeps. Falls back to
+    max_rss_mb without /proc.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return max_rss_mb()
+
+
+class Calibration:
+    """
+    Records the atoms, bytes, load time and resident memory growth of every loaded file, the samples
+    python -m biocypher_metta.planner predicts the memory and load time of a build from
+    """
+
+    def __init__(self, input_dir):
+        self.input_dir = input_dir
+        self.baseline_mb = rss_mb()
+        self.files = []
+
+    def measure(self, path, load):
+        atoms = 0
+        size = 0
+        with (gzip.open(path, "rb") if path.suffix == ".gz" else open(path, "rb")) as f:
+            for line in f:
+                size += len(line)
+                if line.strip():
+                    atoms += 1
+        before = rss_mb()
+        start = time.time()
+        load()
+        self.files.append({"path": str(path.relative_to(self.input_dir)), "atoms": atoms, "bytes": size,
+                           "seconds": time.time() - start, "memory_mb": rss_mb() - before})
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump({"baseline_mb": self.baseline_mb, "files": self.files}, f, indent=2)
+
+
 def setup_logger(logger_name, log_file, level=logging.INFO):
     logger = logging.getLogger(logger_name)
     formatter = logging.Formatter('%(asctime)s - %(name)s : %(message)s')
@@ -46,11 +97,200 @@ def setup_logger(logger_name, log_file, level=logging.INFO):
 
     return logger
 
+
+def run_batches(metta, lines, batch_size=10000):
+    """
+    Run lines of MeTTa in batches of batch_size lines, so a large file is never held in memory as a whole
+    """
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            metta.run("\n".join(batch))
+            batch = []
+    if batch:
+        metta.run("\n".join(batch))
+
+
+def apply_delta(metta, delta_dir, logger, batch_size=10000):
+    """
+    Apply a delta written by biocypher_metta.delta: remove the atoms under remove/ from the space, then load add/
+    """
+    for path in sorted((delta_dir / "remove").rglob("*.metta")):
+        logger.info(f"Removing the atoms of {path} ...")
+        with open(path) as f:
+            run_batches(metta, (f"!(remove-atom &self {line.strip()})" for line in f), batch_size)
+    for path in sorted((delta_dir / "add").rglob("*.metta")):
+        full_path = str(path.resolve())
+        logger.info(f"Loading {full_path} ...")
+        metta.import_file(full_path)
+
+
+# sample queries run once the space is loaded
+QUERIES = [
+    # get properties of (gene ENSG00000290825)
+    '''
+            !(match &self ($x (gene ENSG00000290825) $y) ($x (gene ENSG00000290825) $y))
+    ''',
+    # find genes on chr16 b/n base numbers 53MB and 56MB
+    '''
+            !(match &self (, (chr $g "chr16")
+                            (start $g $start)
+                            (end $g $end))
+                    (if (and (> $start 53000000) (< $end 56000000)) $g ()))
+    ''',
+]
+# the same queries on a build written with --record-atoms, through the record accessors in the type definitions
+RECORD_QUERIES = [
+    '''
+            !(match &self (gene ENSG00000290825)
+                    ((chr (gene ENSG00000290825)) (start (gene ENSG00000290825)) (end (gene ENSG00000290825))))
+    ''',
+    '''
+            !(match &self (gene $g)
+                    (if (and (== (chr (gene $g)) "chr16")
+                             (and (> (start (gene $g)) 53000000) (< (end (gene $g)) 56000000))) (gene $g) ()))
+    ''',
+]
+GROUP_BY = ["file", "dir", "chr", "label"]
+
+
+def queries_for(type_def_path):
+    """
+    :return: the sample queries for the layout of the build, RECORD_QUERIES if the type definitions hold record
+    accessors
+    """
+    with open(type_def_path) as f:
+        return RECORD_QUERIES if any("_record " in line for line in f) else QUERIES
+
+
+def metta_files(input_dir, type_def_path):
+    """
+    The MeTTa files below input_dir, plain and block compressed (--block-compress), without the type definitions
+    """
+    type_defs = type_def_path.resolve()
+    paths = list(input_dir.rglob("*.metta")) + list(input_dir.rglob("*.metta.gz"))
+    return [path for path in paths if path.resolve() != type_defs]
+
+
+def load_file(metta, path, batch_size=10000):
+    if path.suffix == ".gz":
+        # one atom per line, streamed in batches rather than decompressed into a single string
+        with gzip.open(path, "rt") as f:
+            run_batches(metta, (atom for atom in map(str.strip, f) if atom), batch_size)
+    else:
+        metta.import_file(str(path.resolve()))
+
+
+def group_of(input_dir, path, group_by):
+    """
+    :return: the group of a file: its top level output directory (dir), its chromosome partition (chr, see
+    --partition-by-chr) or the label of its first atom (label)
+    """
+    parts = path.relative_to(input_dir).parts
+    if group_by == "dir":
+        return parts[0] if len(parts) > 1 else "."
+    if group_by == "chr":
+        return next((p for p in parts[:-1] if re.match(r"^(chr\w+|no_chr)$", p)), "no_chr")
+    if group_by == "label":
+        with (gzip.open(path, "rt") if path.suffix == ".gz" else open(path)) as f:
+            for line in f:
+                m = re.match(r"^\((\S+)", line.strip())
+                if m:
+                    return m.group(1)
+        return ""
+    return str(path)
+
+
+def text_size(path):
+    """
+    :return: uncompressed size of a MeTTa file, from the block index (<file>.gzi) of block compressed files
+    """
+    if path.suffix != ".gz":
+        return path.stat().st_size
+    index_path = pathlib.Path(f"{path}.gzi")
+    if index_path.exists():
+        # the last entry is the end-of-file block at the uncompressed size
+        with open(index_path, "rb") as f:
+            f.seek(-8, os.SEEK_END)
+            return int.from_bytes(f.read(8), "little")
+    with gzip.open(path, "rb") as f:
+        return sum(len(chunk) for chunk in iter(lambda: f.read(1 << 20), b""))
+
+
+def assign_spaces(input_dir, paths, group_by, spaces):
+    """
+    Assign the groups of files to spaces, largest group first to the space with the fewest uncompressed bytes so far
+    :return: list of the file lists of the spaces
+    """
+    groups = {}
+    for path in paths:
+        groups.setdefault(group_of(input_dir, path, group_by), []).append(path)
+    sizes = {path: text_size(path) for path in paths}
+    loads = [0] * spaces
+    assigned = [[] for _ in range(spaces)]
+    for files in sorted(groups.values(), key=lambda files: -sum(sizes[p] for p in files)):
+        i = loads.index(min(loads))
+        assigned[i].extend(files)
+        loads[i] += sum(sizes[p] for p in files)
+    return [files for files in assigned if files]
+
+
+def load_space(task):
+    """
+    Load the files of one space in a worker process of its own and run the queries on it
+    :return: dict of the load time and peak memory per file and of the space, and the query results
+    """
+    index, type_def_path, files, queries = task
+    start = time.time()
+    metta = MeTTa(env_builder=Environment.test_env())
+    metta.import_file(str(type_def_path.resolve()))
+    loaded = []
+    for path in files:
+        file_start = time.time()
+        load_file(metta, path)
+        loaded.append({"path": str(path), "seconds": time.time() - file_start, "memory_mb": max_rss_mb()})
+    seconds = time.time() - start
+    results = [str(metta.run(query)) for query in queries]
+    return {"space": index, "files": loaded, "seconds": seconds, "memory_mb": max_rss_mb(), "results": results}
+
+
+def load_parallel(input_dir, type_def_path, spaces, group_by, logger):
+    assigned = assign_spaces(input_dir, metta_files(input_dir, type_def_path), group_by, spaces)
+    logger.info(f"Loading {sum(len(files) for files in assigned)} files into {len(assigned)} spaces "
+                f"grouped by {group_by}")
+    start = time.time()
+    # a fresh process per space, so the peak memory (ru_maxrss) of a worker is the one of its space
+    with multiprocessing.Pool(len(assigned), maxtasksperchild=1) as pool:
+        queries = queries_for(type_def_path)
+        tasks = [(i, type_def_path, files, queries) for i, files in enumerate(assigned)]
+        for result in pool.imap_unordered(load_space, tasks):
+            for file in result["files"]:
+                logger.debug(f"[space {result['space']}] {file['path']}: {file['seconds']:.1f} s, "
+                             f"peak memory {file['memory_mb']:.1f} mb")
+            logger.info(f"[space {result['space']}] loaded {len(result['files'])} files in "
+                        f"{datetime.timedelta(seconds=result['seconds'])}, peak memory {result['memory_mb']:.1f} mb")
+            for query, answer in zip(queries, result["results"]):
+                logger.info(f"[space {result['space']}] {query.strip()}: {answer}")
+    logger.info(f"Loaded all spaces in {datetime.timedelta(seconds=time.time() - start)}")
+
+
 @app.command()
 def load_metta_space(input_dir: Annotated[pathlib.Path,
                         typer.Option(exists=True, file_okay=False, dir_okay=True)],
                      type_def_path: Annotated[pathlib.Path,
                         typer.Option(exists=True, file_okay=True, dir_okay=False)],
+                     delta_dir: Annotated[Optional[pathlib.Path],
+                        typer.Option(exists=True, file_okay=False, dir_okay=True,
+                                     help="Delta of biocypher_metta.delta to apply after loading input_dir")] = None,
+                     calibration_file: Annotated[Optional[pathlib.Path],
+                        typer.Option(file_okay=True, dir_okay=False,
+                                     help="Write the atoms, load time and memory of every loaded file to this "
+                                          "json file, for python -m biocypher_metta.planner")] = None,
+                     spaces: Annotated[int, typer.Option(help="Load the files into this many spaces in parallel "
+                                                              "processes, the sample queries run on every space")] = 1,
+                     group_by: Annotated[str, typer.Option(help="With several spaces, keep the files of a group in "
+                                                                "one space: " + ", ".join(GROUP_BY))] = "dir",
                      log = None):
 
     if log and os.path.exists(log):
@@ -58,39 +298,40 @@ def load_metta_space(input_dir: Annotated[pathlib.Path,
 
     logger = setup_logger('metta_space_import', log, logging.DEBUG)
 
+    if spaces > 1:
+        if group_by not in GROUP_BY:
+            raise typer.BadParameter(f"--group-by must be one of {', '.join(GROUP_BY)}")
+        if delta_dir is not None or calibration_file is not None:
+            raise typer.BadParameter("--delta-dir and --calibration-file need a single space")
+        load_parallel(input_dir, type_def_path, spaces, group_by, logger)
+        return
+
     with Timer("Loading MeTTa space...", logger_name="metta_space_import"):
         metta = MeTTa(env_builder=Environment.test_env())
         logger.info(f"Loading type definitions ...")
         metta.import_file(str(type_def_path.resolve()))
         logger.debug(memory_usage("After loading type definitions"))
-        for path in input_dir.rglob("*.metta"):
-            full_path = str(path.resolve())
-            logger.info(f"Loading {full_path} ...")
-            metta.import_file(full_path)
-            logger.debug(memory_usage(f"After loading {full_path}"))
-
-        # get properties of (gene ENSG00000290825)
-        prog1 = '''
-            !(match &self ($x (gene ENSG00000290825) $y) ($x (gene ENSG00000290825) $y))
-        '''
-        with Timer(f"Executing query : {prog1}", logger_name="metta_space_import"):
-            logger.info(metta.run(prog1))
-
-        logger.debug(memory_usage("After executing query"))
-
-        # find genes on chr16 b/n base numbers 53MB and 56MB
-        prog2 = '''
-            !(match &self (, (chr $g "chr16")
-                            (start $g $start)
-                            (end $g $end))
-                    (if (and (> $start 53000000) (< $end 56000000)) $g ()))
-        '''
+        calibration = Calibration(input_dir) if calibration_file is not None else None
 
-        with Timer(f"Executing query : {prog2}", logger_name="metta_space_import"):
-            logger.info(metta.run(prog2))
+        for path in metta_files(input_dir, type_def_path):
+            logger.info(f"Loading {path.resolve()} ...")
+            if calibration is not None:
+                calibration.measure(path, lambda: load_file(metta, path))
+            else:
+                load_file(metta, path)
+            logger.debug(memory_usage(f"After loading {path.resolve()}"))
+        if calibration is not None:
+            calibration.write(calibration_file)
+            logger.info(f"Wrote load calibration of {len(calibration.files)} files to {calibration_file}")
+        if delta_dir is not None:
+            apply_delta(metta, delta_dir, logger)
+            logger.debug(memory_usage("After applying the delta"))
 
-        logger.debug(memory_usage("After executing query"))
+        for query in queries_for(type_def_path):
+            with Timer(f"Executing query : {query}", logger_name="metta_space_import"):
+                logger.info(metta.run(query))
 
+            logger.debug(memory_usage("After executing query"))
 
 if __name__ == "__main__":
     app()
\ No newline at end of file
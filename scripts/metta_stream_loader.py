@@ -0,0 +1,94 @@
+from hyperon import *
+import typer
+from typing import Optional
+from typing_extensions import Annotated
+import pathlib
+import os
+import socket
+import logging
+
+app = typer.Typer()
+
+
+def read_batches(reader, writer=None):
+    """
+    Read the batches sent by biocypher_metta.metta_stream_writer.AtomConnection. Yields the atoms of every
+    batch; over a socket writer is set and each batch is acknowledged once the caller asks for the next one.
+    """
+    while True:
+        header = reader.readline().decode().strip()
+        if header == "END" or header == "":
+            return
+        command, size = header.split(" ")
+        if command != "ATOMS":
+            raise ValueError(f"Unexpected message {header}")
+        payload = reader.read(int(size))
+        yield payload.decode()
+        if writer is not None:
+            writer.write(b"ACK\n")
+            writer.flush()
+
+
+@app.command()
+def load_metta_stream(listen: Annotated[str, typer.Option(help="unix:<socket path>, tcp:<host>:<port> "
+                                                               "or fifo:<named pipe>")] = "unix:/tmp/metta_stream.sock",
+                      query_file: Annotated[Optional[pathlib.Path],
+                        typer.Option(exists=True, file_okay=True, dir_okay=False,
+                                     help="MeTTa program to run once the stream is loaded")] = None):
+    """
+    Load the atoms streamed by create_knowledge_graph.py --output-format metta_stream into a MeTTa space as they
+    arrive. Start the loader first, then the build.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s : %(message)s')
+    logger = logging.getLogger("metta_stream_loader")
+    metta = MeTTa(env_builder=Environment.test_env())
+
+    conn = None
+    if listen.startswith("fifo:"):
+        path = listen[len("fifo:"):]
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        logger.info(f"Waiting for the build on {path} ...")
+        reader, writer = open(path, "rb"), None
+    else:
+        if listen.startswith("tcp:"):
+            host, _, port = listen[len("tcp:"):].rpartition(":")
+            server = socket.create_server((host, int(port)))
+        else:
+            path = listen[len("unix:"):] if listen.startswith("unix:") else listen
+            if os.path.exists(path):
+                os.remove(path)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+            server.listen(1)
+        logger.info(f"Waiting for the build on {listen} ...")
+        conn, _ = server.accept()
+        server.close()
+        reader, writer = conn.makefile("rb"), conn.makefile("wb")
+
+    batches = 0
+    try:
+        for atoms in read_batches(reader, writer):
+            try:
+                metta.run(atoms)
+            except Exception as e:
+                if writer is not None:
+                    writer.write(f"ERR {e}\n".encode())
+                    writer.flush()
+                raise
+            batches += 1
+            if batches % 100 == 0:
+                logger.info(f"Loaded {batches} batches")
+    finally:
+        reader.close()
+        if conn is not None:
+            writer.close()
+            conn.close()
+    logger.info(f"Loaded {batches} batches")
+
+    if query_file is not None:
+        logger.info(metta.run(query_file.read_text()))
+
+
+if __name__ == "__main__":
+    app()
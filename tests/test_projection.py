@@ -0,0 +1,90 @@
+import pytest
+from biocypher_metta.adapters import PROVENANCE_PROPERTIES, Adapter
+
+PROPERTIES = {
+    "chr": "chr1",
+    "annotation": {"cadd_phred": 12.5, "af": 0.01, "freq": {"gnomad": 0.02}},
+    "source": "dbSNP",
+    "source_url": "https://www.ncbi.nlm.nih.gov/snp/",
+}
+
+
+def adapter(include=None, exclude=None, write_properties=True):
+    adapter = Adapter(write_properties, add_provenance=True)
+    adapter.set_property_projection(include, exclude)
+    return adapter
+
+
+def test_no_projection_keeps_everything():
+    a = adapter()
+    assert all(a.needs_property(name) for name in ["chr", "annotation", "annotation.cadd_phred", "source"])
+    assert a.project_properties(PROPERTIES) == PROPERTIES
+
+
+def test_include_nested_property():
+    a = adapter(include=["annotation.cadd_phred"])
+    # the parent holds an included property, its other children and the top level properties are dropped
+    assert a.needs_property("annotation")
+    assert a.needs_property("annotation.cadd_phred")
+    assert not a.needs_property("annotation.af")
+    assert not a.needs_property("annotation.freq.gnomad")
+    assert not a.needs_property("chr")
+    assert a.project_properties(PROPERTIES) == {"annotation": {"cadd_phred": 12.5}, "source": "dbSNP",
+                                                "source_url": "https://www.ncbi.nlm.nih.gov/snp/"}
+
+
+def test_include_parent_keeps_children():
+    a = adapter(include=["annotation"])
+    assert a.needs_property("annotation.freq.gnomad")
+    assert a.project_properties(PROPERTIES)["annotation"] == PROPERTIES["annotation"]
+
+
+@pytest.mark.parametrize("include", [["annotation.cadd_phred"], ["chr"], []])
+def test_provenance_survives_include(include):
+    a = adapter(include=include)
+    projected = a.project_properties(PROPERTIES)
+    for name in PROVENANCE_PROPERTIES:
+        assert a.needs_property(name)
+        assert projected[name] == PROPERTIES[name]
+
+
+def test_exclude_parent_drops_children():
+    a = adapter(exclude=["annotation"])
+    assert not a.needs_property("annotation")
+    assert not a.needs_property("annotation.cadd_phred")
+    assert a.needs_property("chr")
+    assert a.project_properties(PROPERTIES) == {k: v for k, v in PROPERTIES.items() if k != "annotation"}
+
+
+def test_exclude_nested_property():
+    a = adapter(exclude=["annotation.freq"])
+    assert a.needs_property("annotation")
+    assert not a.needs_property("annotation.freq.gnomad")
+    assert a.project_properties(PROPERTIES)["annotation"] == {"cadd_phred": 12.5, "af": 0.01}
+
+
+def test_exclude_wins_over_include():
+    a = adapter(include=["annotation.cadd_phred"], exclude=["annotation"])
+    assert not a.needs_property("annotation.cadd_phred")
+    assert "annotation" not in a.project_properties(PROPERTIES)
+
+
+def test_provenance_excluded_explicitly():
+    a = adapter(include=["chr"], exclude=["source_url"])
+    assert a.project_properties(PROPERTIES) == {"chr": "chr1", "source": "dbSNP"}
+
+
+def test_write_properties_off():
+    a = adapter(write_properties=False)
+    assert not a.needs_property("chr")
+    assert not a.needs_property("source")
+    assert a.project_properties(PROPERTIES) == {}
+
+
+def test_project_records():
+    a = adapter(include=["chr"])
+    nodes = [("rs1", "snp", PROPERTIES)]
+    edges = [("e1", "rs1", "ENSG1", "eqtl", {"chr": "chr1", "p_value": 0.1})]
+    assert list(a.project(nodes)) == [("rs1", "snp", {"chr": "chr1", "source": "dbSNP",
+                                                      "source_url": "https://www.ncbi.nlm.nih.gov/snp/"})]
+    assert list(a.project(edges)) == [("e1", "rs1", "ENSG1", "eqtl", {"chr": "chr1"})]
@@ -0,0 +1,98 @@
+import random
+import numpy as np
+import pytest
+from biocypher_metta.adapters.helpers import (_MAX_POSITION, VARIANT_KEY_HASHED, VARIANT_KEY_TAG_SHIFT,
+                                              decode_variant_keys, encode_variant_ids, pack_variant_id,
+                                              unpack_variant_id)
+
+IDS = [
+    "1_12_A_C_GRCh38",
+    "chr1_12_A_C_GRCh38",
+    "x_100_G_T_GRCh38",
+    "chrm_7_T_A_GRCh38",
+    "22_5_a_c_GRCh38",
+    "chr22_5_acgt_a_GRCh38",
+    "1_5_ACGT_ACGT_GRCh38",
+    "1_0_A_C_GRCh38",
+    f"1_{_MAX_POSITION}_A_C_GRCh38",
+    # not packed: mixed case, too long, out of range, leading zero, unknown chromosome or assembly
+    "1_5_a_C_GRCh38",
+    "1_5_ACGTA_C_GRCh38",
+    f"1_{_MAX_POSITION + 1}_A_C_GRCh38",
+    "1_012_A_C_GRCh38",
+    "1_-5_A_C_GRCh38",
+    "23_5_A_C_GRCh38",
+    "chr_5_A_C_GRCh38",
+    "1_5_A_C_GRCh37",
+    "1_5_A_N_GRCh38",
+    # non-ASCII
+    "1_5_Ä_C_GRCh38",
+    "1_5_A_C_GRCh38é",
+    # wrong number of underscores
+    "1_12_A_C",
+    "1_12_A_C_GRCh38_x",
+    "1__12_A_C_GRCh38",
+    "____",
+    "",
+    "ENSG00000290825",
+]
+
+
+def random_ids(n, seed=0):
+    rng = random.Random(seed)
+
+    def allele():
+        return "".join(rng.choice("ACGT") for _ in range(rng.randint(1, 4)))
+
+    ids = []
+    for _ in range(n):
+        chr = rng.choice(["1", "7", "22", "x", "chrx", "chr1", "m", "chrY", "MT"])
+        ref, alt = allele(), allele()
+        if rng.random() < 0.1:
+            ref, alt = ref.lower(), alt.lower()
+        ids.append(f"{chr}_{rng.randint(0, _MAX_POSITION + 10)}_{ref}_{alt}_GRCh38")
+    return ids
+
+
+@pytest.mark.parametrize("ids", [IDS, random_ids(5000)])
+def test_encode_matches_pack_variant_id(ids):
+    keys, packed = encode_variant_ids(ids)
+    for id, key, is_packed in zip(ids, keys.tolist(), packed.tolist()):
+        expected = pack_variant_id(id)
+        assert is_packed == (expected is not None), id
+        assert key == (expected if expected is not None else 0), id
+
+
+@pytest.mark.parametrize("ids", [IDS, random_ids(5000)])
+def test_decode_round_trip(ids):
+    keys, packed = encode_variant_ids(ids)
+    decoded = decode_variant_keys(keys[packed])
+    assert decoded == [id for id, is_packed in zip(ids, packed) if is_packed]
+    assert decoded == [unpack_variant_id(int(key)) for key in keys[packed]]
+
+
+def test_encode_bytes_like_str():
+    ascii_ids = [id for id in IDS if id.isascii()]
+    keys, packed = encode_variant_ids(ascii_ids)
+    byte_keys, byte_packed = encode_variant_ids(np.array([id.encode() for id in ascii_ids]))
+    assert np.array_equal(keys, byte_keys) and np.array_equal(packed, byte_packed)
+
+
+def test_edge_cases():
+    keys, packed = encode_variant_ids(["1_0_A_C_GRCh38", f"1_{_MAX_POSITION}_A_C_GRCh38", "1_5_Ä_C_GRCh38",
+                                       "1_12_A_C_GRCh38_x"])
+    assert packed.tolist() == [True, True, False, False]
+    assert decode_variant_keys(keys[:2]) == ["1_0_A_C_GRCh38", f"1_{_MAX_POSITION}_A_C_GRCh38"]
+
+
+def test_empty_and_hashed_keys():
+    keys, packed = encode_variant_ids([])
+    assert len(keys) == 0 and len(packed) == 0
+    assert decode_variant_keys(np.array([], dtype=np.uint64)) == []
+    assert decode_variant_keys(np.array([0, VARIANT_KEY_HASHED | 12345], dtype=np.uint64)) == [None, None]
+
+
+def test_tag_is_ignored():
+    key = pack_variant_id("chr7_5_acg_t_GRCh38") | (3 << VARIANT_KEY_TAG_SHIFT)
+    assert unpack_variant_id(key) == "chr7_5_acg_t_GRCh38"
+    assert decode_variant_keys(np.array([key], dtype=np.uint64)) == ["chr7_5_acg_t_GRCh38"]